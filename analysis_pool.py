@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 分析进程池
+下载线程只负责取回响应体，解析和检测交给独立进程执行，不再受GIL限制；
+等待分析的页面数量有上限，分析跟不上时下载线程自动等待（背压）
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from rule_pack import load_cached_rule_pack
+from page_analyzer import analyze_body
+from cloaking import analyze_variant
+
+# 分析进程内的规则包（按版本号缓存，最多保留两个版本）
+_worker_rules = {}
+_worker_cache_dir = None
+
+def _init_worker(rules, cache_dir):
+    """分析进程初始化：载入创建进程池时的规则包"""
+    global _worker_cache_dir
+    _worker_cache_dir = cache_dir
+    _worker_rules[rules.version] = rules
+
+def _worker_analyze(content, encoding, rule_version, options, base=None):
+    """在分析进程中执行；规则热更新后按版本号从磁盘缓存加载新规则包"""
+    rules = _worker_rules.get(rule_version)
+    if rules is None:
+        rules = load_cached_rule_pack(rule_version, _worker_cache_dir)
+        if rules is None:
+            raise LookupError(f'规则包 {rule_version} 不在缓存中')
+        if len(_worker_rules) >= 2:
+            _worker_rules.pop(next(iter(_worker_rules)))
+        _worker_rules[rule_version] = rules
+    return _analyze(content, rules, encoding, options, base)
+
+def _analyze(content, rules, encoding, options, base):
+    """base不为空时先与基准页面比较（见cloaking.analyze_variant）"""
+    if base is None:
+        return analyze_body(content, rules, encoding=encoding, **options)
+    return analyze_variant(content, base, rules, encoding=encoding, **options)
+
+class AnalysisPool:
+    """页面分析进程池，进程池不可用时回退到调用线程内分析"""
+    
+    def __init__(self, rules, cache_dir=None, max_processes=0, queue_size=0, **options):
+        self.processes = max_processes or os.cpu_count() or 1
+        self.queue_size = queue_size or self.processes * 2
+        self.options = options  # 传给analyze_body的解析选项（parser、profile、verdict_threshold等）
+        self.broken = False
+        self.stats = {'submitted': 0, 'completed': 0, 'fallback': 0, 'max_pending': 0}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                             initargs=(rules, cache_dir))
+    
+    def submit(self, content, rules, stop_event=None, encoding=None, base=None):
+        """提交一个响应体，队列已满时阻塞等待；停止或进程池不可用时返回None"""
+        if self.broken:
+            return None
+        while not self._slots.acquire(timeout=0.2):
+            if stop_event is not None and stop_event.is_set():
+                return None
+        
+        try:
+            future = self._executor.submit(_worker_analyze, content, encoding, rules.version, self.options, base)
+        except (BrokenProcessPool, RuntimeError):
+            self.broken = True
+            self._slots.release()
+            return None
+        
+        with self._lock:
+            self._pending += 1
+            self.stats['submitted'] += 1
+            self.stats['max_pending'] = max(self.stats['max_pending'], self._pending)
+        future.add_done_callback(self._on_done)
+        return future
+    
+    def _on_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.stats['completed'] += 1
+        self._slots.release()
+    
+    def analyze_local(self, content, rules, encoding=None, base=None):
+        """在当前线程内分析"""
+        return _analyze(content, rules, encoding, self.options, base)
+    
+    def result(self, future, content, rules, encoding=None, base=None):
+        """取回分析结果；未提交成功或分析进程异常时在当前线程内重新分析"""
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self.broken = True
+            except LookupError:
+                pass  # 分析进程读不到新规则包
+        with self._lock:
+            self.stats['fallback'] += 1
+        return self.analyze_local(content, rules, encoding, base)
+    
+    @property
+    def pending(self):
+        """等待分析的页面数"""
+        return self._pending
+    
+    def shutdown(self, cancel=False):
+        """关闭进程池"""
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+def _simulate_batch(pages, rules, io_threads, io_delay, pool=None):
+    """模拟批量检测：每个下载线程等待io_delay秒后交给分析，返回页/秒"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def worker(content):
+        time.sleep(io_delay)
+        if pool is None:
+            return analyze_body(content, rules)
+        return pool.result(pool.submit(content, rules), content, rules)
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        list(executor.map(worker, pages))
+    return len(pages) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    # 吞吐量对比：下载线程内分析 vs 分析进程池
+    import tempfile
+    import shutil
+    from rule_pack import load_rule_pack
+    from html_parsers import SAMPLE_PAGES
+    
+    cache_dir = tempfile.mkdtemp()
+    try:
+        rules = load_rule_pack(cache_dir=cache_dir)
+        page = SAMPLE_PAGES['gambling'].replace(
+            '</body>', ''.join(f'<div class="item"><a href="/p/{i}">产品{i}</a><p>介绍{i}</p></div>'
+                               for i in range(2000)) + '</body>')
+        pages = [page.encode('utf-8')] * 120
+        
+        threaded = _simulate_batch(pages, rules, io_threads=20, io_delay=0.05)
+        pool = AnalysisPool(rules, cache_dir)
+        try:
+            pooled = _simulate_batch(pages, rules, io_threads=20, io_delay=0.05, pool=pool)
+        finally:
+            pool.shutdown()
+        
+        print(f"页面数: {len(pages)}, 下载线程: 20, 分析进程: {pool.processes}, 队列上限: {pool.queue_size}")
+        print(f"线程内分析: {threaded:.1f} 页/秒")
+        print(f"进程池分析: {pooled:.1f} 页/秒 (最大排队 {pool.stats['max_pending']}, 回退 {pool.stats['fallback']})")
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 异步下载引擎
+基于asyncio + aiohttp，在少量系统线程上维持数千个并发请求，
+按主机限制连接数并复用连接；返回结果与KSiteTool.fetch_page一致
+未安装aiohttp时不可用，批量检测自动回退到线程池引擎
+"""
+
+import sys
+import time
+import socket
+import asyncio
+from urllib.parse import urljoin
+from page_body import BodyBuffer, CHUNK_SIZE, charset_from_content_type
+from fetch_validators import response_validators
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# 与requests会话的重试策略保持一致
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+RETRY_BACKOFF = 0.3
+
+REDIRECT_STATUS = frozenset([301, 302, 303, 307, 308])
+
+def is_available():
+    """当前环境是否可以使用异步引擎"""
+    return aiohttp is not None
+
+class _CachedResolver:
+    """aiohttp解析器：优先使用已解析的地址，没有时交给aiohttp默认的解析器"""
+    
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self.fallback = aiohttp.DefaultResolver()
+    
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        known = [(address_family, ip) for address_family, ip in self.addresses(host) or ()
+                 if family in (socket.AF_UNSPEC, address_family)]
+        if not known:
+            return await self.fallback.resolve(host, port, family)
+        return [{'hostname': host, 'host': ip, 'port': port, 'family': address_family, 'proto': 0,
+                 'flags': socket.AI_NUMERICHOST} for address_family, ip in known]
+    
+    async def close(self):
+        await self.fallback.close()
+
+class AsyncFetcher:
+    """异步页面下载器（需在事件循环内创建和使用）
+    
+    observer(耗时, 结果)在每次请求结束时调用，结果为ok、timeout或overload（429/5xx），供并发控制器使用；
+    addresses(主机)返回已解析的地址[(family, ip)]时建立连接不再解析
+    """
+    
+    def __init__(self, max_connections=500, per_host_limit=4, connect_timeout=5, read_timeout=8,
+                 max_retries=2, max_redirects=20, max_body_bytes=0, observer=None, addresses=None):
+        self.max_retries = max_retries
+        self.max_redirects = max_redirects
+        self.max_body_bytes = max_body_bytes
+        self.observer = observer
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0}
+        # 连接器负责总连接数和单主机连接数上限，并复用keep-alive连接
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections, limit_per_host=per_host_limit,
+                                           ttl_dns_cache=300,
+                                           resolver=_CachedResolver(addresses) if addresses else None),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+        )
+    
+    async def _get(self, url, headers, allow_redirects=True):
+        """带重试的GET请求（连接错误和429/5xx按指数退避重试）
+        
+        返回(状态码, 最终URL, BodyBuffer, 响应头)，状态码>=400或不跟随的重定向不读取响应体
+        """
+        attempt = 0
+        while True:
+            self.stats['requests'] += 1
+            started = time.monotonic()
+            try:
+                async with self.session.get(url, headers=headers, allow_redirects=allow_redirects,
+                                            max_redirects=self.max_redirects) as response:
+                    status = response.status
+                    if status not in RETRY_STATUS or attempt >= self.max_retries:
+                        if status >= 400:
+                            self._observe(started, status)
+                            return status, None, None, None
+                        if not allow_redirects and status in REDIRECT_STATUS and 'Location' in response.headers:
+                            self._observe(started, status)
+                            return status, str(response.url), None, response.headers
+                        # 流式读取，超过上限的部分直接丢弃，边读边计算哈希
+                        body = BodyBuffer(self.max_body_bytes)
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            if not body.feed(chunk):
+                                break
+                        self._observe(started, status)
+                        return status, str(response.url), body, response.headers
+                    self._observe(started, status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self._observe(started, timeout=True)
+                if attempt >= self.max_retries:
+                    raise
+            
+            self.stats['retries'] += 1
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+    
+    def _observe(self, started, status=None, timeout=False):
+        if self.observer is None:
+            return
+        if timeout:
+            outcome = 'timeout'
+        else:
+            outcome = 'overload' if status in RETRY_STATUS else 'ok'
+        self.observer(time.monotonic() - started, outcome)
+    
+    async def fetch(self, url, headers, stop_event=None, allow_redirects=True):
+        """下载页面，结果字段与KSiteTool.fetch_page相同
+        
+        allow_redirects为假时只请求这一跳，重定向返回{'url', 'status_code', 'location'}（location为绝对URL）
+        """
+        if stop_event is not None and stop_event.is_set():
+            return {'url': url, 'status': 'stopped'}
+        
+        try:
+            status, final_url, body, response_headers = await self._get(url, headers, allow_redirects)
+            
+            # 快速检查响应状态
+            if status >= 400:
+                return {
+                    'url': url,
+                    'status_code': status,
+                    'error': f'HTTP {status}',
+                    'status': 'error'
+                }
+            if body is None:
+                return {'url': url, 'status_code': status,
+                        'location': urljoin(final_url, response_headers['Location'])}
+            
+            return {
+                'url': url,
+                'status_code': status,
+                'final_url': final_url,
+                'content': body.content,
+                'content_hash': body.content_hash,
+                'encoding': charset_from_content_type(response_headers.get('Content-Type')),
+                'truncated': body.truncated,
+                'validators': response_validators(response_headers)
+            }
+        
+        except Exception as e:
+            self.stats['errors'] += 1
+            return {
+                'url': url,
+                'error': str(e) or type(e).__name__,
+                'status': 'error'
+            }
+    
+    async def close(self):
+        await self.session.close()
+
+def _serve_fixture(pages, delay=0.05):
+    """本地测试HTTP服务器（asyncio实现，支持keep-alive），返回(端口, 停止函数)
+    
+    监听所有本机地址，Linux下可用127.0.0.x的不同地址模拟多个主机
+    """
+    import threading
+    
+    started = threading.Event()
+    state = {}
+    
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                path = request_line.split()[1].decode('latin-1') if len(request_line.split()) > 1 else '/'
+                body = pages.get(path.split('?')[0])
+                await asyncio.sleep(delay)
+                if body is None:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                else:
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                                 b'Content-Length: %d\r\n\r\n' % len(body) + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    def run():
+        loop = asyncio.new_event_loop()
+        state['loop'] = loop
+        server = loop.run_until_complete(asyncio.start_server(handle, '0.0.0.0', 0, backlog=4096))
+        state['port'] = server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+        server.close()
+    
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return state['port'], lambda: state['loop'].call_soon_threadsafe(state['loop'].stop)
+
+def _peak_rss_mb():
+    """当前进程的峰值内存（MB），无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return None
+
+def _bench_threads(urls, workers):
+    """线程池引擎：共享requests会话，每个线程同时只有一个请求"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from concurrent.futures import ThreadPoolExecutor
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    
+    def fetch(url):
+        try:
+            return session.get(url, timeout=(5, 30)).status_code
+        except requests.RequestException:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(1 for status in executor.map(fetch, urls) if status == 200)
+
+async def _bench_async(urls, concurrency, per_host_limit):
+    """异步引擎：全部请求由一个事件循环调度"""
+    fetcher = AsyncFetcher(max_connections=concurrency, per_host_limit=per_host_limit, read_timeout=30)
+    limit = asyncio.Semaphore(concurrency)
+    
+    async def fetch(url):
+        async with limit:
+            return await fetcher.fetch(url, {})
+    
+    try:
+        results = await asyncio.gather(*(fetch(url) for url in urls))
+    finally:
+        await fetcher.close()
+    return sum(1 for result in results if result.get('status_code') == 200)
+
+if __name__ == "__main__":
+    # 基准测试：线程池引擎 vs 异步引擎（每种引擎在独立子进程中运行，分别统计峰值内存）
+    import argparse
+    import subprocess
+    
+    parser = argparse.ArgumentParser(description='下载引擎基准测试')
+    parser.add_argument('--engine', choices=['threads', 'async'])
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--domains', type=int, default=2000)
+    parser.add_argument('--hosts', type=int, default=50, help='模拟的主机数（127.0.0.x）')
+    parser.add_argument('--delay', type=float, default=0.05, help='服务器响应延迟（秒）')
+    parser.add_argument('--workers', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    args = parser.parse_args()
+    
+    if args.engine:
+        hosts = args.hosts if sys.platform.startswith('linux') else 1
+        urls = [f'http://127.0.0.{i % hosts + 1}:{args.port}/?d={i}' for i in range(args.domains)]
+        start = time.perf_counter()
+        if args.engine == 'threads':
+            ok = _bench_threads(urls, args.workers)
+        else:
+            ok = asyncio.run(_bench_async(urls, args.concurrency, max(1, args.concurrency // hosts)))
+        elapsed = time.perf_counter() - start
+        rss = _peak_rss_mb()
+        line = f"{args.engine:>8}: {len(urls) / elapsed:8.1f} 域名/秒  成功 {ok}/{len(urls)}"
+        if rss is not None:
+            line += f"  峰值内存 {rss:.1f} MB"
+        print(line)
+        sys.exit(0)
+    
+    if not is_available():
+        print("未安装aiohttp，无法测试异步引擎")
+        sys.exit(1)
+    
+    page = ('<html><head><title>测试</title></head><body>'
+            + '<p>正常内容</p>' * 500 + '</body></html>').encode('utf-8')
+    port, stop = _serve_fixture({'/': page}, delay=args.delay)
+    print(f"域名数: {args.domains}, 主机数: {args.hosts}, 响应延迟: {args.delay * 1000:.0f} ms, 页面: {len(page)} 字节")
+    try:
+        for engine in ('threads', 'async'):
+            subprocess.run([sys.executable, __file__, '--engine', engine, '--port', str(port),
+                            '--domains', str(args.domains), '--hosts', str(args.hosts),
+                            '--workers', str(args.workers), '--concurrency', str(args.concurrency)])
+    finally:
+        stop()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 批量检测断点续检
+每次批量检测分配一个持久的运行ID，站点列表和每个站点的完成状态记录在SQLite中；
+检测被停止或程序被关闭后，可跳过已完成的站点，只重新检测未完成（包括中断时正在检测）的站点
+"""
+
+import json
+import sqlite3
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+class BatchJournal:
+    """批量检测运行日志（batch_runs、batch_run_sites表），写入统一交给数据库写入线程"""
+    
+    def __init__(self, db_path, db_writer, chunk_size=5000):
+        self.db_path = db_path
+        self.db_writer = db_writer
+        self.chunk_size = chunk_size
+        conn = sqlite3.connect(db_path)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS batch_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT DEFAULT 'running',
+                settings TEXT,
+                total INTEGER DEFAULT 0,
+                started_at DATETIME,
+                finished_at DATETIME
+            );
+            CREATE TABLE IF NOT EXISTS batch_run_sites (
+                run_id INTEGER,
+                position INTEGER,
+                domain TEXT,
+                keywords TEXT,
+                done INTEGER DEFAULT 0,
+                PRIMARY KEY (run_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_run_sites_domain ON batch_run_sites (run_id, domain);
+        ''')
+        conn.close()
+    
+    def create_run(self, sites, settings=None):
+        """记录一次新的批量检测，返回JournaledSites（按检测取出的进度分块记录站点，属性run_id为运行ID）"""
+        run_id = self.db_writer.call(self._insert_run, json.dumps(settings or {}, ensure_ascii=False))
+        if hasattr(sites, '__len__'):
+            return SizedJournaledSites(self, run_id, sites)
+        return JournaledSites(self, run_id, sites)
+    
+    def _insert_run(self, conn, settings):
+        return conn.execute('INSERT INTO batch_runs (settings, started_at) VALUES (?, ?)',
+                            (settings, datetime.now())).lastrowid
+    
+    def _insert_sites(self, conn, run_id, rows, total):
+        conn.executemany('INSERT INTO batch_run_sites (run_id, position, domain, keywords) VALUES (?, ?, ?, ?)',
+                         rows)
+        conn.execute('UPDATE batch_runs SET total = ? WHERE id = ?', (total, run_id))
+    
+    def mark_done(self, run_id, position):
+        """站点检测完成（没有检测结果需要保存的站点，例如出错的站点）；position为JournalSite.position"""
+        self.db_writer.submit(self.mark_done_in, run_id, position)
+    
+    def mark_done_in(self, conn, run_id, position):
+        """在写入线程中执行：与站点的检测结果在同一个写入任务中调用，两者总在同一个事务中提交
+        
+        按位置（主键）标记，列表中重复出现的域名各自记录完成状态
+        """
+        conn.execute('UPDATE batch_run_sites SET done = 1 WHERE run_id = ? AND position = ?', (run_id, position))
+    
+    def finish_run(self, run_id, status):
+        """结束一次运行：completed（全部完成）、stopped（被停止，可续检）或abandoned（放弃续检）"""
+        self.db_writer.submit(self._finish_run, run_id, status)
+        self.db_writer.flush()
+    
+    def _finish_run(self, conn, run_id, status):
+        conn.execute('UPDATE batch_runs SET status = ?, finished_at = ? WHERE id = ?',
+                     (status, datetime.now(), run_id))
+    
+    def reopen_run(self, run_id):
+        """续检开始时把运行重新标记为进行中"""
+        self.db_writer.call(self._finish_run, run_id, 'running')
+    
+    def pending_sites(self, run_id, page_size=1000):
+        """按原顺序逐个产出未完成的站点（JournalSite）
+        
+        按位置分页读取，每页读完即结束读事务，长时间检测时不妨碍WAL检查点
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            position = -1
+            while True:
+                rows = conn.execute('''
+                    SELECT position, domain, keywords FROM batch_run_sites
+                    WHERE run_id = ? AND position > ? AND done = 0
+                    ORDER BY position LIMIT ?
+                ''', (run_id, position, page_size)).fetchall()
+                if not rows:
+                    break
+                position = rows[-1][0]
+                for site_position, domain, keywords in rows:
+                    yield JournalSite(domain, keywords, site_position)
+        finally:
+            conn.close()
+    
+    def progress(self, run_id):
+        """运行信息及已完成的站点数，运行不存在时返回None"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute('''
+                SELECT id, status, settings, total, started_at, finished_at,
+                       (SELECT COUNT(*) FROM batch_run_sites WHERE run_id = batch_runs.id AND done = 1)
+                FROM batch_runs WHERE id = ?
+            ''', (run_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'settings': json.loads(row[2] or '{}'),
+            'total': row[3],
+            'started_at': row[4],
+            'finished_at': row[5],
+            'done': row[6],
+            'remaining': row[3] - row[6]
+        }
+    
+    def last_unfinished(self):
+        """最近一次未完成（被停止或程序中途退出）且仍有站点未检测的运行，没有时返回None"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT id FROM batch_runs WHERE status IN ('running', 'stopped') "
+                               "ORDER BY id DESC LIMIT 1").fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        run = self.progress(row[0])
+        return run if run['remaining'] > 0 else None
+
+class JournalSite(tuple):
+    """运行中的一个站点：与普通站点一样解包为(域名, 关键词)，position为它在运行中的位置"""
+    
+    def __new__(cls, domain, keywords, position):
+        site = super().__new__(cls, (domain, keywords))
+        site.position = position
+        return site
+
+class JournaledSites:
+    """新运行的站点迭代器：从站点列表中按块取出，整块交给写入线程记录后再逐个产出
+    
+    站点列表只遍历一次（可以是生成器）；站点的日志记录总在它的检测结果之前提交。
+    检测被停止时调用record_rest()把尚未取出的站点也记入日志，续检时继续检测
+    """
+    
+    def __init__(self, journal, run_id, sites):
+        self.journal = journal
+        self.run_id = run_id
+        self.total = 0
+        self._sites = iter(sites)
+        self._buffer = deque()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self._buffer:
+            self._buffer.extend(self._record_chunk())
+            if not self._buffer:
+                raise StopIteration
+        return self._buffer.popleft()
+    
+    def _record_chunk(self):
+        chunk = [JournalSite(domain, keywords, self.total + offset) for offset, (domain, keywords)
+                 in enumerate(islice(self._sites, self.journal.chunk_size))]
+        if chunk:
+            rows = [(self.run_id, site.position, site[0], site[1]) for site in chunk]
+            self.total += len(chunk)
+            self.journal.db_writer.submit(self.journal._insert_sites, self.run_id, rows, self.total)
+        return chunk
+    
+    def record_rest(self):
+        """把站点列表中剩余的站点记入日志（不检测）"""
+        while self._record_chunk():
+            pass
+
+class SizedJournaledSites(JournaledSites):
+    """站点列表有长度时（列表、元组等），len()为站点总数，进度回调可以显示总数"""
+    
+    def __init__(self, journal, run_id, sites):
+        super().__init__(journal, run_id, sites)
+        self._length = len(sites)
+    
+    def __len__(self):
+        return self._length
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 蜘蛛伪装（cloaking）对比
+普通UA与爬虫UA两次访问的结果按代价从低到高比较：
+响应体哈希相同 -> 标记片段差异在阈值内 -> 才对爬虫页面做完整分析并逐项对比
+"""
+
+import re
+from collections import Counter
+from page_body import decode_body
+from page_analyzer import analyze_body
+
+# 变化片段中出现这些标签或属性时，必须完整分析（可能是跳转、暗链或TDK差异）
+_SENSITIVE_SEGMENT_RE = re.compile(rb'^/?\s*(script|iframe|object|embed|title|meta|style)\b|\bstyle\s*=',
+                                   re.IGNORECASE)
+
+def markup_segments(content):
+    """按"<"切分原始响应体，每个片段为一个标签及其后的文本（不需要解码）"""
+    return Counter(content.split(b'<'))
+
+def segment_diff(content, base_content):
+    """比较两个响应体，返回(差异比例, 变化的片段列表)；比例0为完全相同，1为完全不同"""
+    a = markup_segments(content)
+    b = markup_segments(base_content)
+    added = a - b
+    removed = b - a
+    total = sum(a.values()) + sum(b.values())
+    changed = sum(added.values()) + sum(removed.values())
+    return (changed / total if total else 0.0), list(added) + list(removed)
+
+def analyze_variant(content, base, rules, encoding=None, **options):
+    """与基准页面比较，只有差异可能影响结论时才完整分析（可在分析进程中执行）
+    
+    base为{'content': 基准响应体, 'max_distance': 差异比例阈值}。
+    差异比例不超过阈值、变化片段中没有违规关键词且不涉及脚本/隐藏样式/TDK时视为相同页面，
+    返回{'distance': 差异比例, 'analysis': 分析结果（视为相同时为None）}
+    """
+    distance, changed = segment_diff(content, base['content'])
+    if distance <= base.get('max_distance', 0.02):
+        if not any(_SENSITIVE_SEGMENT_RE.search(segment) for segment in changed):
+            changed_text = decode_body(b'<'.join(changed), encoding, options.get('sample_size', 64 * 1024))
+            if not rules.matcher.matched_keywords(changed_text.lower()):
+                return {'distance': round(distance, 4), 'analysis': None}
+    return {'distance': round(distance, 4), 'analysis': analyze_body(content, rules, encoding=encoding, **options)}
+
+def compare_checks(normal_check, spider_check):
+    """逐项对比两次检测结果，返回cloaking结论"""
+    if 'error' in normal_check or 'error' in spider_check:
+        return {
+            'verdict': 'unavailable',
+            'method': 'analysis',
+            'normal_status': normal_check.get('status_code'),
+            'spider_status': spider_check.get('status_code')
+        }
+    
+    normal_violations = normal_check.get('violations', [])
+    spider_violations = spider_check.get('violations', [])
+    spider_only = [keyword for keyword in spider_violations if keyword not in normal_violations]
+    normal_only = [keyword for keyword in normal_violations if keyword not in spider_violations]
+    title_changed = normal_check.get('title') != spider_check.get('title')
+    final_url_changed = normal_check.get('final_url') != spider_check.get('final_url')
+    # 只对普通用户生效的JS跳转
+    user_only_redirects = bool(normal_check.get('js_redirects')) and not spider_check.get('js_redirects')
+    
+    cloaked = bool(spider_only or normal_only or user_only_redirects or
+                   (title_changed and (normal_check.get('tdk_issues') or spider_check.get('tdk_issues'))))
+    return {
+        'verdict': 'cloaked' if cloaked else 'different',
+        'method': 'analysis',
+        'spider_only_violations': spider_only,
+        'normal_only_violations': normal_only,
+        'title_changed': title_changed,
+        'final_url_changed': final_url_changed,
+        'user_only_redirects': user_only_redirects,
+        'hidden_links_delta': len(spider_check.get('hidden_links', [])) - len(normal_check.get('hidden_links', []))
+    }
+
+if __name__ == "__main__":
+    # 测试代码：样例页面的片段差异，以及比较与完整分析的耗时对比
+    import time
+    from html_parsers import SAMPLE_PAGES
+    from rule_pack import load_rule_pack
+    
+    base = SAMPLE_PAGES['gambling'].replace(
+        '</body>', ''.join(f'<div class="item"><a href="/p/{i}">产品{i}</a><p>介绍{i}</p></div>'
+                           for i in range(3000)) + '</body>')
+    variants = {
+        '相同页面': base,
+        '动态时间戳': base.replace('</body>', '<!-- generated 2026-01-01 12:00:00 --></body>'),
+        '替换部分文字': base.replace('产品17<', '博彩17<').replace('产品18<', '六合彩18<'),
+        '正常企业页': SAMPLE_PAGES['clean'],
+    }
+    rules = load_rule_pack()
+    base_option = {'content': base.encode('utf-8'), 'max_distance': 0.02}
+    for name, html in variants.items():
+        variant = analyze_variant(html.encode('utf-8'), base_option, rules)
+        action = '跳过分析' if variant['analysis'] is None else '完整分析'
+        print(f"{name}: 差异 {variant['distance']:.4f}, {action}")
+    
+    content = variants['动态时间戳'].encode('utf-8')
+    start = time.perf_counter()
+    analyze_variant(content, base_option, rules)
+    compare_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    analyze_body(content, rules)
+    analyze_ms = (time.perf_counter() - start) * 1000
+    print(f"片段比较: {compare_ms:.1f} ms, 完整分析: {analyze_ms:.1f} ms ({len(content)} 字节)")
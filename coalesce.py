@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 请求合并
+批量检测中大量域名301到同一个落地页时，每一跳按(规范化URL, UA类型)合并：
+同一请求正在进行时其他站点等待并共享结果，完成后在ttl秒内也直接使用；
+响应体相同的页面按(响应体哈希, 规则包版本, 对比基准)只分析一次。
+线程引擎和异步引擎共用（结果是concurrent.futures.Future，异步引擎用asyncio.wrap_future等待）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    """合并用的URL：协议和主机小写，去掉默认端口、用户信息和片段，空路径补为/"""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+class Abandoned(LookupError):
+    """领头的任务被取消、没有结果，等待者需要自行执行"""
+
+class SingleFlight:
+    """按键合并相同的任务（线程安全）
+    
+    lead(key)返回(Future, 是否领头)：领头者执行任务后finish(key, 结果)，出错时fail(key, 异常)，
+    被取消时abandon(key)；其他调用者等待同一个Future。finish时keep为真的结果保留ttl秒
+    """
+    
+    def __init__(self, ttl=0, max_entries=256, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.stats = {'leaders': 0, 'shared': 0}
+        self._flights = {}  # 键 -> 进行中的Future
+        self._done = OrderedDict()  # 键 -> (过期时间, 已完成的Future)
+        self._lock = threading.Lock()
+    
+    def lead(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is None and key in self._done:
+                expires, kept = self._done[key]
+                if expires > self.clock():
+                    future = kept
+                else:
+                    del self._done[key]
+            if future is not None:
+                self.stats['shared'] += 1
+                return future, False
+            future = self._flights[key] = Future()
+            self.stats['leaders'] += 1
+            return future, True
+    
+    def finish(self, key, result, keep=True):
+        with self._lock:
+            future = self._flights.pop(key)
+            if keep and self.ttl > 0:
+                self._done[key] = (self.clock() + self.ttl, future)
+                self._done.move_to_end(key)
+                while len(self._done) > self.max_entries:
+                    self._done.popitem(last=False)
+        future.set_result(result)
+    
+    def fail(self, key, error):
+        with self._lock:
+            future = self._flights.pop(key)
+        future.set_exception(error)
+    
+    def abandon(self, key):
+        self.fail(key, Abandoned('合并的请求已取消'))
+    
+    def clear(self):
+        """丢弃保留的结果（进行中的任务不受影响）"""
+        with self._lock:
+            self._done.clear()
+
+class RequestCoalescer:
+    """批量检测的下载合并和分析合并"""
+    
+    def __init__(self, ttl=60, max_entries=256):
+        self.fetches = SingleFlight(ttl, max_entries)  # (规范化URL, UA类型, 条件请求头) -> 一跳的下载结果
+        self.analyses = SingleFlight(ttl, max_entries)  # (响应体哈希, 规则包版本, 基准哈希) -> 分析结果
+    
+    def clear(self):
+        self.fetches.clear()
+        self.analyses.clear()
+    
+    def summary(self):
+        """状态栏显示的合并次数"""
+        return f"合并下载 {self.fetches.stats['shared']} 次，合并分析 {self.analyses.stats['shared']} 次"
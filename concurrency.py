@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 自适应并发控制
+批量检测同时进行的站点数按AIMD（加性增、乘性减）自动调整，不再需要手动选择线程数：
+启动阶段每个周期翻倍，直到第一次出现拥塞信号；之后每个周期增加step；
+超时率、429/5xx比例超过阈值或延迟中位数明显高于空载延迟时乘以decrease；
+并发没有用满（站点列表或礼貌调度限制了派发）时保持不变
+"""
+
+import time
+import threading
+
+def percentile(values, fraction):
+    """已排序列表的分位数，列表为空时返回None"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class AimdController:
+    """按请求延迟、超时率和错误率调整并发上限（线程安全）
+    
+    下载完成时record(耗时, 结果)，结果为ok、timeout或overload（429/5xx）；
+    批量检测循环用limit作为同时进行的站点数上限，并用in_flight()报告实际并发
+    """
+    
+    def __init__(self, initial=8, min_limit=2, max_limit=100, step=2, decrease=0.7, interval=2.0, min_samples=10,
+                 timeout_threshold=0.05, overload_threshold=0.1, latency_factor=2.0, clock=time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = max(min_limit, min(initial, self.max_limit))
+        self.step = step
+        self.decrease = decrease
+        self.interval = interval  # 调整周期（秒）
+        self.min_samples = min_samples  # 每个周期至少需要的样本数
+        self.timeout_threshold = timeout_threshold
+        self.overload_threshold = overload_threshold
+        self.latency_factor = latency_factor
+        self.clock = clock
+        self.slow_start = True
+        self.baseline = None  # 空载延迟（各周期延迟中位数的最小值）
+        self.reason = '启动'
+        self.metrics = {}
+        self.stats = {'increases': 0, 'decreases': 0}
+        self._samples = []
+        self._peak_in_flight = 0
+        self._window_start = clock()
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+    
+    def record(self, latency, outcome):
+        """记录一次请求的耗时（秒）和结果"""
+        now = self.clock()
+        with self._lock:
+            # 上次减小并发之前发出的请求反映的是旧并发下的情况
+            if now - latency < self._last_decrease:
+                return
+            self._samples.append((latency, outcome))
+            if len(self._samples) >= self.min_samples and now - self._window_start >= self.interval:
+                self._adjust(now)
+    
+    def in_flight(self, count):
+        """批量检测循环报告当前同时进行的站点数"""
+        if count > self._peak_in_flight:
+            self._peak_in_flight = count
+    
+    def _adjust(self, now):
+        samples = self._samples
+        latencies = sorted(latency for latency, outcome in samples if outcome == 'ok')
+        timeout_rate = sum(outcome == 'timeout' for _, outcome in samples) / len(samples)
+        overload_rate = sum(outcome == 'overload' for _, outcome in samples) / len(samples)
+        p50, p90 = percentile(latencies, 0.5), percentile(latencies, 0.9)
+        if p50 is not None:
+            # 取最小值作为空载延迟，每个周期允许上浮5%；已降到下限时测得的就是空载延迟，
+            # 目标站点整体变慢时基准随之调整，不会一直减小
+            if self.baseline is None or self.limit <= self.min_limit:
+                self.baseline = p50
+            else:
+                self.baseline = min(p50, self.baseline * 1.05)
+        
+        if timeout_rate > self.timeout_threshold:
+            self._decrease(now, f'超时率 {timeout_rate:.0%}，减小')
+        elif overload_rate > self.overload_threshold:
+            self._decrease(now, f'429/5xx {overload_rate:.0%}，减小')
+        elif p50 is not None and p50 > self.latency_factor * self.baseline:
+            self._decrease(now, f'延迟 {p50:.2f}s 超过空载 {self.baseline:.2f}s 的{self.latency_factor:g}倍，减小')
+        elif self._peak_in_flight < self.limit - max(1, self.limit // 10):
+            self.reason = '并发未用满，保持'
+        elif self.limit >= self.max_limit:
+            self.reason = '已达上限'
+        else:
+            self.limit = min(self.max_limit, self.limit * 2 if self.slow_start else self.limit + self.step)
+            self.stats['increases'] += 1
+            self.reason = '启动阶段，翻倍' if self.slow_start else '正常，增加'
+        
+        self.metrics = {'p50': p50, 'p90': p90, 'timeout_rate': timeout_rate, 'overload_rate': overload_rate,
+                        'samples': len(samples)}
+        self._samples = []
+        self._peak_in_flight = 0
+        self._window_start = now
+    
+    def _decrease(self, now, reason):
+        self.limit = max(self.min_limit, int(self.limit * self.decrease))
+        self.slow_start = False
+        self.stats['decreases'] += 1
+        self._last_decrease = now
+        self.reason = reason
+    
+    def summary(self):
+        """状态栏显示的当前并发上限和调整原因"""
+        text = f"并发 {self.limit}/{self.max_limit}（{self.reason}）"
+        metrics = self.metrics
+        if metrics.get('p90') is not None:
+            text += (f" p50 {metrics['p50']:.2f}s p90 {metrics['p90']:.2f}s"
+                     f" 超时 {metrics['timeout_rate']:.0%} 429/5xx {metrics['overload_rate']:.0%}")
+        return text
+
+def _simulate(limit_of, capacity, base_latency=0.3, timeout=8.0, duration=180.0, tick=0.1, seed=1):
+    """模拟链路：并发超过capacity时排队延迟成比例增加，超时的请求失败；超过容量2倍后目标开始返回503
+    
+    limit_of(clock)返回当前并发，返回(最后60秒的成功请求数/秒, 最后60秒的平均并发)
+    """
+    import random
+    
+    rng = random.Random(seed)
+    clock = 0.0
+    ok_tail, limit_tail, ticks = 0, 0, 0
+    while clock < duration:
+        limit = limit_of(clock)
+        latency = base_latency * max(1.0, limit / capacity)
+        for _ in range(max(1, round(limit / latency * tick))):
+            sample = rng.expovariate(1 / latency)
+            if sample > timeout:
+                outcome = 'timeout'
+            elif limit > 2 * capacity and rng.random() < 0.2:
+                outcome = 'overload'
+            else:
+                outcome = 'ok'
+            yield min(sample, timeout), outcome
+            if clock >= duration - 60 and outcome == 'ok':
+                ok_tail += 1
+        if clock >= duration - 60:
+            limit_tail += limit
+            ticks += 1
+        clock += tick
+    return ok_tail / 60, limit_tail / ticks
+
+if __name__ == "__main__":
+    # 不同容量的链路上，固定并发与自适应并发在稳定后（最后60秒）的吞吐量
+    for capacity in (10, 60, 400):
+        best = capacity / 0.3
+        line = [f"容量 {capacity:3d}（最优 {best:6.0f} 次/秒）"]
+        for fixed in (20, 100):
+            simulation = _simulate(lambda clock: fixed, capacity)
+            try:
+                while True:
+                    next(simulation)
+            except StopIteration as stop:
+                throughput, _ = stop.value
+            line.append(f"固定{fixed}: {throughput:6.0f}")
+        
+        state = {'clock': 0.0}
+        controller = AimdController(max_limit=1000, clock=lambda: state['clock'])
+        
+        def limit_of(clock):
+            state['clock'] = clock
+            controller.in_flight(controller.limit)
+            return controller.limit
+        
+        simulation = _simulate(limit_of, capacity)
+        try:
+            while True:
+                controller.record(*next(simulation))
+        except StopIteration as stop:
+            throughput, average_limit = stop.value
+        line.append(f"自适应: {throughput:6.0f}（平均并发 {average_limit:.0f}，{controller.reason}）")
+        print("，".join(line))
@@ -11,6 +11,9 @@ CONFIG = {
     'database': {
         'path': 'k_site_data.db',
         'backup_interval': 24,  # 小时
+        'write_batch_size': 200,  # 写入线程每个事务最多合并的写入条数
+        'write_flush_interval': 0.5,  # 写入线程最多等待多久提交一次（秒）
+        'write_queue_size': 10000,  # 等待写入的结果上限，写入跟不上时检测线程等待
     },
     
     # 请求配置
@@ -21,6 +24,17 @@ CONFIG = {
         'concurrent_limit': 20,  # 并发限制（可调整1-100）
         'connection_pool_size': 50,  # 连接池大小
         'max_workers': 20,  # 最大工作线程数
+        'max_in_flight': 0,  # 线程引擎同时提交的站点数上限，0表示线程数的2倍（站点按需从列表中取出）
+        'engine': 'threads',  # 下载引擎：threads（线程池）/async（asyncio+aiohttp，未安装时回退threads）
+        'async_concurrency': 1000,  # 异步引擎同时检查的站点数上限
+        'per_host_limit': 4,  # 异步引擎单个主机的连接数上限
+        'adaptive_concurrency': True,  # 按延迟、超时率和429/5xx比例自动调整并发（max_workers/async_concurrency为上限）
+        'initial_concurrency': 8,  # 自适应并发的初始值
+        'min_concurrency': 2,  # 自适应并发的下限
+        'site_deadline': 60,  # 单个站点所有步骤（两次下载及重试、收录检查、分析）的总时限（秒），0表示不限
+        'coalesce_requests': True,  # 按每一跳的URL和UA类型合并请求，重定向到同一页面的站点共享一次下载和分析
+        'coalesce_ttl': 60,  # 合并的请求完成后结果保留的秒数，期间相同的请求直接使用
+        'coalesce_entries': 256,  # 保留的结果数上限（含响应体）
     },
     
     # 检测配置
@@ -30,6 +44,33 @@ CONFIG = {
         'enable_hidden_check': True,
         'enable_js_check': True,
         'deep_scan': False,  # 深度扫描
+        'rule_cache_dir': 'rule_cache',  # 规则包编译缓存目录
+        'parser': 'auto',  # HTML解析后端：auto/lexbor/lxml/html.parser（未安装时回退html.parser）
+        'profile': False,  # 在结果中附带单页解析/检测耗时和遍历次数
+        'max_body_bytes': 2 * 1024 * 1024,  # 单个页面最多读取的字节数，超出部分丢弃（0为不限制）
+        'encoding_sample_bytes': 64 * 1024,  # 编码检测只取响应体前N字节
+        'verdict_threshold': 0,  # 正文命中N个违规关键词后提前结束检测（0为完整检测）
+        'cloaking_max_distance': 0.02,  # 爬虫页面与普通页面的标记片段差异比例低于该值且无违规内容变化时视为相同
+        'result_cache': True,  # 按响应体哈希和规则包版本缓存分析结果，页面未变化时不再解析
+        'result_cache_entries': 10000,  # 内存中保留的缓存条目数（LRU），其余保存在数据库
+        'result_cache_days': 30,  # 数据库中缓存条目的保留天数
+        'conditional_requests': True,  # 复检时按上次的ETag/Last-Modified发送条件请求，304时沿用上次结论（需开启result_cache）
+    },
+    
+    # 分析配置（下载线程只负责网络I/O，解析和检测交给独立的进程池）
+    'analysis': {
+        'use_process_pool': True,  # 关闭后在下载线程内直接分析
+        'max_processes': 0,  # 分析进程数，0表示CPU核心数
+        'queue_size': 0,  # 等待分析的页面上限（背压），0表示进程数的2倍
+    },
+    
+    # 页面快照配置（按响应体哈希去重存储，用于规则更新后重新分析）
+    'snapshots': {
+        'enabled': True,
+        'path': 'k_site_snapshots.db',
+        'max_bytes': 2 * 1024 ** 3,  # 压缩后的总大小上限，超出时淘汰最久未访问的快照（0为不限制）
+        'keep_per_domain': 5,  # 每个域名保留最近N次检测的快照（0为不限制）
+        'level': 10,  # zstd压缩级别
     },
     
     # 举报配置
@@ -224,7 +265,16 @@ SECURITY_CONFIG = {
     'user_agent_rotation': True,
     'random_delay': True,
     'respect_robots_txt': False,
+    'robots_cache_ttl': 3600,  # robots.txt按主机缓存的有效期（秒）
     'max_redirects': 3,
+    'max_concurrent_per_host': 2,  # 同一注册域名或同一IP同时检测的站点数上限（request_rate_limit也按此分组计算）
+    'group_by_ip': True,  # 按解析出的IP分组（共享主机上的不同域名共用限速）
+    'dns_cache_ttl': 300,  # 分组用的DNS解析结果缓存时间（秒）；预解析时为记录没有TTL时的默认有效期
+    'dns_prefetch': True,  # 批量检测时预解析域名，不存在或没有地址的域名不发起HTTP请求
+    'dns_concurrency': 200,  # 同时进行的DNS解析数
+    'dns_timeout': 5,  # 单次DNS查询超时（秒）
+    'dns_negative_ttl': 3600,  # 失效域名（NXDOMAIN/无地址）的缓存时间（秒）
+    'scheduler_lookahead': 1000,  # 调度队列中预读的站点数，在其中挑选主机可用的站点先检测
     'connection_timeout': 5,  # 连接超时
     'read_timeout': 8,  # 读取超时
     'keep_alive': True,  # 保持连接
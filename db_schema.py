@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 数据库结构与迁移
+检测日志中的每条发现拆分到detection_findings表（检测器、分类、关键词、位置），
+按分类/关键词/站点和时间查询时走索引，不再扫描violation_details中的JSON；
+离线重放（用新规则包重新分析页面快照）的日志归入detection_generations中的一代，标记规则包版本；
+结构版本记录在PRAGMA user_version中，启动时自动迁移并回填旧日志
+"""
+
+import json
+from datetime import datetime
+
+SCHEMA_VERSION = 3
+
+# TDK检测器中与关键词检测重复的问题类型（关键词及其位置已由keyword检测器记录）
+_TDK_KEYWORD_ISSUES = ('title_violation', 'meta_description_violation', 'meta_keywords_violation')
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+def migrate_database(conn, category_of=None):
+    """把数据库升级到SCHEMA_VERSION，返回迁移前的版本号
+    
+    category_of(keyword)用于回填旧日志中关键词的分类
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    
+    if version < 1:
+        # 早期版本创建的detection_logs没有page_content_hash列
+        if 'page_content_hash' not in _columns(conn, 'detection_logs'):
+            conn.execute('ALTER TABLE detection_logs ADD COLUMN page_content_hash TEXT')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS detection_findings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                log_id INTEGER NOT NULL,
+                fetch TEXT,
+                detector TEXT,
+                category TEXT,
+                keyword TEXT,
+                location TEXT,
+                FOREIGN KEY (log_id) REFERENCES detection_logs (id)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_site_time ON detection_logs (site_id, check_time)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_findings_log ON detection_findings (log_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_findings_category ON detection_findings (category, location)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_findings_keyword ON detection_findings (keyword)')
+        backfill_findings(conn, category_of)
+    
+    if version < 2:
+        # 检测日志记录规则包版本；离线重放的日志属于某一代（实时检测为NULL）
+        columns = _columns(conn, 'detection_logs')
+        for column, column_type in (('rule_version', 'TEXT'), ('generation_id', 'INTEGER')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE detection_logs ADD COLUMN {column} {column_type}')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS detection_generations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT,
+                rule_version TEXT,
+                started_at DATETIME,
+                finished_at DATETIME,
+                captures INTEGER DEFAULT 0,
+                violations INTEGER DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_generation ON detection_logs (generation_id)')
+    
+    if version < 3:
+        # 历史记录按时间分页浏览
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_time ON detection_logs (check_time, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sites_last_checked ON sites (last_checked, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sites_first_detected ON sites (first_detected, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_time ON reports (report_time, id)')
+    
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    return version
+
+def start_generation(conn, rule_version, source='replay'):
+    """创建新的一代检测日志，返回代次ID"""
+    return conn.execute('INSERT INTO detection_generations (source, rule_version, started_at) VALUES (?, ?, ?)',
+                        (source, rule_version, datetime.now())).lastrowid
+
+def finish_generation(conn, generation_id, captures, violations):
+    conn.execute('UPDATE detection_generations SET finished_at = ?, captures = ?, violations = ? WHERE id = ?',
+                 (datetime.now(), captures, violations, generation_id))
+
+def backfill_findings(conn, category_of=None, batch_size=500):
+    """从已有日志的violation_details回填发现记录（跳过已有发现记录的日志），返回写入条数"""
+    cursor = conn.execute('''
+        SELECT id, violation_details FROM detection_logs
+        WHERE violation_details IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM detection_findings f WHERE f.log_id = detection_logs.id)
+    ''')
+    total = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        findings = []
+        for log_id, details in rows:
+            try:
+                result = json.loads(details)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(result, dict):
+                findings.extend((log_id,) + finding for finding in findings_from_result(result, category_of))
+        insert_findings(conn, findings)
+        total += len(findings)
+    return total
+
+def insert_findings(conn, findings):
+    """写入(log_id, fetch, detector, category, keyword, location)记录"""
+    conn.executemany('''
+        INSERT INTO detection_findings (log_id, fetch, detector, category, keyword, location)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', findings)
+
+def findings_from_result(result, category_of=None):
+    """把一次站点检测结果拆分为(fetch, detector, category, keyword, location)列表
+    
+    兼容早期日志格式{"result": ..., "keywords": [...]}（没有位置信息）
+    """
+    category_of = category_of or (lambda keyword: None)
+    if 'normal_check' not in result:
+        return [('normal', 'keyword', category_of(keyword) or 'other', keyword, 'unknown')
+                for keyword in result.get('keywords') or []]
+    
+    findings = _check_findings(result['normal_check'], 'normal', category_of)
+    spider_check = result.get('spider_check') or {}
+    if not spider_check.get('same_as_normal'):
+        findings.extend(_check_findings(spider_check, 'spider', category_of))
+    return findings
+
+def _check_findings(check, fetch, category_of):
+    """单次访问（普通用户或爬虫）的检测结果"""
+    if not check or 'error' in check:
+        return []
+    findings = []
+    
+    # 关键词：按标题、meta描述、meta关键词、正文确定位置
+    fields = (('title', check.get('title')), ('meta_description', check.get('meta_description')),
+              ('meta_keywords', check.get('meta_keywords')))
+    for keyword in check.get('violations', []):
+        category = category_of(keyword) or 'other'
+        lower = keyword.lower()
+        locations = [name for name, value in fields if value and lower in value.lower()] or ['body']
+        findings.extend((fetch, 'keyword', category, keyword, location) for location in locations)
+    
+    for issue in check.get('tdk_issues', []):
+        if issue.get('type') not in _TDK_KEYWORD_ISSUES:
+            findings.append((fetch, 'tdk', issue.get('type'), issue.get('keyword'), issue.get('field', 'tdk')))
+    
+    for item in check.get('hidden_links', []):
+        findings.append((fetch, 'hidden_content', item.get('type'), None, item.get('tag')))
+    
+    for issue in check.get('js_redirects', []):
+        findings.append((fetch, 'js_redirect', issue.get('type', 'js_redirect'), issue.get('pattern'), 'script'))
+    return findings
+
+def query_findings(conn, category=None, keyword=None, location=None, since=None, limit=1000):
+    """按分类/关键词/位置/时间查询命中的站点，返回(domain, check_time, category, keyword, location)
+    
+    例如本周标题中出现博彩关键词的站点：query_findings(conn, 'gambling', location='title', since=一周前)
+    """
+    conditions, params = [], []
+    for column, value in (('f.category', category), ('f.keyword', keyword), ('f.location', location)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if since is not None:
+        conditions.append('dl.check_time >= ?')
+        params.append(since)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    return conn.execute(f'''
+        SELECT s.domain, dl.check_time, f.category, f.keyword, f.location
+        FROM detection_findings f
+        JOIN detection_logs dl ON dl.id = f.log_id
+        JOIN sites s ON s.id = dl.site_id
+        {where}
+        ORDER BY dl.check_time DESC
+        LIMIT ?
+    ''', params + [limit]).fetchall()
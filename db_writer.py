@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 数据库写入线程
+所有检测结果由一个长期运行的写入线程通过同一个连接写入（WAL模式），
+按条数或时间把多次写入合并成一个事务提交，下载线程只负责入队
+"""
+
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+class DbWriter:
+    """单连接数据库写入线程（分组提交）"""
+    
+    def __init__(self, db_path, batch_size=200, flush_interval=0.5, queue_size=10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # 第一条写入入队后最多等待多久提交（秒）
+        self.stats = {'queued': 0, 'written': 0, 'errors': 0, 'batches': 0, 'max_queue': 0,
+                      'total_latency': 0.0, 'max_latency': 0.0, 'last_error': None}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._closed = False  # 不再接受新的写入
+        self._stopped = False  # 写入线程已退出（或连接失败），队列中剩余的任务不会再执行
+        self._thread = threading.Thread(target=self._run, name='DbWriter', daemon=True)
+        self._thread.start()
+    
+    def submit(self, job, *args):
+        """把写入任务job(conn, *args)加入队列，返回Future（提交事务后得到job的返回值）"""
+        if self._closed:
+            raise RuntimeError('数据库写入线程已关闭')
+        future = Future()
+        self._put((job, args, future, time.perf_counter()))
+        with self._lock:
+            self.stats['queued'] += 1
+            self.stats['max_queue'] = max(self.stats['max_queue'], self._queue.qsize())
+        return future
+    
+    def _put(self, item):
+        self._queue.put(item)
+        # 与关闭竞争时，入队晚于写入线程退出前的清理：由入队的线程自己让它失败（或放行）
+        if self._stopped:
+            self._drain(RuntimeError('数据库写入线程已关闭'))
+    
+    def call(self, job, *args):
+        """同步写入，立即提交并返回job的返回值"""
+        future = self.submit(job, *args)
+        self.flush(wait=False)
+        return future.result()
+    
+    def flush(self, wait=True):
+        """立即提交队列中已有的写入；wait为True时等待提交完成"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._put(done)
+        if wait:
+            done.wait()
+    
+    def close(self):
+        """提交剩余写入并结束写入线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+    
+    @property
+    def queue_depth(self):
+        """等待写入的任务数"""
+        return self._queue.qsize()
+    
+    def metrics(self):
+        """写入统计：队列深度、写入条数、提交次数、从入队到提交的平均/最大延迟（毫秒）"""
+        with self._lock:
+            written = self.stats['written'] + self.stats['errors']
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue': self.stats['max_queue'],
+                'written': self.stats['written'],
+                'errors': self.stats['errors'],
+                'batches': self.stats['batches'],
+                'avg_latency_ms': self.stats['total_latency'] / written * 1000 if written else 0.0,
+                'max_latency_ms': self.stats['max_latency'] * 1000,
+                'last_error': self.stats['last_error']
+            }
+    
+    def summary(self):
+        """状态栏显示的写入统计"""
+        metrics = self.metrics()
+        text = (f"写入队列 {metrics['queue_depth']}，已写入 {metrics['written']} 条/{metrics['batches']} 次提交，"
+                f"平均延迟 {metrics['avg_latency_ms']:.0f} ms")
+        if metrics['errors']:
+            text += f"，失败 {metrics['errors']} 条"
+        return text
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)  # 事务由写入线程显式管理
+        conn.execute('PRAGMA busy_timeout=5000')
+        # 切换WAL模式需要独占数据库，不经过busy_timeout等待；写入线程启动时其他连接可能正在建表，稍后重试
+        for attempt in range(50):
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                break
+            except sqlite3.OperationalError:
+                if attempt == 49:
+                    raise
+                time.sleep(0.1)
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL模式下只在检查点时同步磁盘
+        return conn
+    
+    def _run(self):
+        try:
+            conn = self._connect()
+        except Exception as e:
+            # 无法打开数据库：不再接受写入，已入队的任务以该错误失败，避免call()和flush()永远等待
+            with self._lock:
+                self.stats['last_error'] = str(e)
+            self._stop(e)
+            return
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                batch, events = [], []
+                deadline = time.perf_counter() + self.flush_interval
+                # 收集一批写入：达到条数、超时、收到flush或关闭请求时提交
+                while True:
+                    if item is None:
+                        stopping = True
+                        break
+                    if isinstance(item, threading.Event):
+                        events.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                
+                if batch:
+                    self._write_batch(conn, batch)
+                for event in events:
+                    event.set()
+        finally:
+            conn.close()
+            self._stop(RuntimeError('数据库写入线程已关闭'))
+    
+    def _stop(self, error):
+        """写入线程退出：之后入队的任务由_put处理"""
+        self._closed = True
+        self._stopped = True
+        self._drain(error)
+    
+    def _drain(self, error):
+        """清空队列：写入任务以error失败，flush请求直接放行"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not None:
+                future = item[2]
+                with self._lock:
+                    self.stats['errors'] += 1
+                    self.stats['last_error'] = str(error)
+                future.set_exception(error)
+    
+    def _write_batch(self, conn, batch):
+        """在一个事务中执行一批写入，单条失败只回滚该条"""
+        results = []
+        try:
+            conn.execute('BEGIN')
+            for job, args, future, queued_at in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    results.append((future, queued_at, job(conn, *args), None))
+                    conn.execute('RELEASE job')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((future, queued_at, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            # 提交失败（磁盘错误等），整批失败
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(future, queued_at, None, e) for job, args, future, queued_at in batch]
+        
+        now = time.perf_counter()
+        with self._lock:
+            self.stats['batches'] += 1
+            for future, queued_at, result, error in results:
+                latency = now - queued_at
+                self.stats['total_latency'] += latency
+                self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+                if error is None:
+                    self.stats['written'] += 1
+                else:
+                    self.stats['errors'] += 1
+                    self.stats['last_error'] = str(error)
+        for future, queued_at, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+if __name__ == "__main__":
+    # 基准测试：100个线程各自连接、插入、提交 vs 写入线程分组提交
+    import os
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    
+    rows = 2000
+    workers = 100
+    
+    def create(path):
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT, site TEXT, details TEXT)')
+        conn.commit()
+        conn.close()
+    
+    def insert(conn, i):
+        return conn.execute('INSERT INTO logs (site, details) VALUES (?, ?)', (f'site{i}.com', 'x' * 2000)).lastrowid
+    
+    def per_call(path):
+        errors = []
+        
+        def work(i):
+            try:
+                conn = sqlite3.connect(path)
+                insert(conn, i)
+                conn.commit()
+                conn.close()
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, range(rows)))
+        return rows / (time.perf_counter() - start), len(errors)
+    
+    def with_writer(path):
+        writer = DbWriter(path)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda i: writer.submit(insert, i), range(rows)))
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        writer.close()
+        return rows / elapsed, writer.metrics()
+    
+    directory = tempfile.mkdtemp()
+    old_path = os.path.join(directory, 'per_call.db')
+    new_path = os.path.join(directory, 'writer.db')
+    create(old_path)
+    create(new_path)
+    rate, errors = per_call(old_path)
+    print(f"每次连接并提交: {rate:8.1f} 条/秒 (失败 {errors} 条)")
+    rate, metrics = with_writer(new_path)
+    print(f"写入线程分组提交: {rate:8.1f} 条/秒 (提交 {metrics['batches']} 次, 最大排队 {metrics['max_queue']}, "
+          f"平均延迟 {metrics['avg_latency_ms']:.1f} ms)")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 单站点时限与取消
+每个站点的检测在一个CancelScope中进行，所有步骤（两次下载、重试退避、收录检查、等待分析）共用一个总时限；
+scope内建立和取用的连接都登记在scope上，到达时限或停止检测时直接关闭这些套接字，
+阻塞中的连接和读取立即返回，重试前的退避等待也随之结束；
+连接时优先使用addresses(主机)给出的已解析地址（DNS预解析结果），没有时再解析
+"""
+
+import heapq
+import socket
+import threading
+import time
+from functools import partial
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
+
+class Cancelled(Exception):
+    """站点检测已停止或超过总时限"""
+
+_local = threading.local()
+
+def current_scope():
+    """当前线程所在的CancelScope，不在scope中时返回None"""
+    return getattr(_local, 'scope', None)
+
+def checkpoint():
+    """当前线程所在的scope已取消或超时时抛出Cancelled"""
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+
+def sleep(seconds):
+    """可取消的等待（不在scope中时与time.sleep相同）"""
+    scope = current_scope()
+    if scope is None:
+        time.sleep(seconds)
+    else:
+        scope.sleep(seconds)
+
+def _abort(item):
+    """关闭登记的套接字或连接对象的套接字，唤醒阻塞在其上的线程（关闭文件描述符仍由使用者完成）"""
+    sock = getattr(item, 'sock', item)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+class CancelScope:
+    """一个站点的取消范围：with scope期间该线程的请求登记在scope上"""
+    
+    def __init__(self, timeout=None, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = clock() + timeout if timeout else None
+        self.reason = None
+        self.finished = False
+        self._event = threading.Event()
+        self._items = set()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._previous = []
+    
+    def __enter__(self):
+        self._previous.append(current_scope())
+        _local.scope = self
+        return self
+    
+    def __exit__(self, *exc_info):
+        _local.scope = self._previous.pop()
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+    
+    def remaining(self):
+        """距时限的秒数，没有时限时返回None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock())
+    
+    def cancel(self, reason='已停止'):
+        """取消：关闭登记的连接并调用on_cancel回调，之后的检查点抛出Cancelled"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            items = list(self._items)
+            callbacks = list(self._callbacks)
+        for item in items:
+            _abort(item)
+        for callback in callbacks:
+            callback()
+    
+    def on_cancel(self, callback):
+        """取消时调用callback()（在调用cancel的线程中），已取消时立即调用"""
+        with self._lock:
+            self._callbacks.append(callback)
+            cancelled = self._event.is_set()
+        if cancelled:
+            callback()
+    
+    def check(self):
+        if self.deadline is not None and not self._event.is_set() and self.clock() >= self.deadline:
+            self.cancel('超过单站点时限')
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+    
+    def sleep(self, seconds):
+        """等待seconds秒，期间被取消或到达时限时抛出Cancelled"""
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            self._event.wait(remaining)
+            self.cancel('超过单站点时限')
+        elif seconds > 0:
+            self._event.wait(seconds)
+        self.check()
+    
+    def clamp(self, timeout):
+        """把requests的超时（秒数或(连接, 读取)）限制在剩余时间内"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.001)
+        if isinstance(timeout, tuple):
+            return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+        return remaining if timeout is None else min(timeout, remaining)
+    
+    def register(self, item):
+        with self._lock:
+            self._items.add(item)
+            cancelled = self._event.is_set()
+        if cancelled:
+            _abort(item)
+    
+    def unregister(self, item):
+        with self._lock:
+            self._items.discard(item)
+    
+    def close(self):
+        """站点检测结束，之后不再关闭这些连接（连接可能已回到连接池被其他站点使用）"""
+        with self._lock:
+            self.finished = True
+            self._items.clear()
+            self._callbacks.clear()
+
+class ScopeGroup:
+    """批量检测中所有站点的scope：到达时限时由后台线程取消，停止检测时全部取消"""
+    
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.stats = {'expired': 0, 'cancelled': 0}
+        self._active = set()
+        self._deadlines = []  # (时限, 序号, scope)
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def open(self, timeout=None):
+        """为一个站点创建scope并开始计时（timeout为空时不限时，只在停止时取消）"""
+        scope = CancelScope(timeout, self.clock)
+        with self._cond:
+            self._active.add(scope)
+            if scope.deadline is not None:
+                self._counter += 1
+                heapq.heappush(self._deadlines, (scope.deadline, self._counter, scope))
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._watch, daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+        return scope
+    
+    def close(self, scope):
+        scope.close()
+        with self._cond:
+            self._active.discard(scope)
+    
+    def cancel_all(self, reason='已停止'):
+        """取消所有进行中的站点"""
+        with self._cond:
+            scopes = list(self._active)
+        for scope in scopes:
+            scope.cancel(reason)
+        self.stats['cancelled'] += len(scopes)
+    
+    def _watch(self):
+        with self._cond:
+            while True:
+                if not self._deadlines:
+                    self._cond.wait()
+                    continue
+                deadline, _, scope = self._deadlines[0]
+                delay = deadline - self.clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._deadlines)
+                if not scope.finished and not scope.cancelled:
+                    scope.cancel('超过单站点时限')
+                    self.stats['expired'] += 1
+
+def _create_connection(address, timeout, source_address=None, socket_options=None, addresses=None):
+    """与urllib3的create_connection相同，但套接字在连接前登记到当前scope，连接中也可以被取消；
+    addresses(主机)返回[(family, ip)]时直接使用，不再解析
+    """
+    scope = current_scope()
+    host, port = address
+    host = host.strip('[]')
+    allowed = allowed_gai_family()
+    known = addresses(host) if addresses is not None else None
+    if known:
+        infos = [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '',
+                  (ip, port) if family == socket.AF_INET else (ip, port, 0, 0))
+                 for family, ip in known if allowed in (socket.AF_UNSPEC, family)]
+    else:
+        infos = socket.getaddrinfo(host, port, allowed, socket.SOCK_STREAM)
+    error = None
+    for family, socktype, proto, _, sockaddr in infos:
+        if scope is not None:
+            scope.check()
+        sock = socket.socket(family, socktype, proto)
+        if scope is not None:
+            scope.register(sock)
+        try:
+            for option in socket_options or ():
+                sock.setsockopt(*option)
+            if isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+        finally:
+            if scope is not None:
+                scope.unregister(sock)
+    raise error or OSError('getaddrinfo returns an empty list')
+
+class _ScopedConnection(HTTPConnection):
+    addresses = None  # 由连接池设置的已解析地址查询函数
+    
+    def _new_conn(self):
+        if current_scope() is None and self.addresses is None:
+            return super()._new_conn()
+        # 连接失败时抛出与urllib3相同的异常
+        try:
+            return _create_connection((self._dns_host, self.port), self.timeout, self.source_address,
+                                      self.socket_options, self.addresses)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        except socket.timeout as e:
+            raise ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+class _ScopedHTTPSConnection(_ScopedConnection, HTTPSConnection):
+    pass
+
+class _ScopedPool(HTTPConnectionPool):
+    """取出的连接登记到当前scope，放回连接池时注销"""
+    
+    ConnectionCls = _ScopedConnection
+    
+    def __init__(self, *args, addresses=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.addresses = addresses
+    
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.addresses = self.addresses
+        return conn
+    
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        scope = current_scope()
+        if scope is not None:
+            conn._cancel_scope = scope
+            scope.register(conn)
+        return conn
+    
+    def _put_conn(self, conn):
+        scope = getattr(conn, '_cancel_scope', None)
+        if scope is not None:
+            scope.unregister(conn)
+            conn._cancel_scope = None
+        super()._put_conn(conn)
+
+class _ScopedHTTPSPool(_ScopedPool, HTTPSConnectionPool):
+    ConnectionCls = _ScopedHTTPSConnection
+
+class ScopedRetry(Retry):
+    """重试前的退避等待在当前scope中进行，停止或超时时立即结束"""
+    
+    def sleep(self, response=None):
+        scope = current_scope()
+        if scope is None:
+            return super().sleep(response)
+        seconds = None
+        if self.respect_retry_after_header and response:
+            seconds = self.get_retry_after(response)
+        scope.sleep(seconds or self.get_backoff_time())
+
+class ScopedHTTPAdapter(HTTPAdapter):
+    """请求前检查当前scope，超时限制在剩余时间内，连接登记到scope上；addresses为已解析地址的查询函数"""
+    
+    def __init__(self, *args, addresses=None, **kwargs):
+        self.addresses = addresses
+        super().__init__(*args, **kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': partial(_ScopedPool, addresses=self.addresses),
+                                                   'https': partial(_ScopedHTTPSPool, addresses=self.addresses)}
+    
+    def send(self, request, timeout=None, **kwargs):
+        scope = current_scope()
+        if scope is not None:
+            scope.check()
+            timeout = scope.clamp(timeout)
+        return super().send(request, timeout=timeout, **kwargs)
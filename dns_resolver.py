@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 DNS预解析
+批量检测时站点进入调度队列的同时提交解析，在后台事件循环中并发进行（aiodns，未安装时在线程池中调用getaddrinfo）；
+结果按记录的TTL缓存（getaddrinfo不提供TTL，使用默认有效期），不存在（NXDOMAIN）或没有地址的域名标记为失效，
+检测时直接跳过，不发起任何HTTP请求；解析出的地址交给requests和aiohttp建立连接，不再重复解析
+"""
+
+import socket
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from politeness import is_ip
+
+try:
+    import aiodns
+    import aiodns.error
+except ImportError:
+    aiodns = None
+
+# 失效的解析结果：域名不存在、域名存在但没有地址记录
+DEAD_STATUSES = frozenset(['nxdomain', 'noaddress'])
+
+STATUS_TEXT = {'nxdomain': '域名不存在', 'noaddress': '域名没有地址记录', 'error': '解析失败'}
+
+def _status_of_error(error):
+    """解析异常对应的状态；超时、服务器错误等暂时性失败为error（不判定为失效）"""
+    if aiodns is not None and isinstance(error, aiodns.error.DNSError):
+        code = error.args[0] if error.args else None
+        if code in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENONAME):
+            return 'nxdomain'
+        if code == aiodns.error.ARES_ENODATA:
+            return 'noaddress'
+    elif isinstance(error, socket.gaierror):
+        if error.errno == socket.EAI_NONAME:
+            return 'nxdomain'
+        if error.errno == getattr(socket, 'EAI_NODATA', None):
+            return 'noaddress'
+    return 'error'
+
+class DnsResolver:
+    """批量异步解析的DNS缓存（线程安全）
+    
+    submit(host)立即返回concurrent.futures.Future，结果为{'status', 'addresses': [(family, ip)], 'expires'}；
+    同一主机同时只解析一次，有效期内的结果直接返回
+    """
+    
+    def __init__(self, concurrency=200, timeout=5, tries=2, default_ttl=300, negative_ttl=3600, error_ttl=60,
+                 min_ttl=30, max_ttl=86400, max_entries=100000, nameservers=None, clock=time.monotonic):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.tries = tries
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl  # 失效结果的有效期
+        self.error_ttl = error_ttl  # 暂时性失败的有效期
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.nameservers = nameservers
+        self.clock = clock
+        self.stats = {'resolved': 0, 'dead': 0, 'errors': 0, 'hits': 0}
+        self._entries = OrderedDict()  # 主机 -> 解析结果
+        self._pending = {}  # 主机 -> Future
+        self._lock = threading.RLock()  # 已完成的Future在add_done_callback中立即回调
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._resolver = None
+        self._executor = None
+    
+    def _start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+    
+    def submit(self, host):
+        """提交解析（不阻塞）"""
+        host = (host or '').lower().rstrip('.')
+        with self._lock:
+            entry = self._cached(host)
+            if entry is not None:
+                self.stats['hits'] += 1
+                future = Future()
+                future.set_result(entry)
+                return future
+            future = self._pending.get(host)
+            if future is None:
+                if self._loop is None:
+                    self._start()
+                future = self._pending[host] = asyncio.run_coroutine_threadsafe(self._resolve(host), self._loop)
+                future.add_done_callback(lambda _: self._done(host))
+            return future
+    
+    def _done(self, host):
+        with self._lock:
+            self._pending.pop(host, None)
+    
+    def _cached(self, host):
+        if is_ip(host):
+            family = socket.AF_INET6 if ':' in host else socket.AF_INET
+            return {'status': 'ok', 'addresses': [(family, host)], 'expires': float('inf')}
+        entry = self._entries.get(host)
+        if entry is not None and entry['expires'] > self.clock():
+            return entry
+        return None
+    
+    def lookup(self, host):
+        """有效期内的解析结果，没有时返回None（不发起解析）"""
+        with self._lock:
+            return self._cached((host or '').lower().rstrip('.'))
+    
+    def addresses(self, host):
+        """有效期内解析成功的地址[(family, ip)]，没有时返回None（由调用方自行解析）"""
+        entry = self.lookup(host)
+        if entry is None or entry['status'] != 'ok':
+            return None
+        return entry['addresses']
+    
+    def first_address(self, host):
+        """解析主机的第一个地址，失败时返回None（阻塞，供调度器的解析线程使用）"""
+        entry = self.submit(host).result()
+        return entry['addresses'][0][1] if entry['status'] == 'ok' else None
+    
+    async def _resolve(self, host):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                addresses, ttl = await asyncio.wait_for(self._query(host), self.timeout * self.tries + 1)
+                status = 'ok' if addresses else 'noaddress'
+            except Exception as e:
+                addresses, ttl = [], None
+                status = _status_of_error(e)
+        
+        if status == 'ok':
+            ttl = self.default_ttl if not ttl else min(max(ttl, self.min_ttl), self.max_ttl)
+            self.stats['resolved'] += 1
+        elif status in DEAD_STATUSES:
+            ttl = self.negative_ttl
+            self.stats['dead'] += 1
+        else:
+            ttl = self.error_ttl
+            self.stats['errors'] += 1
+        entry = {'status': status, 'addresses': addresses, 'expires': self.clock() + ttl}
+        with self._lock:
+            self._entries[host] = entry
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+    
+    async def _query(self, host):
+        """返回([(family, ip)], TTL)；TTL未知时为None"""
+        if aiodns is not None:
+            if self._resolver is None:
+                self._resolver = aiodns.DNSResolver(nameservers=self.nameservers, timeout=self.timeout,
+                                                    tries=self.tries)
+            result = await self._resolver.getaddrinfo(host, port=80, type=socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys((node.family, node.addr[0].decode()) for node in result.nodes))
+            ttls = [node.ttl for node in result.nodes if node.ttl]
+            return addresses, min(ttls) if ttls else None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=min(self.concurrency, 64))
+        infos = await self._loop.run_in_executor(self._executor, socket.getaddrinfo, host, 80, 0, socket.SOCK_STREAM)
+        return list(dict.fromkeys((family, sockaddr[0]) for family, _, _, _, sockaddr in infos)), None
+    
+    def summary(self):
+        """状态栏显示的解析统计"""
+        stats = self.stats
+        return f"DNS 解析 {stats['resolved']} 失效 {stats['dead']} 失败 {stats['errors']} 缓存命中 {stats['hits']}"
+    
+    def close(self):
+        if self._loop is None:
+            return
+        
+        async def shutdown():
+            if self._resolver is not None:
+                await self._resolver.close()
+        
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._loop = None
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 结果与历史记录导出
+检测结果和数据库游标逐行流式写入CSV、JSON Lines、JSON、Parquet或Excel（只写模式），
+按块写出，不构建完整的列表或DataFrame；导出百万行历史记录的内存占用与行数无关
+未安装pyarrow时不支持Parquet
+"""
+
+import csv
+import json
+import os
+import sqlite3
+from itertools import islice
+from config import OUTPUT_FORMATS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_SIZE = 5000
+
+# Excel单个工作表的最大行数（含标题行），超出时续写到下一个工作表
+EXCEL_MAX_ROWS = 1048576
+
+# 检测结果导出的列及其Parquet类型（int、float或string）
+RESULT_COLUMNS = ['域名', '关键词', '违规内容', '百度收录', '谷歌收录', '隐藏内容数量', 'JS劫持数量', '检测时间']
+RESULT_TYPES = ['string', 'string', 'string', 'string', 'string', 'int', 'int', 'string']
+
+# 历史记录：(工作表名, 查询)，列名取自查询的别名
+HISTORY_TABLES = {
+    'sites': ('站点记录', '''
+        SELECT domain as '域名', keywords as '关键词', status as '状态',
+               violation_type as '违规类型', first_detected as '首次检测',
+               last_checked as '最后检测', baidu_indexed as '百度收录',
+               google_indexed as '谷歌收录', report_count as '举报次数'
+        FROM sites
+        ORDER BY last_checked DESC
+    '''),
+    'logs': ('检测日志', '''
+        SELECT s.domain as '域名', dl.check_time as '检测时间',
+               dl.violation_found as '发现违规', dl.violation_details as '违规详情'
+        FROM detection_logs dl
+        JOIN sites s ON dl.site_id = s.id
+        ORDER BY dl.check_time DESC
+    '''),
+    'reports': ('举报记录', '''
+        SELECT s.domain as '域名', r.platform as '平台',
+               r.report_time as '举报时间', r.report_reason as '举报原因',
+               r.status as '状态'
+        FROM reports r
+        JOIN sites s ON r.site_id = s.id
+        ORDER BY r.report_time DESC
+    ''')
+}
+
+FORMATS = {'.xlsx': 'excel', '.csv': 'csv', '.jsonl': 'jsonl', '.json': 'json', '.parquet': 'parquet'}
+
+def format_of(path):
+    """按扩展名确定导出格式，未知扩展名返回None"""
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+def chunks(rows, size=CHUNK_SIZE):
+    """把行迭代器切分为列表块"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            break
+        yield chunk
+
+def result_row(result):
+    """单个检测结果的导出行（出错的结果返回None）"""
+    if 'error' in result:
+        return None
+    normal_check = result.get('normal_check', {})
+    indexing = result.get('indexing_status', {})
+    return (
+        result.get('domain', ''),
+        result.get('keywords', ''),
+        ', '.join(normal_check.get('violations', [])),
+        '是' if indexing.get('baidu_indexed') else '否',
+        '是' if indexing.get('google_indexed') else '否',
+        len(normal_check.get('hidden_links', [])),
+        len(normal_check.get('js_redirects', [])),
+        result.get('check_time', '')
+    )
+
+def cursor_rows(cursor, size=CHUNK_SIZE):
+    """逐块从游标读取行"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+def write_csv(path, columns, rows):
+    with open(path, 'w', newline='', encoding=OUTPUT_FORMATS['csv'].get('encoding', 'utf-8-sig')) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        count = 0
+        for chunk in chunks(rows):
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+def write_jsonl(path, columns, rows):
+    """每行一个JSON对象；columns为None时rows本身就是字典"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in chunks(rows):
+            f.write(''.join(json.dumps(row if columns is None else dict(zip(columns, row)), ensure_ascii=False,
+                                       default=str) + '\n' for row in chunk))
+            count += len(chunk)
+    return count
+
+def write_json(path, columns, rows):
+    """JSON数组，逐个对象写出（不在内存中构建整个数组）"""
+    indent = 2 if OUTPUT_FORMATS['json'].get('pretty_print') else None
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for row in rows:
+            item = row if columns is None else dict(zip(columns, row))
+            text = json.dumps(item, ensure_ascii=False, indent=indent, default=str)
+            if indent:
+                text = '\n' + '\n'.join(' ' * indent + line for line in text.split('\n'))
+            f.write((',' if count else '') + text)
+            count += 1
+        f.write('\n]\n' if indent and count else ']\n')
+    return count
+
+def column_types(conn, query, columns):
+    """按查询结果中实际的存储类型确定各列的Parquet类型（SQLite的列类型不限制存入的值）
+    
+    只有整数的列为int，只有整数和浮点数的列为float，其他（文本、混合、全为空）为string
+    """
+    quoted = ('"' + column.replace('"', '""') + '"' for column in columns)
+    storages = ', '.join(f'group_concat(DISTINCT typeof({column}))' for column in quoted)
+    row = conn.execute(f'SELECT {storages} FROM ({query})').fetchone()
+    types = []
+    for storage in row:
+        storage = set((storage or '').split(',')) - {'null', ''}
+        if storage == {'integer'}:
+            types.append('int')
+        elif storage and storage <= {'integer', 'real'}:
+            types.append('float')
+        else:
+            types.append('string')
+    return types
+
+def parquet_column(values, column_type):
+    """一列的值转为pyarrow数组；string列中的其他类型转为字符串"""
+    if column_type == 'int':
+        return pyarrow.array(values, type=pyarrow.int64())
+    if column_type == 'float':
+        return pyarrow.array(values, type=pyarrow.float64())
+    return pyarrow.array([value if value is None or isinstance(value, str) else str(value) for value in values],
+                         type=pyarrow.string())
+
+def write_parquet(path, columns, rows, types=None):
+    """每块写为一个行组；types为各列类型（int、float或string，None表示全部为string），不由数据推断
+    
+    写入失败时删除不完整的文件
+    """
+    if pyarrow is None:
+        raise RuntimeError('导出Parquet需要安装pyarrow')
+    types = types or ['string'] * len(columns)
+    arrow_types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'string': pyarrow.string()}
+    schema = pyarrow.schema([pyarrow.field(column, arrow_types[column_type])
+                             for column, column_type in zip(columns, types)])
+    count = 0
+    try:
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for chunk in chunks(rows):
+                arrays = [parquet_column([row[index] for row in chunk], column_type)
+                          for index, column_type in enumerate(types)]
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                count += len(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return count
+
+def write_excel(path, sheets):
+    """sheets为[(工作表名, 列名, 行迭代器)]，openpyxl只写模式逐行写出"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    count = 0
+    for title, columns, rows in sheets:
+        sheet = workbook.create_sheet(title)
+        sheet.append(columns)
+        sheet_rows, part = 1, 1
+        for row in rows:
+            if sheet_rows >= EXCEL_MAX_ROWS:
+                part += 1
+                sheet = workbook.create_sheet(f'{title}_{part}')
+                sheet.append(columns)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+            count += 1
+    workbook.save(path)
+    return count
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'json': write_json, 'parquet': write_parquet}
+
+def export_rows(path, sheets, fmt=None):
+    """导出一个或多个表，返回写入的行数
+    
+    sheets为[(表名, 列名, 行迭代器, 列类型)]，列类型只用于Parquet（None表示全部为string）；
+    Excel每个表一个工作表；其他格式只有一个表时写入path，多个表时分别写入“文件名_表名.扩展名”
+    """
+    fmt = fmt or format_of(path)
+    if fmt == 'excel':
+        return write_excel(path, [(title, columns, rows) for title, columns, rows, _ in sheets])
+    if fmt not in WRITERS:
+        raise ValueError(f'不支持的导出格式：{path}')
+    
+    def write(target, columns, rows, types):
+        if fmt == 'parquet':
+            return write_parquet(target, columns, rows, types)
+        return WRITERS[fmt](target, columns, rows)
+    
+    if len(sheets) == 1:
+        return write(path, *sheets[0][1:])
+    stem, ext = os.path.splitext(path)
+    return sum(write(f'{stem}_{title}{ext}', columns, rows, types) for title, columns, rows, types in sheets)
+
+def export_results(path, results, fmt=None):
+    """导出检测结果（可以是结果流）；JSON和JSON Lines保留完整结果，其他格式每个结果一行"""
+    fmt = fmt or format_of(path)
+    if fmt in ('json', 'jsonl'):
+        return WRITERS[fmt](path, None, results)
+    rows = (row for row in map(result_row, results) if row is not None)
+    return export_rows(path, [('检测结果', RESULT_COLUMNS, rows, RESULT_TYPES)], fmt)
+
+def export_history(path, db_path='k_site_data.db', tables=('sites', 'logs', 'reports'), fmt=None):
+    """从数据库游标流式导出历史记录，返回写入的行数
+    
+    在同一个读事务中确定列类型并读取各表，导出期间写入线程新增的记录不会使两者不一致
+    """
+    fmt = fmt or format_of(path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('BEGIN')
+        sheets = []
+        for table in tables:
+            title, query = HISTORY_TABLES[table]
+            cursor = conn.execute(query)
+            columns = [description[0] for description in cursor.description]
+            types = column_types(conn, query, columns) if fmt == 'parquet' else None
+            sheets.append((title, columns, cursor_rows(cursor), types))
+        return export_rows(path, sheets, fmt)
+    finally:
+        conn.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 条件请求
+按(URL, UA类型)保存上次下载的ETag、Last-Modified和最终URL，复检时发送If-None-Match/If-Modified-Since；
+服务器返回304时不再下载响应体，沿用上次的响应体哈希（由分析结果缓存取回上次的检测结论）
+"""
+
+import sqlite3
+import threading
+
+def response_validators(headers):
+    """从响应头中取ETag和Last-Modified"""
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+class ValidatorStore:
+    """条件请求校验信息，启动时全部载入内存，变更成批交给写入线程写入SQLite的fetch_validators表"""
+    
+    def __init__(self, db_path, db_writer, flush_every=100):
+        self.db_path = db_path
+        self.db_writer = db_writer
+        self.flush_every = flush_every
+        self.stats = {'conditional': 0, 'not_modified': 0, 'bytes_saved': 0, 'bytes_downloaded': 0}
+        self._entries = {}
+        self._pending = {}  # 尚未交给写入线程的变更，值为None表示删除
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # 按取出顺序交给写入线程（先于_lock获取）
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fetch_validators (
+                url TEXT,
+                ua_class TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                final_url TEXT,
+                content_hash TEXT,
+                content_length INTEGER,
+                encoding TEXT,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (url, ua_class)
+            )
+        ''')
+        conn.commit()
+        for row in conn.execute('SELECT url, ua_class, etag, last_modified, final_url, content_hash, '
+                                'content_length, encoding FROM fetch_validators'):
+            self._entries[(row[0], row[1])] = {
+                'etag': row[2],
+                'last_modified': row[3],
+                'final_url': row[4],
+                'content_hash': row[5],
+                'content_length': row[6],
+                'encoding': row[7]
+            }
+        conn.close()
+    
+    def get(self, url, ua_class):
+        """上次下载的校验信息，没有时返回None"""
+        return self._entries.get((url, ua_class))
+    
+    def request_headers(self, entry):
+        """由校验信息生成条件请求头"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        if headers:
+            with self._lock:
+                self.stats['conditional'] += 1
+        return headers
+    
+    def record(self, url, ua_class, fetched):
+        """处理一次下载结果并返回下载结果
+        
+        304时补全为上次下载的结果（content为None，not_modified为True）；
+        其他成功的下载更新校验信息（响应头中没有校验信息时删除旧条目）
+        """
+        key = (url, ua_class)
+        if fetched.get('status_code') == 304:
+            entry = self._entries.get(key)
+            if entry is None:
+                return {'url': url, 'status_code': 304, 'error': 'HTTP 304', 'status': 'error'}
+            with self._lock:
+                self.stats['not_modified'] += 1
+                self.stats['bytes_saved'] += entry['content_length'] or 0
+            return dict(fetched, content=None, content_hash=entry['content_hash'], final_url=entry['final_url'],
+                        encoding=entry['encoding'], truncated=False, not_modified=True)
+        
+        if 'content' not in fetched:
+            return fetched
+        
+        validators = fetched.get('validators') or {}
+        entry = None
+        if validators.get('etag') or validators.get('last_modified'):
+            entry = {
+                'etag': validators.get('etag'),
+                'last_modified': validators.get('last_modified'),
+                'final_url': fetched['final_url'],
+                'content_hash': fetched['content_hash'],
+                'content_length': len(fetched['content']),
+                'encoding': fetched['encoding']
+            }
+        with self._lock:
+            self.stats['bytes_downloaded'] += len(fetched['content'])
+            if entry is not None:
+                self._entries[key] = entry
+            elif key not in self._entries:
+                return fetched
+            else:
+                del self._entries[key]
+            self._pending[key] = entry
+            if len(self._pending) < self.flush_every:
+                return fetched
+        self.flush()
+        return fetched
+    
+    def _submit(self, batch):
+        """（不持有_lock时调用）交给写入线程，写入队列满时submit会阻塞"""
+        upserts = [(url, ua_class, entry['etag'], entry['last_modified'], entry['final_url'],
+                    entry['content_hash'], entry['content_length'], entry['encoding'])
+                   for (url, ua_class), entry in batch.items() if entry is not None]
+        deletes = [key for key, entry in batch.items() if entry is None]
+        self.db_writer.submit(self._write, upserts, deletes)
+    
+    def _write(self, conn, upserts, deletes):
+        conn.executemany('''
+            INSERT OR REPLACE INTO fetch_validators
+            (url, ua_class, etag, last_modified, final_url, content_hash, content_length, encoding)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', upserts)
+        conn.executemany('DELETE FROM fetch_validators WHERE url = ? AND ua_class = ?', deletes)
+    
+    def flush(self):
+        """把变更成批交给写入线程（不等待提交）"""
+        with self._submit_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if batch:
+                self._submit(batch)
+    
+    def close(self):
+        """交出剩余变更并等待写入线程提交"""
+        self.flush()
+        self.db_writer.flush()
+    
+    def summary(self):
+        """状态栏显示的条件请求统计"""
+        saved = self.stats['bytes_saved']
+        saved_text = f"{saved / (1024 * 1024):.1f} MB" if saved >= 1024 * 1024 else f"{saved / 1024:.1f} KB"
+        return f"条件请求 {self.stats['conditional']} 次，未修改 {self.stats['not_modified']} 次，节省 {saved_text}"
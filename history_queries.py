@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 历史记录查询
+站点记录、检测日志、举报记录按键集分页（上一页最后一行的(排序值, id)作为下一页的起点），
+过滤和排序都在SQLite中完成并走索引；翻到第N页与第一页的开销相同
+"""
+
+PAGE_SIZE = 200
+
+# 各表可用的排序（显示名称 -> 排序列，最后再按id排序）
+SITE_SORTS = {'最后检测': ('s.last_checked',), '首次检测': ('s.first_detected',), '域名': ('s.domain',)}
+LOG_SORTS = {'检测时间': ('dl.check_time',), '域名': ('s.domain', 'dl.check_time')}
+REPORT_SORTS = {'举报时间': ('r.report_time',), '域名': ('s.domain', 'r.report_time')}
+
+def _filters(domain=None, since=None, until=None, date_column=None):
+    """域名前缀和日期范围（until当天包含在内）条件"""
+    conditions, params = [], []
+    if domain:
+        # 用范围条件代替LIKE，可以走domain的唯一索引
+        conditions.append('s.domain >= ? AND s.domain < ?')
+        params.extend([domain, domain + '\U0010ffff'])
+    if since:
+        conditions.append(f'{date_column} >= ?')
+        params.append(since)
+    if until:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(until)
+    return conditions, params
+
+def _page(conn, columns, tables, id_column, sort_columns, conditions, params, descending=True, after=None,
+          limit=PAGE_SIZE):
+    """执行一页查询，返回(行列表, 下一页起点)；行的第一列为id，没有下一页时起点为None"""
+    keys = sort_columns + (id_column,)
+    if after is not None:
+        # (排序值..., id)行值比较，配合ORDER BY使用索引直接定位到上一页的末尾
+        placeholders = ', '.join('?' * len(keys))
+        conditions = conditions + [f"({', '.join(keys)}) {'<' if descending else '>'} ({placeholders})"]
+        params = params + list(after)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    order = 'DESC' if descending else 'ASC'
+    rows = conn.execute(f'''
+        SELECT {columns}, {', '.join(sort_columns)}
+        FROM {tables}
+        {where}
+        ORDER BY {', '.join(f'{key} {order}' for key in keys)}
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+    width = len(sort_columns)
+    cursor = tuple(rows[-1][-width:]) + (rows[-1][0],) if len(rows) == limit else None
+    return [row[:-width] for row in rows], cursor
+
+def _join(sort, outer, inner):
+    """按域名排序时先按域名索引遍历站点（CROSS JOIN固定连接顺序），否则由查询优化器决定"""
+    return f"sites s CROSS JOIN {outer} ON {inner}" if sort == '域名' else f"{outer} JOIN sites s ON {inner}"
+
+def query_sites(conn, domain=None, since=None, until=None, category=None, sort='最后检测', descending=True,
+                after=None, limit=PAGE_SIZE):
+    """站点记录，按最后检测时间过滤"""
+    conditions, params = _filters(domain, since, until, 's.last_checked')
+    if category:
+        conditions.append('s.violation_type LIKE ?')
+        params.append(f'%{category}%')
+    columns = '''s.id, s.domain, s.keywords, s.status, s.violation_type, s.first_detected, s.last_checked,
+                 s.baidu_indexed, s.google_indexed, s.report_count'''
+    return _page(conn, columns, 'sites s', 's.id', SITE_SORTS[sort], conditions, params, descending, after, limit)
+
+def query_logs(conn, domain=None, since=None, until=None, category=None, sort='检测时间', descending=True,
+               after=None, limit=PAGE_SIZE):
+    """检测日志；违规详情取自发现记录表（按log_id索引），不读取整段JSON"""
+    conditions, params = _filters(domain, since, until, 'dl.check_time')
+    if category:
+        conditions.append('EXISTS (SELECT 1 FROM detection_findings f WHERE f.log_id = dl.id AND f.category = ?)')
+        params.append(category)
+    columns = '''dl.id, s.domain, dl.check_time, dl.violation_found,
+                 (SELECT group_concat(DISTINCT f.category || ':' || f.keyword)
+                  FROM detection_findings f
+                  WHERE f.log_id = dl.id AND f.detector = 'keyword')'''
+    return _page(conn, columns, _join(sort, 'detection_logs dl', 'dl.site_id = s.id'), 'dl.id', LOG_SORTS[sort],
+                 conditions, params, descending, after, limit)
+
+def query_reports(conn, domain=None, since=None, until=None, category=None, sort='举报时间', descending=True,
+                  after=None, limit=PAGE_SIZE):
+    """举报记录，分类按被举报站点的违规类型过滤"""
+    conditions, params = _filters(domain, since, until, 'r.report_time')
+    if category:
+        conditions.append('s.violation_type LIKE ?')
+        params.append(f'%{category}%')
+    columns = 'r.id, s.domain, r.platform, r.report_time, r.report_reason, r.status'
+    return _page(conn, columns, _join(sort, 'reports r', 'r.site_id = s.id'), 'r.id', REPORT_SORTS[sort],
+                 conditions, params, descending, after, limit)
+
+def log_detail(conn, log_id):
+    """单条检测日志的完整结果JSON，不存在时返回None"""
+    row = conn.execute('SELECT violation_details FROM detection_logs WHERE id = ?', (log_id,)).fetchone()
+    return row[0] if row else None
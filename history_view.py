@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 历史记录界面
+查询在后台线程中执行（独立的只读连接），结果经队列交回界面线程；
+表格按页加载，滚动到接近底部时自动加载下一页
+"""
+
+import queue
+import sqlite3
+import threading
+import tkinter as tk
+from tkinter import ttk
+from history_queries import PAGE_SIZE
+
+class HistoryLoader:
+    """历史记录查询线程：submit(fn, callback)在后台执行fn(conn)，callback(result, error)在界面线程中调用"""
+    
+    POLL_INTERVAL = 50  # 毫秒
+    
+    def __init__(self, root, db_path):
+        self.root = root
+        self.db_path = db_path
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self._poll_job = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def submit(self, fn, callback):
+        self.pending += 1
+        self.requests.put((fn, callback))
+        if self._poll_job is None:
+            self._poll_job = self.root.after(self.POLL_INTERVAL, self._poll)
+    
+    def close(self):
+        self.requests.put(None)
+        if self._poll_job is not None:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+    
+    def _run(self):
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+        try:
+            while True:
+                request = self.requests.get()
+                if request is None:
+                    break
+                fn, callback = request
+                try:
+                    self.results.put((callback, fn(conn), None))
+                except Exception as e:
+                    self.results.put((callback, None, e))
+        finally:
+            conn.close()
+    
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            callback(result, error)
+        if self.pending:
+            self._poll_job = self.root.after(self.POLL_INTERVAL, self._poll)
+
+class HistoryTable:
+    """带过滤栏的分页历史表格
+    
+    query(conn, domain, since, until, category, sort, descending, after, limit)返回(行列表, 下一页起点)，
+    行的第一列为记录ID；format_row(row)返回显示的值
+    """
+    
+    def __init__(self, parent, loader, columns, column_widths, query, sorts, categories=(), format_row=None,
+                 on_error=None):
+        self.loader = loader
+        self.query = query
+        self.format_row = format_row or tuple
+        self.on_error = on_error
+        self.cursor = None
+        self.loading = False
+        self.token = 0  # 重新查询后丢弃旧查询还未返回的结果
+        
+        parent.columnconfigure(0, weight=1)
+        parent.rowconfigure(1, weight=1)
+        
+        # 过滤栏：域名前缀、日期范围（YYYY-MM-DD）、违规分类、排序
+        filter_frame = ttk.Frame(parent)
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 5))
+        self.domain_var = tk.StringVar()
+        self.since_var = tk.StringVar()
+        self.until_var = tk.StringVar()
+        self.category_var = tk.StringVar(value='全部')
+        self.sort_var = tk.StringVar(value=next(iter(sorts)))
+        self.descending_var = tk.BooleanVar(value=True)
+        
+        ttk.Label(filter_frame, text="域名:").grid(row=0, column=0)
+        domain_entry = ttk.Entry(filter_frame, textvariable=self.domain_var, width=20)
+        domain_entry.grid(row=0, column=1, padx=(0, 10))
+        ttk.Label(filter_frame, text="日期:").grid(row=0, column=2)
+        ttk.Entry(filter_frame, textvariable=self.since_var, width=11).grid(row=0, column=3)
+        ttk.Label(filter_frame, text="至").grid(row=0, column=4)
+        ttk.Entry(filter_frame, textvariable=self.until_var, width=11).grid(row=0, column=5, padx=(0, 10))
+        ttk.Label(filter_frame, text="分类:").grid(row=0, column=6)
+        ttk.Combobox(filter_frame, textvariable=self.category_var, values=['全部'] + list(categories),
+                     state='readonly', width=12).grid(row=0, column=7, padx=(0, 10))
+        ttk.Label(filter_frame, text="排序:").grid(row=0, column=8)
+        ttk.Combobox(filter_frame, textvariable=self.sort_var, values=list(sorts),
+                     state='readonly', width=10).grid(row=0, column=9)
+        ttk.Checkbutton(filter_frame, text="倒序", variable=self.descending_var).grid(row=0, column=10, padx=(5, 10))
+        ttk.Button(filter_frame, text="查询", command=self.reload).grid(row=0, column=11)
+        domain_entry.bind('<Return>', lambda event: self.reload())
+        
+        # 创建Treeview（iid为记录ID）
+        self.tree = ttk.Treeview(parent, columns=columns, show='headings', height=20)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=column_widths.get(col, 100))
+        
+        # 添加滚动条；滚动到最后2%时加载下一页
+        scrollbar_y = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar_x = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.tree.xview)
+        
+        def on_yscroll(first, last):
+            scrollbar_y.set(first, last)
+            if float(last) >= 0.98:
+                self.load_more()
+        
+        self.tree.configure(yscrollcommand=on_yscroll, xscrollcommand=scrollbar_x.set)
+        self.tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar_y.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        scrollbar_x.grid(row=2, column=0, sticky=(tk.W, tk.E))
+        
+        # 状态栏
+        status_frame = ttk.Frame(parent)
+        status_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        self.status_var = tk.StringVar()
+        ttk.Label(status_frame, textvariable=self.status_var).grid(row=0, column=0, padx=(0, 10))
+        self.more_button = ttk.Button(status_frame, text="加载更多", command=self.load_more, state=tk.DISABLED)
+        self.more_button.grid(row=0, column=1)
+    
+    def bind(self, sequence, func):
+        self.tree.bind(sequence, func)
+    
+    def selected_id(self):
+        """当前选中行的记录ID，没有选中时返回None"""
+        selection = self.tree.selection()
+        return int(selection[0]) if selection else None
+    
+    def filters(self):
+        category = self.category_var.get()
+        return {
+            'domain': self.domain_var.get().strip().lower() or None,
+            'since': self.since_var.get().strip() or None,
+            'until': self.until_var.get().strip() or None,
+            'category': None if category == '全部' else category,
+            'sort': self.sort_var.get(),
+            'descending': self.descending_var.get()
+        }
+    
+    def reload(self):
+        """按当前过滤条件重新查询第一页"""
+        self.token += 1
+        self.tree.delete(*self.tree.get_children())
+        self.cursor = None
+        self.loading = False
+        self._request(None)
+    
+    def load_more(self):
+        if self.cursor is not None and not self.loading:
+            self._request(self.cursor)
+    
+    def _request(self, after):
+        self.loading = True
+        self.more_button.config(state=tk.DISABLED)
+        self.status_var.set(f"已加载 {len(self.tree.get_children())} 条，正在加载...")
+        filters = self.filters()
+        token = self.token
+        self.loader.submit(lambda conn: self.query(conn, after=after, limit=PAGE_SIZE, **filters),
+                           lambda result, error: self._on_page(token, result, error))
+    
+    def _on_page(self, token, result, error):
+        if token != self.token:
+            return
+        self.loading = False
+        if error is not None:
+            self.status_var.set(f"已加载 {len(self.tree.get_children())} 条")
+            if self.on_error:
+                self.on_error(error)
+            return
+        rows, self.cursor = result
+        for row in rows:
+            self.tree.insert('', 'end', iid=str(row[0]), values=self.format_row(row))
+        count = len(self.tree.get_children())
+        self.status_var.set(f"已加载 {count} 条" + ("" if self.cursor is not None else "（全部）"))
+        self.more_button.config(state=tk.NORMAL if self.cursor is not None else tk.DISABLED)
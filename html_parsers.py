@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 HTML解析后端
+统一封装html.parser、lxml和selectolax(lexbor)三种解析器，
+为检测流水线提供相同的节点接口：name、get()、get_text()、string
+未安装lxml/selectolax时自动回退到html.parser
+"""
+
+import re
+import time
+from bs4 import BeautifulSoup, Tag, NavigableString, CData
+
+try:
+    import lxml.html
+    from lxml.etree import Comment as LxmlComment, ParserError as LxmlParserError
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# 计入页面正文的文本节点类型（不含注释、脚本和样式）
+TEXT_TYPES = (NavigableString,)
+
+# bs4中这些标签内的文本不属于正文（Script、Stylesheet、TemplateString等）
+NON_TEXT_CONTAINERS = frozenset(['script', 'style', 'template', 'rt', 'rp'])
+
+# HTML5中只有这些外部内容（SVG、MathML）里的CDATA是文本，其他位置的CDATA按注释处理（与浏览器、lexbor一致）
+FOREIGN_CONTENT = frozenset(['svg', 'math'])
+
+_XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>', re.IGNORECASE)
+
+# title中出现标签、注释等（html.parser会把它们解析成子节点）
+_TITLE_MARKUP_RE = re.compile(r'<title\b[^>]*>[^<]*<(?!/title)', re.IGNORECASE)
+
+class SoupBackend:
+    """BeautifulSoup + html.parser（纯Python，始终可用）"""
+    name = 'html.parser'
+    
+    def parse(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        if _TITLE_MARKUP_RE.search(html):
+            # HTML5中title的内容是纯文本（lxml、lexbor和浏览器一致），html.parser却解析出子元素，还原为原始文本
+            for title in soup.find_all('title'):
+                if len(title.contents) > 1 or title.find(True) is not None:
+                    title.string = ''.join(child.decode(formatter=None) if isinstance(child, Tag)
+                                           else child.output_ready(formatter=None) for child in title.contents)
+        return soup
+    
+    def iter_nodes(self, root):
+        """单次遍历文档，产出(节点, 是否文本)"""
+        for node in root.descendants:
+            if isinstance(node, Tag):
+                yield node, False
+            elif type(node) in TEXT_TYPES:
+                yield node, True
+            elif type(node) is CData and node.find_parent(FOREIGN_CONTENT) is not None:
+                yield node, True
+
+class _LxmlNode:
+    """lxml元素的节点适配器"""
+    __slots__ = ('element', 'name')
+    
+    def __init__(self, element):
+        self.element = element
+        self.name = element.tag.lower()
+    
+    def get(self, attr, default=None):
+        return self.element.get(attr, default)
+    
+    def get_text(self):
+        return self.element.text_content()
+    
+    @property
+    def string(self):
+        # 与bs4一致：只有单个文本子节点时才有string
+        if len(self.element):
+            return None
+        return self.element.text
+
+class LxmlBackend:
+    """lxml（libxml2，C实现）"""
+    name = 'lxml'
+    
+    def parse(self, html):
+        # lxml不接受带编码声明的unicode字符串
+        html = _XML_DECLARATION_RE.sub('', html, count=1)
+        if not html.strip():
+            return None
+        try:
+            return lxml.html.document_fromstring(html)
+        except LxmlParserError:
+            return None  # 只有注释、DOCTYPE等，没有任何元素（Document is empty）
+    
+    def iter_nodes(self, root):
+        """按文档顺序深度优先遍历，文本包括元素的text和tail"""
+        if root is None:
+            return
+        # 栈元素：(元素, 是否离开, 父元素是否位于脚本/样式等容器内, 是否位于SVG/MathML内)
+        stack = [(root, False, False, False)]
+        while stack:
+            element, leaving, parent_in_container, in_foreign = stack.pop()
+            if leaving:
+                # 元素结束后的tail属于父元素的正文
+                if element.tail and not parent_in_container:
+                    yield element.tail, True
+                continue
+            
+            stack.append((element, True, parent_in_container, in_foreign))
+            if not isinstance(element.tag, str):
+                # 注释和处理指令只保留其后的tail文本；libxml2把CDATA解析成"[CDATA[...]]"注释，外部内容中按文本处理
+                text = element.text
+                if (in_foreign and element.tag is LxmlComment and not parent_in_container
+                        and text.startswith('[CDATA[') and text.endswith(']]')):
+                    yield text[7:-2], True
+                continue
+            
+            node = _LxmlNode(element)
+            yield node, False
+            in_container = parent_in_container or node.name in NON_TEXT_CONTAINERS
+            in_foreign = in_foreign or node.name in FOREIGN_CONTENT
+            if element.text and not in_container:
+                yield element.text, True
+            for child in reversed(element):
+                stack.append((child, False, in_container, in_foreign))
+
+class _LexborNode:
+    """selectolax(lexbor)节点的适配器"""
+    __slots__ = ('node', 'name')
+    
+    def __init__(self, node):
+        self.node = node
+        self.name = node.tag
+    
+    def get(self, attr, default=None):
+        attributes = self.node.attributes
+        if attr not in attributes:
+            return default
+        # 无值属性与bs4保持一致，返回空字符串
+        return attributes[attr] or ''
+    
+    def get_text(self):
+        return self.node.text(deep=True)
+    
+    @property
+    def string(self):
+        child = self.node.child
+        if child is None or child.next is not None or child.tag != '-text':
+            return None
+        return child.text(deep=False)
+
+class LexborBackend:
+    """selectolax + lexbor（C实现，速度最快）"""
+    name = 'lexbor'
+    
+    def parse(self, html):
+        return LexborHTMLParser(html)
+    
+    def iter_nodes(self, root):
+        if root.root is None:
+            return
+        for node in root.root.traverse(include_text=True):
+            tag = node.tag
+            if tag == '-text':
+                parent = node.parent
+                if parent is None or parent.tag not in NON_TEXT_CONTAINERS:
+                    yield node.text(deep=False), True
+            elif tag[0] not in '-_':
+                yield _LexborNode(node), False
+
+_BACKENDS = {
+    'html.parser': SoupBackend,
+    'lxml': LxmlBackend,
+    'lexbor': LexborBackend,
+}
+
+# auto模式下的优先顺序
+AUTO_ORDER = ('lexbor', 'lxml', 'html.parser')
+
+def available_backends():
+    """当前环境可用的解析后端"""
+    available = ['html.parser']
+    if lxml is not None:
+        available.append('lxml')
+    if LexborHTMLParser is not None:
+        available.append('lexbor')
+    return available
+
+_instances = {}
+
+def get_parser(name=None):
+    """获取解析后端，未安装时回退到html.parser"""
+    name = name or 'auto'
+    available = available_backends()
+    if name == 'auto':
+        name = next(backend for backend in AUTO_ORDER if backend in available)
+    elif name not in available:
+        name = 'html.parser'
+    
+    backend = _instances.get(name)
+    if backend is None:
+        backend = _instances[name] = _BACKENDS[name]()
+    return backend
+
+# 解析器一致性检查和吞吐量测试使用的样例页面
+SAMPLE_PAGES = {
+    'gambling': """<html><head><title>澳门赌场 官方网站</title>
+<meta name="description" content="最好的百家乐 真人荷官">
+<meta name="Keywords" content="博彩,六合彩,时时彩"></head><body>
+<div style="display: none">隐藏的暗链文字 博彩网站大全 <a href="http://x.example">点击进入</a></div>
+<p style="visibility:hidden">短</p>
+<span style="font-size:0">这是零字号隐藏的链接文字信息</span>
+<span style="font-size:0.8em">normal</span>
+<iframe src="http://evil.example/x" style="display:none"></iframe>
+<script>window.location = "http://evil.example";</script>
+<p>欢迎访问 <b>正常</b>内容 发<!-- split -->票</p>
+</body></html>""",
+    'clean': """<!DOCTYPE html><html><head><meta charset="utf-8"><title>正常企业网站</title>
+<style>.a{display:none}</style></head><body><ul><li>产品一</li><li>产品二</li></ul>
+<script>var t = setTimeout(function(){}, 100);</script><p>联系我们</p></body></html>""",
+    'cloaked_js': """<html><head><title>首页</title></head><body>
+<script type="text/javascript">
+var u = unescape("%68%74%74%70"); if (navigator.userAgent.indexOf("Baiduspider") < 0) { location.href = u; }
+</script><div style="position:absolute;left:-9999px">快三 北京赛车 幸运飞艇 在线投注平台</div>
+<object data="http://evil.example/flash" style="visibility: hidden"></object>
+</body></html>""",
+    'tdk_stuffing': """<html><head><title>高收益投资理财稳赚不赔保本无风险日赚千元月入十万躺赚暴富首选平台欢迎您的光临与咨询</title>
+<meta name="description" content="aaaaaaaaaaaaaaaaaaaaaaaa">
+<meta name="keywords" content="a,b,c,d,e,f,g,h,i,j,k,l"></head>
+<body><p>贷款 无抵押 秒批</p></body></html>""",
+    'xml_declared': """<?xml version="1.0" encoding="utf-8"?>
+<html><head><title>声明页</title></head><body><p>代开发票 刻章 办证</p></body></html>""",
+}
+
+# 一致性检查额外使用的边界页面（各解析器容易出现差异的写法）
+PARITY_PAGES = {
+    'comment_only': '<!-- only comment -->',
+    'whitespace_comment': '  \n<!-- 博彩 -->\n  ',
+    'doctype_only': '<!DOCTYPE html>',
+    'empty': '',
+    'title_markup': '<html><head><title>a<b>博彩</b></title></head><body><p>正文</p></body></html>',
+    'title_entities': '<title>a &amp; <b class="x">博彩</b> &lt;i&gt; <!-- c --></title><p>正文</p>',
+    'cdata': '<html><body><p><![CDATA[博彩]]></p><p>正文</p></body></html>',
+    'cdata_only': '<![CDATA[博彩]]>',
+    'svg_cdata': '<html><body><svg><text><![CDATA[博彩]]></text></svg></body></html>',
+    'no_html_wrapper': '<title>六合彩</title><div style="display:none">隐藏的暗链文字 博彩网站大全</div>',
+    'unclosed': '<html><body><div><p>时时彩<span>北京赛车',
+}
+
+# 一致性检查比较的结果字段
+PARITY_FIELDS = ('title', 'violations', 'hidden_links', 'js_redirects', 'tdk_issues')
+
+def check_parity(rules, pages=None, backends=None):
+    """以html.parser为基准，检查各后端的检测结果是否一致（解析出错也计为差异），返回差异列表"""
+    from page_analyzer import analyze_html
+    
+    def analyze(html, backend):
+        try:
+            return analyze_html(html, rules, parser=backend)
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+    
+    pages = pages or dict(SAMPLE_PAGES, **PARITY_PAGES)
+    backends = backends or available_backends()
+    mismatches = []
+    for page_name, html in pages.items():
+        expected = analyze(html, 'html.parser')
+        for backend in backends:
+            actual = analyze(html, backend)
+            for field in PARITY_FIELDS + ('error',):
+                if actual.get(field) != expected.get(field):
+                    mismatches.append({
+                        'page': page_name,
+                        'backend': backend,
+                        'field': field,
+                        'expected': expected[field],
+                        'actual': actual[field]
+                    })
+    return mismatches
+
+def benchmark(rules, html, rounds=20):
+    """各后端解析+检测的吞吐量（页/秒）"""
+    from page_analyzer import analyze_html
+    
+    results = {}
+    for backend in available_backends():
+        start = time.perf_counter()
+        for _ in range(rounds):
+            analyze_html(html, rules, parser=backend)
+        results[backend] = rounds / (time.perf_counter() - start)
+    return results
+
+if __name__ == "__main__":
+    # 一致性检查与吞吐量测试
+    from rule_pack import load_rule_pack
+    
+    rules = load_rule_pack()
+    print(f"可用后端: {', '.join(available_backends())}")
+    
+    mismatches = check_parity(rules)
+    if mismatches:
+        for item in mismatches:
+            print(f"[不一致] {item['page']} / {item['backend']} / {item['field']}")
+            print(f"  html.parser: {item['expected']}")
+            print(f"  {item['backend']}: {item['actual']}")
+    else:
+        print(f"一致性检查通过: {len(SAMPLE_PAGES) + len(PARITY_PAGES)} 个样例页面")
+    
+    large_page = SAMPLE_PAGES['gambling'].replace(
+        '</body>', ''.join(f'<div class="item"><a href="/p/{i}">产品{i}</a><p>介绍{i}</p></div>'
+                           for i in range(3000)) + '</body>')
+    for backend, pages_per_second in benchmark(rules, large_page).items():
+        print(f"{backend:>12}: {pages_per_second:.1f} 页/秒 ({len(large_page)} 字节/页)")
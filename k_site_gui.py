@@ -8,14 +8,29 @@ K站工具 GUI界面
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
+import multiprocessing
 import json
 import pandas as pd
 from datetime import datetime
 import os
 import time
+from collections import deque
 from k_site_tool import KSiteTool
+from config import CONFIG
+from virtual_tree import VirtualTreeview
+from history_view import HistoryLoader, HistoryTable
+import exporters
+from history_queries import (SITE_SORTS, LOG_SORTS, REPORT_SORTS, query_sites, query_logs, query_reports,
+                             log_detail)
+
+# 导出文件类型（按扩展名选择格式）
+EXPORT_FILETYPES = [("Excel files", "*.xlsx"), ("CSV files", "*.csv"), ("JSON Lines files", "*.jsonl"),
+                    ("JSON files", "*.json"), ("Parquet files", "*.parquet"), ("All files", "*.*")]
 
 class KSiteGUI:
+    # 检测进度按固定间隔批量刷新（毫秒），不再每完成一个站点调度一次界面更新
+    UPDATE_INTERVAL = 100
+    
     def __init__(self, root):
         self.root = root
         self.root.title("K站工具 - 违规站点检测与举报系统 v1.0")
@@ -25,12 +40,17 @@ class KSiteGUI:
         # 初始化工具
         self.tool = KSiteTool()
         self.current_results = []
+        self._updates = deque()  # 检测线程产生、等待界面批量处理的(current, total, result)
+        self._update_job = None
         
         # 创建界面
         self.create_widgets()
         
         # 设置样式
         self.setup_styles()
+        
+        # 上次批量检测未完成时询问是否续检
+        self.root.after(500, self.offer_resume)
     
     def setup_styles(self):
         """设置界面样式"""
@@ -249,9 +269,11 @@ class KSiteGUI:
         self.thread_count = tk.IntVar(value=20)
         thread_spinbox = ttk.Spinbox(thread_frame, from_=1, to=100, width=8, textvariable=self.thread_count)
         thread_spinbox.grid(row=0, column=1, sticky=tk.W, padx=(5, 0))
+        self.adaptive_concurrency = tk.BooleanVar(value=CONFIG['request'].get('adaptive_concurrency', True))
+        ttk.Checkbutton(thread_frame, text="自动调整", variable=self.adaptive_concurrency).grid(row=0, column=2, sticky=tk.W, padx=(5, 0))
         
         # 线程数说明
-        ttk.Label(options_frame, text="线程数范围: 1-100 (推荐: 10-50)", 
+        ttk.Label(options_frame, text="线程数范围: 1-100；自动调整时为上限，并发按延迟、超时和429/5xx比例增减",
                  foreground='gray', font=('TkDefaultFont', 8)).grid(row=2, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
     
     def create_control_section(self, parent):
@@ -268,6 +290,7 @@ class KSiteGUI:
         ttk.Button(control_frame, text="导出结果", command=self.export_results).grid(row=0, column=2, padx=(0, 10))
         ttk.Button(control_frame, text="批量举报", command=self.batch_report).grid(row=0, column=3, padx=(0, 10))
         ttk.Button(control_frame, text="查看历史", command=self.view_history).grid(row=0, column=4, padx=(0, 10))
+        ttk.Button(control_frame, text="重载规则", command=self.reload_rules).grid(row=0, column=5, padx=(0, 10))
     
     def create_progress_section(self, parent):
         """创建进度显示区域"""
@@ -289,26 +312,13 @@ class KSiteGUI:
         results_frame.columnconfigure(0, weight=1)
         results_frame.rowconfigure(0, weight=1)
         
-        # 创建Treeview
+        # 创建表格（只渲染可见行，第N行对应current_results[N]）
         columns = ('域名', '状态', '违规类型', '收录状态', '隐藏内容', 'JS劫持', '检测时间')
-        self.results_tree = ttk.Treeview(results_frame, columns=columns, show='headings', height=15)
-        
-        # 设置列标题
-        for col in columns:
-            self.results_tree.heading(col, text=col)
-            self.results_tree.column(col, width=120)
-        
-        # 添加滚动条
-        scrollbar_y = ttk.Scrollbar(results_frame, orient=tk.VERTICAL, command=self.results_tree.yview)
-        scrollbar_x = ttk.Scrollbar(results_frame, orient=tk.HORIZONTAL, command=self.results_tree.xview)
-        self.results_tree.configure(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
-        
-        self.results_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.results_view = VirtualTreeview(results_frame, columns, height=15)
+        self.results_view.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # 绑定双击事件
-        self.results_tree.bind('<Double-1>', self.show_detail)
+        self.results_view.bind('<Double-1>', self.show_detail)
     
     def create_status_bar(self, parent):
         """创建状态栏"""
@@ -319,9 +329,17 @@ class KSiteGUI:
         self.status_var = tk.StringVar(value="就绪")
         ttk.Label(status_frame, textvariable=self.status_var).grid(row=0, column=0, sticky=tk.W)
         
+        # 分析结果缓存命中统计
+        self.cache_var = tk.StringVar(value="")
+        ttk.Label(status_frame, textvariable=self.cache_var).grid(row=0, column=1, sticky=tk.E, padx=(0, 20))
+        
         # 统计信息
         self.stats_var = tk.StringVar(value="")
         ttk.Label(status_frame, textvariable=self.stats_var).grid(row=0, column=2, sticky=tk.E)
+        
+        # 自适应并发的当前上限和调整原因
+        self.concurrency_var = tk.StringVar(value="")
+        ttk.Label(status_frame, textvariable=self.concurrency_var).grid(row=1, column=0, columnspan=3, sticky=tk.W)
     
     def import_excel(self):
         """导入Excel文件"""
@@ -418,12 +436,12 @@ class KSiteGUI:
             return
         
         self.tool.set_max_workers(thread_count)
+        CONFIG['request']['adaptive_concurrency'] = self.adaptive_concurrency.get()
         
         # 清空之前的结果
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
-        
+        self.results_view.clear()
         self.current_results = []
+        self.start_updates()
         
         # 更新界面状态
         self.start_button.config(state='disabled')
@@ -432,7 +450,7 @@ class KSiteGUI:
         self.progress_bar['value'] = 0
         
         # 更新状态栏
-        self.status_var.set(f"开始检测 {len(domains)} 个域名，使用 {thread_count} 个线程...")
+        self.status_var.set(f"开始检测 {len(domains)} 个域名，{self.concurrency_text(thread_count)}...")
         
         # 启动检测线程
         self.detection_thread = threading.Thread(
@@ -442,15 +460,61 @@ class KSiteGUI:
         )
         self.detection_thread.start()
     
-    def run_detection(self, domains):
-        """运行检测（在后台线程中）"""
+    def offer_resume(self):
+        """启动时发现未完成的批量检测，询问是否从中断处继续"""
+        try:
+            run = self.tool.journal.last_unfinished()
+        except Exception:
+            return
+        if run is None:
+            return
+        
+        if messagebox.askyesno("续检", f"上次批量检测（{run['started_at'][:19]} 开始，共 {run['total']} 个站点）"
+                                      f"已完成 {run['done']} 个，是否继续检测剩余的 {run['remaining']} 个站点？"):
+            self.resume_detection(run)
+        else:
+            self.tool.journal.finish_run(run['id'], 'abandoned')
+    
+    def resume_detection(self, run):
+        """续检上次未完成的批量检测（跳过已完成的站点）"""
+        thread_count = run['settings'].get('max_workers') or self.thread_count.get()
+        self.thread_count.set(thread_count)
+        self.tool.set_max_workers(thread_count)
+        self.adaptive_concurrency.set(run['settings'].get('adaptive_concurrency', self.adaptive_concurrency.get()))
+        CONFIG['request']['adaptive_concurrency'] = self.adaptive_concurrency.get()
+        
+        # 清空之前的结果
+        self.results_view.clear()
+        self.current_results = []
+        self.start_updates()
+        
+        # 更新界面状态
+        self.start_button.config(state='disabled')
+        self.stop_button.config(state='normal')
+        self.progress_bar['maximum'] = run['remaining']
+        self.progress_bar['value'] = 0
+        
+        self.status_var.set(f"续检第 {run['id']} 次批量检测，剩余 {run['remaining']} 个域名，{self.concurrency_text(thread_count)}...")
+        
+        self.detection_thread = threading.Thread(
+            target=self.run_detection,
+            args=(None, run['id']),
+            daemon=True
+        )
+        self.detection_thread.start()
+    
+    def run_detection(self, domains, run_id=None):
+        """运行检测（在后台线程中）；run_id不为空时续检该次批量检测"""
         try:
             def progress_callback(current, total, result):
-                # 更新进度
-                self.root.after(0, lambda: self.update_progress(current, total, result))
+                # 只入队，由界面线程按固定间隔批量处理
+                self._updates.append((current, total, result))
             
             # 执行批量检测
-            results = self.tool.batch_check_sites(domains, progress_callback)
+            if run_id is None:
+                results = self.tool.batch_check_sites(domains, progress_callback)
+            else:
+                results = list(self.tool.resume(run_id, progress_callback))
             
             # 检测完成
             self.root.after(0, lambda: self.detection_completed(results))
@@ -458,18 +522,63 @@ class KSiteGUI:
         except Exception as e:
             self.root.after(0, lambda: self.detection_error(str(e)))
     
-    def update_progress(self, current, total, result):
-        """更新进度显示"""
+    def start_updates(self):
+        """开始定时批量刷新检测进度"""
+        self._updates.clear()
+        if self._update_job is None:
+            self._update_job = self.root.after(self.UPDATE_INTERVAL, self.flush_updates)
+    
+    def stop_updates(self):
+        """处理剩余的进度并停止定时刷新"""
+        if self._update_job is not None:
+            self.root.after_cancel(self._update_job)
+            self._update_job = None
+        self.flush_updates(reschedule=False)
+    
+    def flush_updates(self, reschedule=True):
+        """一次处理上个间隔内完成的全部站点"""
+        updates = []
+        while self._updates:
+            updates.append(self._updates.popleft())
+        if updates:
+            current, total, _ = updates[-1]
+            # 续检时站点逐个从数据库读出，总数取剩余站点数
+            self.update_progress(current, total or self.progress_bar['maximum'], [update[2] for update in updates])
+        if reschedule:
+            self._update_job = self.root.after(self.UPDATE_INTERVAL, self.flush_updates)
+    
+    def update_progress(self, current, total, results):
+        """更新进度显示，results为本次刷新新完成的站点"""
         self.progress_bar['value'] = current
-        self.progress_var.set(f"正在检测 {current}/{total}: {result.get('domain', '')}")
+        self.progress_var.set(f"正在检测 {current}/{total}: {results[-1].get('domain', '')}")
+        self.update_cache_stats()
         
         # 添加结果到表格
-        if 'error' not in result:
-            self.add_result_to_tree(result)
-            self.current_results.append(result)
+        results = [result for result in results if 'error' not in result]
+        self.current_results.extend(results)
+        self.results_view.append([self.result_row(result) for result in results])
+    
+    def concurrency_text(self, thread_count):
+        if self.adaptive_concurrency.get():
+            return f"自动调整并发（上限 {thread_count} 个线程）"
+        return f"使用 {thread_count} 个线程"
+    
+    def update_cache_stats(self):
+        """在状态栏显示分析结果缓存的命中/未命中次数、条件请求节省的流量、数据库写入队列、DNS预解析、请求合并和当前并发"""
+        parts = [store.summary() for store in (self.tool.result_cache, self.tool.validator_store, self.tool.db_writer,
+                                               self.tool.dns, self.tool.coalescer)
+                 if store is not None]
+        self.cache_var.set(" | ".join(parts))
+        if self.tool.concurrency is not None:
+            self.concurrency_var.set(self.tool.concurrency.summary())
     
     def add_result_to_tree(self, result):
         """添加结果到表格"""
+        self.current_results.append(result)
+        self.results_view.append([self.result_row(result)])
+    
+    def result_row(self, result):
+        """检测结果在表格中显示的一行"""
         domain = result.get('domain', '')
         
         normal_check = result.get('normal_check', {})
@@ -563,18 +672,11 @@ class KSiteGUI:
         # 检测时间
         check_time = result.get('check_time', '')[:19] if result.get('check_time') else ''
         
-        # 插入到表格
-        item = self.results_tree.insert('', 'end', values=(
-            domain, status, violation_types, indexing_text, 
-            hidden_text, js_text, check_time
-        ))
-        
-        # 设置颜色
-        if status == "违规":
-            self.results_tree.set(item, '状态', status)
+        return (domain, status, violation_types, indexing_text, hidden_text, js_text, check_time)
     
     def detection_completed(self, results):
         """检测完成"""
+        self.stop_updates()
         self.start_button.config(state='normal')
         self.stop_button.config(state='disabled')
         
@@ -583,6 +685,7 @@ class KSiteGUI:
         
         self.progress_var.set("检测完成")
         self.status_var.set(f"检测完成，共 {report['total_sites']} 个站点")
+        self.update_cache_stats()
         
         stats_text = (f"违规: {report['violation_sites']} | "
                      f"收录: {report['indexed_sites']} | "
@@ -596,6 +699,7 @@ class KSiteGUI:
     
     def detection_error(self, error_msg):
         """检测出错"""
+        self.stop_updates()
         self.start_button.config(state='normal')
         self.stop_button.config(state='disabled')
         self.progress_var.set("检测出错")
@@ -622,24 +726,21 @@ class KSiteGUI:
                     self.root.after(0, lambda: self.status_var.set("检测完全停止"))
             wait_for_thread()
     
+    def reload_rules(self):
+        """重新加载检测规则（检测进行中也可替换，新站点使用新规则）"""
+        try:
+            pack = self.tool.reload_rules()
+            self.status_var.set(f"规则已重新加载，版本 {pack.version}，关键词 {len(pack.keywords)} 个")
+        except Exception as e:
+            messagebox.showerror("错误", f"重新加载规则失败：{str(e)}")
+    
     def show_detail(self, event):
         """显示详细信息"""
-        selection = self.results_tree.selection()
-        if not selection:
+        index = self.results_view.selected_index()
+        if index is None or index >= len(self.current_results):
             return
         
-        item = selection[0]
-        domain = self.results_tree.item(item)['values'][0]
-        
-        # 查找对应的结果数据
-        result_data = None
-        for result in self.current_results:
-            if result.get('domain') == domain:
-                result_data = result
-                break
-        
-        if result_data:
-            self.show_detail_window(result_data)
+        self.show_detail_window(self.current_results[index])
     
     def show_detail_window(self, result_data):
         """显示详细信息窗口"""
@@ -709,6 +810,21 @@ JS劫持详情:
         if len(normal_check.get('js_redirects', [])) > 3:
             detail_text += f"  ... 还有 {len(normal_check.get('js_redirects', [])) - 3} 个JS劫持\n"
         
+        # 蜘蛛伪装对比（普通访问 vs 爬虫访问）
+        cloaking = result_data.get('cloaking')
+        if cloaking:
+            verdict_names = {
+                'identical': '完全相同', 'similar': '基本相同', 'different': '内容不同',
+                'cloaked': '疑似蜘蛛伪装', 'unavailable': '无法对比'
+            }
+            detail_text += f"""
+【蜘蛛伪装对比】
+结论: {verdict_names.get(cloaking.get('verdict'), cloaking.get('verdict'))}
+差异比例: {cloaking.get('distance', 'N/A')}
+仅爬虫可见的违规词: {', '.join(cloaking.get('spider_only_violations', [])) or '无'}
+仅用户可见的违规词: {', '.join(cloaking.get('normal_only_violations', [])) or '无'}
+"""
+        
         # 如果有错误信息，显示错误详情
         if 'error' in normal_check:
             detail_text += f"""
@@ -734,45 +850,27 @@ JS劫持详情:
         file_path = filedialog.asksaveasfilename(
             title="保存结果",
             defaultextension=".xlsx",
-            filetypes=[("Excel files", "*.xlsx"), ("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=EXPORT_FILETYPES
         )
         
         if file_path:
+            # 结果列表在导出期间可能被新的检测替换，导出当前这一份
+            results = self.current_results
+            self.run_export(lambda: exporters.export_results(file_path, results), "结果已导出到", "导出失败", file_path)
+    
+    def run_export(self, export, success, failure, file_path):
+        """在后台线程中流式导出，完成后在界面线程中提示"""
+        self.status_var.set(f"正在导出：{file_path}")
+        
+        def export_thread():
             try:
-                if file_path.endswith('.xlsx'):
-                    # 导出为Excel
-                    export_data = []
-                    for result in self.current_results:
-                        if 'error' in result:
-                            continue
-                        
-                        normal_check = result.get('normal_check', {})
-                        violations = normal_check.get('violations', [])
-                        indexing = result.get('indexing_status', {})
-                        
-                        export_data.append({
-                            '域名': result.get('domain', ''),
-                            '关键词': result.get('keywords', ''),
-                            '违规内容': ', '.join(violations),
-                            '百度收录': '是' if indexing.get('baidu_indexed') else '否',
-                            '谷歌收录': '是' if indexing.get('google_indexed') else '否',
-                            '隐藏内容数量': len(normal_check.get('hidden_links', [])),
-                            'JS劫持数量': len(normal_check.get('js_redirects', [])),
-                            '检测时间': result.get('check_time', '')
-                        })
-                    
-                    df = pd.DataFrame(export_data)
-                    df.to_excel(file_path, index=False)
-                    
-                else:
-                    # 导出为JSON
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        json.dump(self.current_results, f, ensure_ascii=False, indent=2)
-                
-                messagebox.showinfo("成功", f"结果已导出到：{file_path}")
-                
+                count = export()
+                self.root.after(0, lambda: self.status_var.set(f"已导出 {count} 行"))
+                self.root.after(0, lambda: messagebox.showinfo("成功", f"{success}：{file_path}"))
             except Exception as e:
-                messagebox.showerror("错误", f"导出失败：{str(e)}")
+                self.root.after(0, lambda: messagebox.showerror("错误", f"{failure}：{str(e)}"))
+                        
+        threading.Thread(target=export_thread, daemon=True).start()
     
     def batch_report(self):
         """批量举报"""
@@ -866,6 +964,15 @@ JS劫持详情:
         history_window.geometry("1200x700")
         history_window.resizable(True, True)
         
+        # 历史记录查询在后台线程中执行，窗口关闭时结束
+        self.history_loader = HistoryLoader(self.root, self.tool.db_path)
+        
+        def close_history():
+            self.history_loader.close()
+            history_window.destroy()
+        
+        history_window.protocol("WM_DELETE_WINDOW", close_history)
+        
         # 创建主框架
         main_frame = ttk.Frame(history_window, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -906,238 +1013,107 @@ JS劫持详情:
         ttk.Button(button_frame, text="刷新", command=lambda: self.refresh_history(notebook)).grid(row=0, column=0, padx=(0, 10))
         ttk.Button(button_frame, text="导出历史", command=self.export_history).grid(row=0, column=1, padx=(0, 10))
         ttk.Button(button_frame, text="清空历史", command=self.clear_history).grid(row=0, column=2, padx=(0, 10))
-        ttk.Button(button_frame, text="关闭", command=history_window.destroy).grid(row=0, column=3)
+        ttk.Button(button_frame, text="关闭", command=close_history).grid(row=0, column=3)
     
     def create_sites_history_tab(self, parent):
         """创建站点历史选项卡"""
-        parent.columnconfigure(0, weight=1)
-        parent.rowconfigure(0, weight=1)
-        
-        # 创建Treeview
         columns = ('ID', '域名', '关键词', '状态', '违规类型', '首次检测', '最后检测', '百度收录', '谷歌收录', '举报次数')
-        self.sites_tree = ttk.Treeview(parent, columns=columns, show='headings', height=20)
-        
-        # 设置列标题和宽度
         column_widths = {'ID': 50, '域名': 150, '关键词': 100, '状态': 80, '违规类型': 120, 
                         '首次检测': 130, '最后检测': 130, '百度收录': 80, '谷歌收录': 80, '举报次数': 80}
         
-        for col in columns:
-            self.sites_tree.heading(col, text=col)
-            self.sites_tree.column(col, width=column_widths.get(col, 100))
-        
-        # 添加滚动条
-        sites_scrollbar_y = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.sites_tree.yview)
-        sites_scrollbar_x = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.sites_tree.xview)
-        self.sites_tree.configure(yscrollcommand=sites_scrollbar_y.set, xscrollcommand=sites_scrollbar_x.set)
+        def format_row(row):
+            # 格式化日期和收录状态
+            return (row[0], row[1], row[2] or "", row[3], row[4] or "无", row[5] or "未知", row[6] or "未知",
+                    "是" if row[7] else "否", "是" if row[8] else "否", row[9])
         
-        self.sites_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        sites_scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        sites_scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.sites_table = HistoryTable(parent, self.history_loader, columns, column_widths, query_sites,
+                                        SITE_SORTS, self.violation_categories(), format_row,
+                                        lambda e: messagebox.showerror("错误", f"加载站点历史失败：{str(e)}"))
         
         # 加载站点数据
         self.load_sites_history()
     
     def create_logs_history_tab(self, parent):
         """创建检测日志选项卡"""
-        parent.columnconfigure(0, weight=1)
-        parent.rowconfigure(0, weight=1)
-        
-        # 创建Treeview
         columns = ('ID', '域名', '检测时间', '发现违规', '违规详情')
-        self.logs_tree = ttk.Treeview(parent, columns=columns, show='headings', height=20)
-        
-        # 设置列标题和宽度
         column_widths = {'ID': 50, '域名': 150, '检测时间': 130, '发现违规': 80, '违规详情': 400}
         
-        for col in columns:
-            self.logs_tree.heading(col, text=col)
-            self.logs_tree.column(col, width=column_widths.get(col, 100))
+        def format_row(row):
+            # 简化违规详情显示
+            details = row[4] if row[4] else ""
+            if len(details) > 100:
+                details = details[:100] + "..."
+            return (row[0], row[1], row[2], "是" if row[3] else "否", details)
         
-        # 添加滚动条
-        logs_scrollbar_y = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.logs_tree.yview)
-        logs_scrollbar_x = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.logs_tree.xview)
-        self.logs_tree.configure(yscrollcommand=logs_scrollbar_y.set, xscrollcommand=logs_scrollbar_x.set)
-        
-        self.logs_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        logs_scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        logs_scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.logs_table = HistoryTable(parent, self.history_loader, columns, column_widths, query_logs,
+                                       LOG_SORTS, self.violation_categories(), format_row,
+                                       lambda e: messagebox.showerror("错误", f"加载检测日志失败：{str(e)}"))
         
         # 绑定双击事件查看详情
-        self.logs_tree.bind('<Double-1>', self.show_log_detail)
+        self.logs_table.bind('<Double-1>', self.show_log_detail)
         
         # 加载日志数据
         self.load_logs_history()
     
     def create_reports_history_tab(self, parent):
         """创建举报记录选项卡"""
-        parent.columnconfigure(0, weight=1)
-        parent.rowconfigure(0, weight=1)
-        
-        # 创建Treeview
         columns = ('ID', '域名', '平台', '举报时间', '举报原因', '状态')
-        self.reports_tree = ttk.Treeview(parent, columns=columns, show='headings', height=20)
-        
-        # 设置列标题和宽度
         column_widths = {'ID': 50, '域名': 150, '平台': 100, '举报时间': 130, '举报原因': 200, '状态': 80}
         
-        for col in columns:
-            self.reports_tree.heading(col, text=col)
-            self.reports_tree.column(col, width=column_widths.get(col, 100))
-        
-        # 添加滚动条
-        reports_scrollbar_y = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.reports_tree.yview)
-        reports_scrollbar_x = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.reports_tree.xview)
-        self.reports_tree.configure(yscrollcommand=reports_scrollbar_y.set, xscrollcommand=reports_scrollbar_x.set)
-        
-        self.reports_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        reports_scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        reports_scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.reports_table = HistoryTable(parent, self.history_loader, columns, column_widths, query_reports,
+                                          REPORT_SORTS, self.violation_categories(), None,
+                                          lambda e: messagebox.showerror("错误", f"加载举报记录失败：{str(e)}"))
         
         # 加载举报数据
         self.load_reports_history()
     
+    def violation_categories(self):
+        """当前规则包中的违规分类（历史记录按分类过滤）"""
+        return list(self.tool.rule_pack.source.get('keywords', {}))
+    
     def load_sites_history(self):
-        """加载站点历史数据"""
-        try:
-            import sqlite3
-            conn = sqlite3.connect('k_site_data.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, domain, keywords, status, violation_type, 
-                       first_detected, last_checked, baidu_indexed, 
-                       google_indexed, report_count
-                FROM sites
-                ORDER BY last_checked DESC
-            ''')
-            
-            # 清空现有数据
-            for item in self.sites_tree.get_children():
-                self.sites_tree.delete(item)
-            
-            # 添加数据
-            for row in cursor.fetchall():
-                # 格式化日期
-                first_detected = row[5] if row[5] else "未知"
-                last_checked = row[6] if row[6] else "未知"
-                
-                # 格式化收录状态
-                baidu_status = "是" if row[7] else "否"
-                google_status = "是" if row[8] else "否"
-                
-                self.sites_tree.insert('', 'end', values=(
-                    row[0], row[1], row[2] or "", row[3], row[4] or "无",
-                    first_detected, last_checked, baidu_status, google_status, row[9]
-                ))
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"加载站点历史失败：{str(e)}")
+        """加载站点历史数据（后台分页查询）"""
+        self.sites_table.reload()
     
     def load_logs_history(self):
-        """加载检测日志数据"""
-        try:
-            import sqlite3
-            conn = sqlite3.connect('k_site_data.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT dl.id, s.domain, dl.check_time, dl.violation_found, dl.violation_details
-                FROM detection_logs dl
-                JOIN sites s ON dl.site_id = s.id
-                ORDER BY dl.check_time DESC
-                LIMIT 1000
-            ''')
-            
-            # 清空现有数据
-            for item in self.logs_tree.get_children():
-                self.logs_tree.delete(item)
-            
-            # 添加数据
-            for row in cursor.fetchall():
-                violation_found = "是" if row[3] else "否"
-                
-                # 简化违规详情显示
-                details = row[4] if row[4] else ""
-                if len(details) > 100:
-                    details = details[:100] + "..."
-                
-                self.logs_tree.insert('', 'end', values=(
-                    row[0], row[1], row[2], violation_found, details
-                ))
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"加载检测日志失败：{str(e)}")
+        """加载检测日志数据（后台分页查询）"""
+        self.logs_table.reload()
     
     def load_reports_history(self):
-        """加载举报记录数据"""
-        try:
-            import sqlite3
-            conn = sqlite3.connect('k_site_data.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT r.id, s.domain, r.platform, r.report_time, r.report_reason, r.status
-                FROM reports r
-                JOIN sites s ON r.site_id = s.id
-                ORDER BY r.report_time DESC
-            ''')
-            
-            # 清空现有数据
-            for item in self.reports_tree.get_children():
-                self.reports_tree.delete(item)
-            
-            # 添加数据
-            for row in cursor.fetchall():
-                self.reports_tree.insert('', 'end', values=row)
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"加载举报记录失败：{str(e)}")
+        """加载举报记录数据（后台分页查询）"""
+        self.reports_table.reload()
     
     def show_log_detail(self, event):
-        """显示日志详情"""
-        selection = self.logs_tree.selection()
-        if not selection:
+        """显示日志详情（完整结果在后台读取）"""
+        log_id = self.logs_table.selected_id()
+        if log_id is None:
             return
         
-        item = self.logs_tree.item(selection[0])
-        log_id = item['values'][0]
+        def show(details, error):
+            if error is not None:
+                messagebox.showerror("错误", f"加载日志详情失败：{str(error)}")
+                return
+            if not details:
+                return
         
-        try:
-            import sqlite3
-            conn = sqlite3.connect('k_site_data.db')
-            cursor = conn.cursor()
+            detail_window = tk.Toplevel(self.root)
+            detail_window.title("检测日志详情")
+            detail_window.geometry("800x600")
             
-            cursor.execute('SELECT violation_details FROM detection_logs WHERE id = ?', (log_id,))
-            result = cursor.fetchone()
-            conn.close()
+            text_widget = scrolledtext.ScrolledText(detail_window, wrap=tk.WORD)
+            text_widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
             
-            if result and result[0]:
-                detail_window = tk.Toplevel(self.root)
-                detail_window.title("检测日志详情")
-                detail_window.geometry("800x600")
-                
-                text_widget = scrolledtext.ScrolledText(detail_window, wrap=tk.WORD)
-                text_widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            # 格式化JSON数据
+            try:
+                data = json.loads(details)
+                formatted_text = json.dumps(data, indent=2, ensure_ascii=False)
+                text_widget.insert(tk.END, formatted_text)
+            except:
+                text_widget.insert(tk.END, details)
                 
-                # 格式化JSON数据
-                try:
-                    import json
-                    data = json.loads(result[0])
-                    formatted_text = json.dumps(data, indent=2, ensure_ascii=False)
-                    text_widget.insert(tk.END, formatted_text)
-                except:
-                    text_widget.insert(tk.END, result[0])
+            text_widget.config(state=tk.DISABLED)
                 
-                text_widget.config(state=tk.DISABLED)
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"加载日志详情失败：{str(e)}")
+        self.history_loader.submit(lambda conn: log_detail(conn, log_id), show)
     
     def refresh_history(self, notebook):
         """刷新历史记录"""
@@ -1149,67 +1125,20 @@ JS劫持详情:
             self.load_logs_history()
         elif current_tab == 2:  # 举报记录
             self.load_reports_history()
-        
-        messagebox.showinfo("提示", "历史记录已刷新")
     
     def export_history(self):
         """导出历史记录"""
-        try:
-            file_path = filedialog.asksaveasfilename(
-                title="导出历史记录",
-                defaultextension=".xlsx",
-                filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
-            )
-            
-            if not file_path:
-                return
-            
-            import sqlite3
-            import pandas as pd
-            
-            conn = sqlite3.connect('k_site_data.db')
-            
-            # 导出站点数据
-            sites_df = pd.read_sql_query('''
-                SELECT domain as '域名', keywords as '关键词', status as '状态', 
-                       violation_type as '违规类型', first_detected as '首次检测', 
-                       last_checked as '最后检测', baidu_indexed as '百度收录', 
-                       google_indexed as '谷歌收录', report_count as '举报次数'
-                FROM sites
-                ORDER BY last_checked DESC
-            ''', conn)
-            
-            # 导出检测日志
-            logs_df = pd.read_sql_query('''
-                SELECT s.domain as '域名', dl.check_time as '检测时间', 
-                       dl.violation_found as '发现违规', dl.violation_details as '违规详情'
-                FROM detection_logs dl
-                JOIN sites s ON dl.site_id = s.id
-                ORDER BY dl.check_time DESC
-            ''', conn)
-            
-            # 导出举报记录
-            reports_df = pd.read_sql_query('''
-                SELECT s.domain as '域名', r.platform as '平台', 
-                       r.report_time as '举报时间', r.report_reason as '举报原因', 
-                       r.status as '状态'
-                FROM reports r
-                JOIN sites s ON r.site_id = s.id
-                ORDER BY r.report_time DESC
-            ''', conn)
-            
-            conn.close()
-            
-            # 写入Excel文件
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                sites_df.to_excel(writer, sheet_name='站点记录', index=False)
-                logs_df.to_excel(writer, sheet_name='检测日志', index=False)
-                reports_df.to_excel(writer, sheet_name='举报记录', index=False)
+        file_path = filedialog.asksaveasfilename(
+            title="导出历史记录",
+            defaultextension=".xlsx",
+            filetypes=EXPORT_FILETYPES
+        )
             
-            messagebox.showinfo("成功", f"历史记录已导出到：{file_path}")
+        if not file_path:
+            return
             
-        except Exception as e:
-            messagebox.showerror("错误", f"导出历史记录失败：{str(e)}")
+        self.run_export(lambda: exporters.export_history(file_path, self.tool.db_path), "历史记录已导出到", "导出历史记录失败",
+                        file_path)
     
     def clear_history(self):
         """清空历史记录"""
@@ -1226,6 +1155,7 @@ JS劫持详情:
                 cursor = conn.cursor()
                 
                 # 清空所有表
+                cursor.execute('DELETE FROM detection_findings')
                 cursor.execute('DELETE FROM detection_logs')
                 cursor.execute('DELETE FROM reports')
                 cursor.execute('DELETE FROM sites')
@@ -1247,6 +1177,8 @@ JS劫持详情:
                 messagebox.showerror("错误", f"清空历史记录失败：{str(e)}")
 
 def main():
+    # 打包为可执行文件时，分析进程池的子进程需要由此进入
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = KSiteGUI(root)
     root.mainloop()
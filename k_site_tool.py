@@ -24,31 +24,101 @@ import pandas as pd
 from fake_useragent import UserAgent
 import hashlib
 import base64
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from config import CONFIG, SECURITY_CONFIG
+from rule_pack import load_rule_pack
+from page_analyzer import (analyze_body, analyze_document, HiddenContentDetector,
+                           JsRedirectDetector, TdkDetector)
+from analysis_pool import AnalysisPool
+from cloaking import analyze_variant, compare_checks
+from page_body import BodyBuffer, CHUNK_SIZE, charset_from_content_type
+from async_fetch import AsyncFetcher, is_available as async_engine_available
+from result_cache import ResultCache
+from fetch_validators import ValidatorStore, response_validators
+from db_writer import DbWriter
+from db_schema import (migrate_database, findings_from_result, insert_findings, start_generation,
+                       finish_generation)
+from snapshot_store import SnapshotStore
+from batch_journal import BatchJournal, JournaledSites
+from politeness import PolitenessScheduler, RobotsCache, resolve_host
+from dns_resolver import DnsResolver, DEAD_STATUSES, STATUS_TEXT
+from concurrency import AimdController
+from deadline import (Cancelled, ScopeGroup, ScopedHTTPAdapter, ScopedRetry, checkpoint, current_scope,
+                      sleep as scoped_sleep)
+from coalesce import Abandoned, RequestCoalescer, normalize_url
+import exporters
 
 class KSiteTool:
     def __init__(self):
+        # 批量检测的DNS预解析和缓存，解析出的地址在下载时直接使用
+        self.dns = self._create_dns_resolver()
+
         # 配置高性能requests会话
         self.session = self._create_optimized_session()
         self.ua = UserAgent()
+
+        # 检测规则包（关键词、正则、选择器统一来自config.py，编译结果按内容哈希缓存）
+        self.rule_cache_dir = CONFIG['detection']['rule_cache_dir']
+        self._rules_lock = threading.Lock()
+        self.rule_pack = load_rule_pack(cache_dir=self.rule_cache_dir)
+
         self.db_path = 'k_site_data.db'
         self.init_database()
-        
-        # 线程控制
+
+        # 检测结果由单独的写入线程分组提交，下载线程不再直接写数据库
+        database = CONFIG['database']
+        self.db_writer = DbWriter(self.db_path, batch_size=database.get('write_batch_size', 200),
+                                  flush_interval=database.get('write_flush_interval', 0.5),
+                                  queue_size=database.get('write_queue_size', 10000))
+        self._site_ids = {}  # 域名 -> sites.id，批量检测开始时整体载入，只由写入线程更新
+
+        # 批量检测的站点列表和完成状态，中断后可续检
+        self.journal = BatchJournal(self.db_path, self.db_writer)
+        self.current_run_id = None
+
+        # robots.txt按主机缓存（respect_robots_txt开启时使用）
+        self.robots_cache = RobotsCache(ttl=SECURITY_CONFIG.get('robots_cache_ttl', 3600))
+
+        # 线程控制；开启自适应并发时max_workers为上限，批量检测期间concurrency为当前的并发控制器
         self.max_workers = CONFIG['request']['max_workers']
+        self.concurrency = None
+
+        # 批量检测中每个站点的取消范围（单站点总时限，停止检测时关闭进行中的连接）
+        self.site_scopes = ScopeGroup()
         self.stop_flag = threading.Event()
-        
-        # 违规关键词库
-        self.violation_keywords = [
-            '博彩', '赌博', '色情', '黄色', '成人', '裸体', '性爱', '做爱',
-            '六合彩', '时时彩', '北京赛车', '澳门赌场', '真人荷官',
-            '代孕', '假证', '假币', '枪支', '毒品', '迷药', '催情',
-            '发票', '刻章', '办证', '代开', '增值税', '普通发票'
-        ]
-        
+
+        # 请求合并：重定向到同一页面的站点共享一次下载和一次分析
+        request = CONFIG['request']
+        self.coalescer = None
+        if request.get('coalesce_requests', True):
+            self.coalescer = RequestCoalescer(ttl=request.get('coalesce_ttl', 60),
+                                              max_entries=request.get('coalesce_entries', 256))
+
+        # 分析结果缓存（响应体哈希 + 规则包版本），复检时未变化的页面不再解析
+        detection = CONFIG['detection']
+        self.result_cache = None
+        if detection.get('result_cache', True):
+            self.result_cache = ResultCache(self.db_path, self.db_writer,
+                                            max_entries=detection.get('result_cache_entries', 10000),
+                                            retention_days=detection.get('result_cache_days', 30))
+
+        # 条件请求（ETag/Last-Modified），304时依赖结果缓存沿用上次的结论
+        self.validator_store = None
+        if self.result_cache is not None and detection.get('conditional_requests', True):
+            self.validator_store = ValidatorStore(self.db_path, self.db_writer)
+
+        # 页面快照（按响应体哈希去重、zstd字典压缩），规则更新后可重新分析而不必重新抓取
+        snapshots = CONFIG.get('snapshots', {})
+        self.snapshot_store = None
+        if snapshots.get('enabled', True):
+            self.snapshot_store = SnapshotStore(snapshots.get('path', 'k_site_snapshots.db'),
+                                                max_bytes=snapshots.get('max_bytes', 2 * 1024 ** 3),
+                                                keep_per_domain=snapshots.get('keep_per_domain', 5),
+                                                level=snapshots.get('level', 10))
+
         # 搜索引擎User-Agent
         self.search_engines_ua = {
             'baidu': 'Mozilla/5.0 (compatible; Baiduspider/2.0; +http://www.baidu.com/search/spider.html)',
@@ -56,47 +126,89 @@ class KSiteTool:
             'sogou': 'Sogou web spider/4.0(+http://www.sogou.com/docs/help/webmasters.htm#07)',
             '360': 'Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; 360Spider)'
         }
-    
+
+    @property
+    def violation_keywords(self):
+        """当前规则包中的全部违规关键词"""
+        return self.rule_pack.keywords
+
+    @property
+    def keyword_matcher(self):
+        """当前规则包的关键词自动机"""
+        return self.rule_pack.matcher
+
+    def reload_rules(self):
+        """重新加载config.py中的规则，原子替换当前规则包（检测中的站点继续使用旧规则包）"""
+        with self._rules_lock:
+            pack = load_rule_pack(cache_dir=self.rule_cache_dir)
+            self.rule_pack = pack
+        return pack
+
     def _create_optimized_session(self):
         """创建优化的requests会话"""
         session = requests.Session()
-        
-        # 配置重试策略
-        retry_strategy = Retry(
+
+        # 配置重试策略（退避等待可以被停止检测和单站点时限打断）
+        retry_strategy = ScopedRetry(
             total=CONFIG['request']['max_retries'],
             backoff_factor=0.3,
             status_forcelist=[429, 500, 502, 503, 504],
         )
-        
-        # 配置HTTP适配器
-        adapter = HTTPAdapter(
+
+        # 配置HTTP适配器（连接登记到当前站点的取消范围，使用预解析的地址）
+        adapter = ScopedHTTPAdapter(
             pool_connections=SECURITY_CONFIG['pool_connections'],
             pool_maxsize=SECURITY_CONFIG['pool_maxsize'],
-            max_retries=retry_strategy
+            max_retries=retry_strategy,
+            addresses=self.dns.addresses if self.dns else None
         )
-        
+
         session.mount("http://", adapter)
         session.mount("https://", adapter)
-        
-        # 设置超时
+
+        # 设置超时和重定向次数上限
         session.timeout = (SECURITY_CONFIG['connection_timeout'], SECURITY_CONFIG['read_timeout'])
-        
+        session.max_redirects = SECURITY_CONFIG['max_redirects']
+
         return session
-    
+
+    def _create_dns_resolver(self):
+        """按SECURITY_CONFIG创建DNS预解析器，未开启时返回None"""
+        if not SECURITY_CONFIG.get('dns_prefetch', True):
+            return None
+        return DnsResolver(concurrency=SECURITY_CONFIG.get('dns_concurrency', 200),
+                           timeout=SECURITY_CONFIG.get('dns_timeout', 5),
+                           default_ttl=SECURITY_CONFIG.get('dns_cache_ttl', 300),
+                           negative_ttl=SECURITY_CONFIG.get('dns_negative_ttl', 3600))
+
+    def site_dns(self, url):
+        """站点主机的预解析结果（等待解析完成，期间可以被取消）；未开启预解析时返回None"""
+        if self.dns is None:
+            return None
+        return self._wait_future(self.dns.submit(urlparse(url).hostname))
+
+    def _wait_future(self, future):
+        """等待Future完成并返回结果，期间当前站点被停止或超时时抛出Cancelled"""
+        while wait([future], timeout=0.1).not_done:
+            checkpoint()
+        return future.result()
+
     def set_max_workers(self, workers):
         """设置最大工作线程数（1-100）"""
         self.max_workers = max(1, min(100, workers))
         CONFIG['request']['max_workers'] = self.max_workers
-    
+
     def stop_detection(self):
         """停止检测"""
         self.stop_flag.set()
-        
+        self.site_scopes.cancel_all()  # 关闭进行中的连接，打断重试等待
+        self.db_writer.flush(wait=False)  # 已完成站点的结果立即提交
+
     def init_database(self):
         """初始化数据库"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        
+
         # 创建网站监控表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sites (
@@ -112,7 +224,7 @@ class KSiteTool:
                 report_count INTEGER DEFAULT 0
             )
         ''')
-        
+
         # 创建举报记录表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS reports (
@@ -125,7 +237,7 @@ class KSiteTool:
                 FOREIGN KEY (site_id) REFERENCES sites (id)
             )
         ''')
-        
+
         # 创建检测日志表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS detection_logs (
@@ -138,34 +250,108 @@ class KSiteTool:
                 FOREIGN KEY (site_id) REFERENCES sites (id)
             )
         ''')
-        
+
         conn.commit()
+
+        # 升级旧数据库（补充列、建立发现记录表和索引，并从旧日志回填）
+        migrate_database(conn, self.rule_pack.matcher.category_of)
         conn.close()
-    
+
     def add_site(self, domain, keywords):
-        """添加监控网站"""
+        """添加监控网站（已存在时更新关键词），返回站点ID"""
+        return self.db_writer.call(self._upsert_site, domain, keywords)
+
+    def load_site_ids(self):
+        """载入全部域名到站点ID的映射，复检已知域名时不再查询sites表"""
         conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                INSERT INTO sites (domain, keywords, first_detected, last_checked)
-                VALUES (?, ?, ?, ?)
-            ''', (domain, keywords, datetime.now(), datetime.now()))
-            conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            return None
+            site_ids = dict(conn.execute('SELECT domain, id FROM sites'))
         finally:
             conn.close()
-    
+        self._site_ids = site_ids
+        return len(site_ids)
+
+    def _upsert_site(self, conn, domain, keywords, site_status=None):
+        """在写入线程中执行：插入或更新监控网站，返回站点ID
+
+        site_status为本次检测得到的站点状态（见_site_status），为None时只更新关键词
+        """
+        now = datetime.now()
+        if site_status is None:
+            row = conn.execute('''
+                INSERT INTO sites (domain, keywords, first_detected, last_checked)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(domain) DO UPDATE SET keywords = excluded.keywords
+                RETURNING id
+            ''', (domain, keywords, now, now)).fetchone()
+            self._site_ids[domain] = row[0]
+            return row[0]
+
+        values = (keywords, site_status['status'], site_status['violation_type'], now,
+                  site_status['baidu_indexed'], site_status['google_indexed'])
+
+        # 已知域名直接按主键更新
+        site_id = self._site_ids.get(domain)
+        if site_id is not None:
+            cursor = conn.execute('''
+                UPDATE sites SET keywords = ?, status = ?, violation_type = ?, last_checked = ?,
+                                 baidu_indexed = COALESCE(?, baidu_indexed),
+                                 google_indexed = COALESCE(?, google_indexed)
+                WHERE id = ?
+            ''', values + (site_id,))
+            if cursor.rowcount:
+                return site_id
+
+        # 新域名（或映射中的站点已被删除）
+        row = conn.execute('''
+            INSERT INTO sites (keywords, status, violation_type, last_checked, baidu_indexed, google_indexed,
+                               domain, first_detected)
+            VALUES (?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), ?, ?)
+            ON CONFLICT(domain) DO UPDATE SET
+                keywords = excluded.keywords,
+                status = excluded.status,
+                violation_type = excluded.violation_type,
+                last_checked = excluded.last_checked,
+                baidu_indexed = COALESCE(?, baidu_indexed),
+                google_indexed = COALESCE(?, google_indexed)
+            RETURNING id
+        ''', values + (domain, now, site_status['baidu_indexed'], site_status['google_indexed'])).fetchone()
+        self._site_ids[domain] = row[0]
+        return row[0]
+
+    def _site_status(self, result, rules):
+        """由一次检测结果得到sites表中的站点状态（状态、违规分类、收录情况；收录未知时为None）"""
+        normal_check = result.get('normal_check', {})
+        spider_check = result.get('spider_check', {})
+        categories = []
+        for keyword in normal_check.get('violations', []) + spider_check.get('violations', []):
+            category = rules.matcher.category_of(keyword) or 'other'
+            if category not in categories:
+                categories.append(category)
+
+        if 'error' in normal_check:
+            status = "无法访问"
+        elif categories:
+            status = "发现违规"
+        else:
+            status = "站点正常"
+
+        indexing = result.get('indexing_status') or {}
+        indexed = {key: None if indexing.get(key) is None else int(bool(indexing[key]))
+                   for key in ('baidu_indexed', 'google_indexed')}
+        return {
+            'status': status,
+            'violation_type': ', '.join(categories) or None,
+            **indexed
+        }
+
     def get_random_headers(self, engine=None):
         """获取随机请求头"""
         if engine and engine in self.search_engines_ua:
             user_agent = self.search_engines_ua[engine]
         else:
             user_agent = self.ua.random
-            
+
         return {
             'User-Agent': user_agent,
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -174,191 +360,527 @@ class KSiteTool:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         }
-    
-    def check_site_content(self, url, use_search_engine_ua=False):
+
+    def check_site_content(self, url, use_search_engine_ua=False, rules=None):
         """检查网站内容是否违规"""
+        # 整个页面使用同一个规则包，检测过程中热更新规则不会影响本次结果
+        rules = rules or self.rule_pack
+        fetched = self.fetch_page(url, use_search_engine_ua, rules)
+        return self.analyze_fetched(fetched, rules)
+
+    def request_headers(self, url, use_search_engine_ua=False, rules=None):
+        """请求头；上次的检测结论仍在结果缓存中时附带条件请求头"""
+        headers = self.get_random_headers('baidu' if use_search_engine_ua else None)
+        if self.validator_store is not None:
+            rules = rules or self.rule_pack
+            entry = self.validator_store.get(url, self._ua_class(use_search_engine_ua))
+            if entry is not None and self.result_cache.contains(entry['content_hash'], rules.version):
+                headers.update(self.validator_store.request_headers(entry))
+        return headers
+
+    def record_fetch(self, url, use_search_engine_ua, fetched):
+        """保存本次下载的校验信息；304时补全为上次下载的结果"""
+        if self.validator_store is None:
+            return fetched
+        return self.validator_store.record(url, self._ua_class(use_search_engine_ua), fetched)
+
+    def _ua_class(self, use_search_engine_ua):
+        return 'spider' if use_search_engine_ua else 'normal'
+
+    def _site_host(self, domain):
+        url = f"http://{domain}" if not domain.startswith('http') else domain
+        return urlparse(url).hostname or domain
+
+    def robots_allowed(self, url, use_search_engine_ua=False, parser=None):
+        """respect_robots_txt开启时检查robots.txt是否允许访问；parser为空时从缓存中取，没有时同步获取"""
+        if not SECURITY_CONFIG.get('respect_robots_txt'):
+            return True
+        parser = parser or self.robots_cache.get(url)
+        if parser is None:
+            try:
+                timeout = (SECURITY_CONFIG['connection_timeout'], SECURITY_CONFIG['read_timeout'])
+                response = self.session.get(self.robots_cache.robots_url(url), headers=self.get_random_headers(),
+                                            timeout=timeout)
+                parser = self.robots_cache.store(url, response.status_code, response.content)
+            except requests.RequestException:
+                parser = self.robots_cache.store(url, None)
+        return self.robots_cache.allowed(parser, url, 'Baiduspider' if use_search_engine_ua else '*')
+
+    async def robots_parser_async(self, url, fetcher):
+        """异步引擎获取robots.txt（已缓存时直接返回）"""
+        parser = self.robots_cache.get(url)
+        if parser is None:
+            fetched = await fetcher.fetch(self.robots_cache.robots_url(url), self.get_random_headers())
+            parser = self.robots_cache.store(url, fetched.get('status_code'), fetched.get('content', b''))
+        return parser
+
+    def _robots_blocked(self, url):
+        return {'url': url, 'error': 'robots.txt禁止访问', 'status': 'blocked'}
+
+    def fetch_page(self, url, use_search_engine_ua=False, rules=None):
+        """下载页面（只做网络I/O，返回原始响应体，解析交给analyze_fetched）
+
+        逐跳跟随重定向，每一跳与其他站点的相同请求合并（见_run_hop），结果附带本站点的redirect_chain
+        """
         if self.stop_flag.is_set():
             return {'url': url, 'status': 'stopped'}
-            
+
         try:
-            headers = self.get_random_headers('baidu' if use_search_engine_ua else None)
-            
+            if not self.robots_allowed(url, use_search_engine_ua):
+                return self._robots_blocked(url)
+
+            headers = self.request_headers(url, use_search_engine_ua, rules)
+
             # 使用配置的超时设置
             timeout = (SECURITY_CONFIG['connection_timeout'], SECURITY_CONFIG['read_timeout'])
-            response = self.session.get(url, headers=headers, timeout=timeout, allow_redirects=True)
-            
-            # 快速检查响应状态
-            if response.status_code >= 400:
-                return {
-                    'url': url,
-                    'status_code': response.status_code,
-                    'error': f'HTTP {response.status_code}',
-                    'status': 'error'
-                }
-            
-            response.encoding = response.apparent_encoding or 'utf-8'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 检查页面内容
-            page_text = soup.get_text().lower()
-            title = soup.title.string if soup.title else ''
-            meta_desc = ''
-            meta_keywords = ''
-            
-            # 获取meta信息
-            for meta in soup.find_all('meta'):
-                if meta.get('name') == 'description':
-                    meta_desc = meta.get('content', '')
-                elif meta.get('name') == 'keywords':
-                    meta_keywords = meta.get('content', '')
-            
-            # 检查违规内容
-            violations = []
-            for keyword in self.violation_keywords:
-                if keyword in page_text or keyword in title or keyword in meta_desc or keyword in meta_keywords:
-                    violations.append(keyword)
-            
-            # 检查隐藏链接和JS跳转
-            hidden_links = self.check_hidden_content(soup)
-            js_redirects = self.check_js_redirects(soup)
-            
-            # 检查TDK篡改
-            tdk_issues = self.check_tdk_tampering(soup)
-            
+            hop, chain = url, []
+            while True:
+                try:
+                    result, shared = self._run_hop(self._hop_key(hop, use_search_engine_ua, headers),
+                                                   lambda: self._fetch_hop(hop, headers, timeout))
+                except Abandoned:
+                    continue  # 合并的请求所属站点被取消，自行请求
+                hop = self._next_hop(hop, result, chain)
+                if hop is None:
+                    break
+            return self._chain_result(url, use_search_engine_ua, result, chain, shared)
+
+        except Exception as e:
+            return {
+                'url': url,
+                'error': str(e),
+                'status': 'error'
+            }
+
+    def _fetch_hop(self, url, headers, timeout):
+        """请求一跳（不跟随重定向）：重定向返回{'url', 'status_code', 'location'}，其他与fetch_page相同"""
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout, allow_redirects=False, stream=True)
+
+            try:
+                # 快速检查响应状态
+                if response.status_code >= 400:
+                    self.observe_fetch(started, response.status_code)
+                    return {
+                        'url': url,
+                        'status_code': response.status_code,
+                        'error': f'HTTP {response.status_code}',
+                        'status': 'error'
+                    }
+
+                if response.is_redirect:
+                    self.observe_fetch(started, response.status_code)
+                    return {'url': url, 'status_code': response.status_code,
+                            'location': urljoin(response.url, self.session.get_redirect_target(response))}
+
+                # 流式读取，超过上限的部分直接丢弃，边读边计算哈希
+                body = BodyBuffer(CONFIG['detection']['max_body_bytes'])
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not body.feed(chunk):
+                        break
+            finally:
+                response.close()
+
+            self.observe_fetch(started, response.status_code)
             return {
                 'url': url,
                 'status_code': response.status_code,
-                'title': title,
-                'meta_description': meta_desc,
-                'meta_keywords': meta_keywords,
-                'violations': violations,
-                'hidden_links': hidden_links,
-                'js_redirects': js_redirects,
-                'tdk_issues': tdk_issues,
-                'content_hash': hashlib.md5(response.text.encode()).hexdigest(),
-                'final_url': response.url
+                'final_url': response.url,
+                'content': body.content,
+                'content_hash': body.content_hash,
+                'encoding': charset_from_content_type(response.headers.get('Content-Type')),
+                'truncated': body.truncated,
+                'validators': response_validators(response.headers)
             }
-            
+
         except Exception as e:
+            self.observe_fetch(started, error=e)
             return {
                 'url': url,
                 'error': str(e),
                 'status': 'error'
             }
-    
-    def check_hidden_content(self, soup):
+
+    def _hop_key(self, url, use_search_engine_ua, headers):
+        """合并请求的键：规范化URL和UA类型；条件请求头不同的请求不合并（304只对发出请求的校验信息有效）"""
+        return (normalize_url(url), self._ua_class(use_search_engine_ua), headers.get('If-None-Match'),
+                headers.get('If-Modified-Since'))
+
+    def _run_hop(self, key, fetch):
+        """执行一跳请求，返回(结果, 是否来自其他站点的请求)
+
+        相同的请求正在进行或刚完成时等待并使用其结果；领头的站点被取消时抛出Abandoned
+        """
+        if self.coalescer is None:
+            return fetch(), False
+        flights = self.coalescer.fetches
+        future, leader = flights.lead(key)
+        if not leader:
+            return self._wait_future(future), True
+        try:
+            result = fetch()
+        except BaseException:
+            flights.abandon(key)
+            raise
+        self._finish_hop(key, result)
+        return result, False
+
+    def _finish_hop(self, key, result):
+        """交出一跳的结果；本站点被停止或超时导致的失败不交给其他站点，出错的结果不保留"""
+        scope = current_scope()
+        if self.stop_flag.is_set() or (scope is not None and scope.cancelled):
+            self.coalescer.fetches.abandon(key)
+        else:
+            self.coalescer.fetches.finish(key, result, keep='error' not in result)
+
+    def _next_hop(self, url, result, chain):
+        """重定向时把这一跳记入chain并返回下一跳的URL，否则返回None；超过重定向次数上限时抛出TooManyRedirects"""
+        if 'location' not in result:
+            return None
+        if len(chain) >= self.session.max_redirects:
+            raise requests.TooManyRedirects(f'Exceeded {self.session.max_redirects} redirects.')
+        chain.append({'url': url, 'status_code': result['status_code']})
+        return result['location']
+
+    def _chain_result(self, url, use_search_engine_ua, result, chain, shared):
+        """把最后一跳的结果（可能来自其他站点）作为本站点的下载结果，附带本站点的重定向链"""
+        fetched = dict(result, url=url)
+        if chain:
+            fetched['redirect_chain'] = chain
+        if shared:
+            fetched['coalesced'] = True
+        return self.record_fetch(url, use_search_engine_ua, fetched)
+
+    def observe_fetch(self, started, status_code=None, error=None):
+        """把一次下载的耗时和结果交给并发控制器；与并发无关的错误（连接被拒绝、域名不存在等）不计入"""
+        controller = self.concurrency
+        if controller is None:
+            return
+        if error is not None:
+            # 读取响应体时超时会被包装为ConnectionError
+            if isinstance(error, requests.Timeout) or 'timed out' in str(error):
+                outcome = 'timeout'
+            elif isinstance(error, requests.exceptions.RetryError):
+                outcome = 'overload'  # 429/5xx重试次数用完
+            else:
+                return
+        else:
+            outcome = 'overload' if status_code == 429 or status_code >= 500 else 'ok'
+        controller.record(time.monotonic() - started, outcome)
+
+    async def fetch_page_async(self, fetcher, url, use_search_engine_ua=False, rules=None, robots=None):
+        """异步引擎下载页面，结果与fetch_page相同；robots为已获取的robots.txt解析结果"""
+        if not self.robots_allowed(url, use_search_engine_ua, robots):
+            return self._robots_blocked(url)
+        headers = self.request_headers(url, use_search_engine_ua, rules)
+        hop, chain = url, []
+        try:
+            while True:
+                try:
+                    result, shared = await self._run_hop_async(
+                        self._hop_key(hop, use_search_engine_ua, headers),
+                        lambda: fetcher.fetch(hop, headers, self.stop_flag, allow_redirects=False))
+                except Abandoned:
+                    continue
+                hop = self._next_hop(hop, result, chain)
+                if hop is None:
+                    break
+        except requests.TooManyRedirects as e:
+            return {'url': url, 'error': str(e), 'status': 'error'}
+        return self._chain_result(url, use_search_engine_ua, result, chain, shared)
+
+    async def _run_hop_async(self, key, fetch):
+        """异步引擎执行一跳请求，同_run_hop"""
+        if self.coalescer is None:
+            return await fetch(), False
+        flights = self.coalescer.fetches
+        future, leader = flights.lead(key)
+        if not leader:
+            return await self._await_shared(future), True
+        try:
+            result = await fetch()
+        except BaseException:
+            flights.abandon(key)
+            raise
+        self._finish_hop(key, result)
+        return result, False
+
+    async def _await_shared(self, future):
+        """在事件循环中等待其他站点也在等待的Future；本任务被取消时不取消该Future"""
+        waiter = asyncio.wrap_future(future)
+        waiter.add_done_callback(lambda done: done.cancelled() or done.exception())  # 本任务已取消时取走异常
+        return await asyncio.shield(waiter)
+
+    def analyze_fetched(self, fetched, rules=None, pool=None, future=None):
+        """分析fetch_page的下载结果；future为已提交到分析进程池的任务"""
+        if 'content' not in fetched:
+            return fetched  # 下载失败或已停止
+
+        rules = rules or self.rule_pack
+        url = fetched['url']
+
+        try:
+            # 已提交的任务在提交前查过缓存，未提交时在这里查
+            analysis = self.cached_analysis(fetched, rules) if future is None else None
+            if analysis is None and future is None and fetched['content'] is None:
+                raise LookupError('未修改页面（304）的上次检测结果已不在缓存中')
+            if analysis is None:
+                # 解析一次、遍历一次，由各检测器分别汇总
+                if future is not None:
+                    analysis = pool.result(future, fetched['content'], rules, fetched['encoding'])
+                elif pool is not None:
+                    analysis = self.shared_analysis(fetched, rules, None, lambda: pool.result(
+                        None, fetched['content'], rules, fetched['encoding']))
+                else:
+                    analysis = self.shared_analysis(fetched, rules, None, lambda: analyze_body(
+                        fetched['content'], rules, encoding=fetched['encoding'], **self._analysis_options()))
+                self.store_analysis(fetched, rules, analysis)
+
+            return self._content_result(fetched, analysis, rules)
+
+        except Exception as e:
+            return {
+                'url': url,
+                'error': str(e),
+                'status': 'error'
+            }
+
+    def _content_result(self, fetched, analysis, rules):
+        """由下载结果和分析结果组成check_site_content格式的检测结果"""
+        return {
+            'url': fetched['url'],
+            'status_code': fetched['status_code'],
+            'title': analysis['title'],
+            'meta_description': analysis['meta_description'],
+            'meta_keywords': analysis['meta_keywords'],
+            'violations': analysis['violations'],
+            'hidden_links': analysis['hidden_links'],
+            'js_redirects': analysis['js_redirects'],
+            'tdk_issues': analysis['tdk_issues'],
+            'content_hash': fetched['content_hash'],
+            'final_url': fetched['final_url'],
+            'rule_version': rules.version,
+            **({'truncated': True} if fetched['truncated'] else {}),
+            **({'early_exit': True} if analysis.get('early_exit') else {}),
+            **({'cache_hit': True} if analysis.get('cache_hit') else {}),
+            **({'not_modified': True} if fetched.get('not_modified') else {}),
+            **({'profile': analysis['profile']} if 'profile' in analysis else {}),
+            **self._fetch_fields(fetched)
+        }
+
+    def _fetch_fields(self, fetched):
+        """检测结果中附带的下载信息：本站点的重定向链、是否与其他站点合并了请求"""
+        return {
+            **({'redirect_chain': fetched['redirect_chain']} if fetched.get('redirect_chain') else {}),
+            **({'coalesced': True} if fetched.get('coalesced') else {})
+        }
+
+    def _spider_base(self, spider_fetch, normal_fetch):
+        """爬虫页面的对比基准；任一次下载失败时返回None（直接完整分析爬虫页面）"""
+        if 'content' not in spider_fetch or 'content' not in normal_fetch:
+            return None
+        identical = spider_fetch['content_hash'] == normal_fetch['content_hash']
+        if not identical and (spider_fetch['content'] is None or normal_fetch['content'] is None):
+            return None  # 304时没有响应体可比较，直接分析爬虫页面（结论来自结果缓存）
+        return {
+            'content': normal_fetch['content'],
+            'content_hash': normal_fetch['content_hash'],
+            'identical': identical,
+            'max_distance': CONFIG['detection']['cloaking_max_distance']
+        }
+
+    def compare_spider_fetch(self, spider_fetch, normal_fetch, normal_check, rules=None, pool=None, future=None):
+        """分析爬虫UA的下载结果并与普通访问对比，返回(spider_check, cloaking)
+
+        响应体哈希相同，或差异很小且不涉及违规内容时，沿用普通访问的检测结果；
+        否则完整分析爬虫页面并逐项对比
+        """
+        rules = rules or self.rule_pack
+        base = self._spider_base(spider_fetch, normal_fetch)
+        if base is None:
+            spider_check = self.analyze_fetched(spider_fetch, rules, pool, future)
+            return spider_check, compare_checks(normal_check, spider_check)
+
+        if base['identical']:
+            cloaking = {'verdict': 'identical', 'method': 'hash', 'distance': 0.0}
+            return self._reuse_check(normal_check, spider_fetch), cloaking
+
+        try:
+            variant = self.cached_variant(spider_fetch, rules) if future is None else None
+            if variant is None:
+                if future is not None:
+                    variant = pool.result(future, spider_fetch['content'], rules, spider_fetch['encoding'], base)
+                elif pool is not None:
+                    variant = self.shared_analysis(spider_fetch, rules, base, lambda: pool.result(
+                        None, spider_fetch['content'], rules, spider_fetch['encoding'], base))
+                else:
+                    variant = self.shared_analysis(spider_fetch, rules, base, lambda: analyze_variant(
+                        spider_fetch['content'], base, rules, encoding=spider_fetch['encoding'],
+                        **self._analysis_options()))
+            if variant['analysis'] is not None:
+                self.store_analysis(spider_fetch, rules, variant['analysis'])
+        except Exception as e:
+            spider_check = {'url': spider_fetch['url'], 'error': str(e), 'status': 'error'}
+            return spider_check, compare_checks(normal_check, spider_check)
+
+        if variant['analysis'] is None:
+            cloaking = {'verdict': 'similar', 'method': 'segments', 'distance': variant['distance']}
+            return self._reuse_check(normal_check, spider_fetch), cloaking
+
+        spider_check = self._content_result(spider_fetch, variant['analysis'], rules)
+        cloaking = compare_checks(normal_check, spider_check)
+        if variant['distance'] is not None:
+            cloaking['distance'] = variant['distance']
+        return spider_check, cloaking
+
+    def submit_analysis(self, pool, fetched, rules, base=None):
+        """把下载结果提交到分析进程池，返回Future；不需要分析或没有进程池时返回None"""
+        if pool is None or 'content' not in fetched:
+            return None
+        if base is not None and base['identical']:
+            return None  # 与普通页面完全相同，不需要分析
+        # 页面与上次检测时相同：直接返回已完成的任务，不占用分析进程
+        cached = self.cached_analysis(fetched, rules) if base is None else self.cached_variant(fetched, rules)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        if fetched['content'] is None:
+            return None  # 304且上次的结果已不在缓存中，由analyze_fetched报告
+        if self.coalescer is None:
+            return pool.submit(fetched['content'], rules, self.stop_flag, fetched['encoding'], base)
+
+        # 其他站点的相同页面正在分析时共用同一个任务（领头任务未提交成功时由pool.result在本线程内分析）
+        flights = self.coalescer.analyses
+        key = self._analysis_key(fetched, rules, base)
+        shared, leader = flights.lead(key)
+        if not leader:
+            return shared
+        future = pool.submit(fetched['content'], rules, self.stop_flag, fetched['encoding'], base)
+        if future is None:
+            flights.abandon(key)
+        else:
+            future.add_done_callback(lambda done: self._finish_analysis(key, done))
+        return future
+
+    def _finish_analysis(self, key, future):
+        try:
+            result = future.result()
+        except BaseException as e:
+            self.coalescer.analyses.fail(key, e)
+        else:
+            self.coalescer.analyses.finish(key, result)
+
+    def _analysis_key(self, fetched, rules, base=None):
+        """合并分析的键：响应体哈希、规则包版本和对比基准的响应体哈希"""
+        return (fetched['content_hash'], rules.version, base['content_hash'] if base is not None else None)
+
+    def shared_analysis(self, fetched, rules, base, analyze):
+        """在当前线程内分析（analyze()），其他站点的相同页面正在分析时等待并使用其结果"""
+        if self.coalescer is None:
+            return analyze()
+        flights = self.coalescer.analyses
+        key = self._analysis_key(fetched, rules, base)
+        future, leader = flights.lead(key)
+        if not leader:
+            try:
+                return self._wait_future(future)
+            except Abandoned:
+                return analyze()
+        try:
+            result = analyze()
+        except Exception as e:
+            flights.fail(key, e)
+            raise
+        except BaseException:
+            flights.abandon(key)
+            raise
+        flights.finish(key, result)
+        return result
+
+    def cached_analysis(self, fetched, rules):
+        """按响应体哈希和规则包版本查找上次的分析结果，未命中时返回None"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(fetched.get('content_hash'), rules.version)
+
+    def cached_variant(self, spider_fetch, rules):
+        """爬虫页面命中缓存时直接作为完整分析结果（不再做片段比较），格式同analyze_variant"""
+        analysis = self.cached_analysis(spider_fetch, rules)
+        return None if analysis is None else {'distance': None, 'analysis': analysis}
+
+    def store_analysis(self, fetched, rules, analysis):
+        """保存分析结果到缓存"""
+        if self.result_cache is not None:
+            self.result_cache.put(fetched.get('content_hash'), rules.version, analysis)
+
+    def save_snapshots(self, domain, normal_fetch, spider_fetch):
+        """保存两次访问的页面快照（相同的响应体只存一份）"""
+        if self.snapshot_store is None:
+            return
+        captured_at = datetime.now()
+        for fetch, fetched in (('normal', normal_fetch), ('spider', spider_fetch)):
+            try:
+                self.snapshot_store.put(domain, fetched, fetch, captured_at)
+            except sqlite3.Error:
+                pass  # 快照保存失败不影响检测结果
+
+    def _reuse_check(self, normal_check, fetched):
+        """爬虫页面与普通页面相同时，沿用普通访问的检测结果"""
+        check = dict(normal_check, url=fetched['url'], status_code=fetched['status_code'],
+                     content_hash=fetched['content_hash'], final_url=fetched['final_url'],
+                     same_as_normal=True)
+        check.pop('redirect_chain', None)
+        check.pop('coalesced', None)
+        check.update(self._fetch_fields(fetched))
+        return check
+
+    def _analysis_options(self):
+        """页面分析选项（解析后端、编码采样大小、提前结束阈值等）"""
+        detection = CONFIG['detection']
+        return {
+            'parser': detection['parser'],
+            'profile': detection['profile'],
+            'sample_size': detection['encoding_sample_bytes'],
+            'verdict_threshold': detection['verdict_threshold'],
+        }
+
+    def check_hidden_content(self, soup, rules=None):
         """检查隐藏内容和暗链"""
-        hidden_elements = []
-        
-        # 检查display:none的元素
-        for element in soup.find_all(style=re.compile(r'display\s*:\s*none')):
-            if element.get_text().strip():
-                hidden_elements.append({
-                    'type': 'display_none',
-                    'content': element.get_text()[:100],
-                    'tag': element.name
-                })
-        
-        # 检查visibility:hidden的元素
-        for element in soup.find_all(style=re.compile(r'visibility\s*:\s*hidden')):
-            if element.get_text().strip():
-                hidden_elements.append({
-                    'type': 'visibility_hidden',
-                    'content': element.get_text()[:100],
-                    'tag': element.name
-                })
-        
-        # 检查iframe隐藏内容
-        for iframe in soup.find_all('iframe'):
-            if iframe.get('style') and ('display:none' in iframe.get('style') or 'visibility:hidden' in iframe.get('style')):
-                hidden_elements.append({
-                    'type': 'hidden_iframe',
-                    'src': iframe.get('src', ''),
-                    'tag': 'iframe'
-                })
-        
-        return hidden_elements
-    
-    def check_js_redirects(self, soup):
+        result, _ = analyze_document(soup, rules or self.rule_pack, (HiddenContentDetector,))
+        return result['hidden_links']
+
+    def check_js_redirects(self, soup, rules=None):
         """检查JS跳转和劫持"""
-        js_issues = []
-        
-        # 检查script标签中的跳转代码
-        for script in soup.find_all('script'):
-            if script.string:
-                script_content = script.string.lower()
-                
-                # 检查常见的跳转模式
-                redirect_patterns = [
-                    r'window\.location',
-                    r'document\.location',
-                    r'location\.href',
-                    r'location\.replace',
-                    r'window\.open'
-                ]
-                
-                for pattern in redirect_patterns:
-                    if re.search(pattern, script_content):
-                        js_issues.append({
-                            'type': 'js_redirect',
-                            'pattern': pattern,
-                            'content': script.string[:200]
-                        })
-        
-        return js_issues
-    
-    def check_tdk_tampering(self, soup):
+        result, _ = analyze_document(soup, rules or self.rule_pack, (JsRedirectDetector,))
+        return result['js_redirects']
+
+    def check_tdk_tampering(self, soup, rules=None):
         """检查TDK篡改"""
-        issues = []
-        
-        title = soup.title.string if soup.title else ''
-        
-        # 检查标题中的违规内容
-        for keyword in self.violation_keywords:
-            if keyword in title:
-                issues.append({
-                    'type': 'title_violation',
-                    'keyword': keyword,
-                    'title': title
-                })
-        
-        # 检查meta描述和关键词
-        for meta in soup.find_all('meta'):
-            content = meta.get('content', '').lower()
-            name = meta.get('name', '').lower()
-            
-            if name in ['description', 'keywords']:
-                for keyword in self.violation_keywords:
-                    if keyword in content:
-                        issues.append({
-                            'type': f'meta_{name}_violation',
-                            'keyword': keyword,
-                            'content': content[:100]
-                        })
-        
-        return issues
-    
+        result, _ = analyze_document(soup, rules or self.rule_pack, (TdkDetector,))
+        return result['tdk_issues']
+
     def check_site_indexing(self, domain):
         """检查网站收录状态 - 优化版本"""
         if self.stop_flag.is_set():
             return {'status': 'stopped'}
-            
+
         results = {}
         timeout = (SECURITY_CONFIG['connection_timeout'], SECURITY_CONFIG['read_timeout'])
-        
+
         # 检查百度收录 - 进一步优化版
         try:
             if self.stop_flag.is_set():
                 return results
-                
+
             # 添加随机延迟以避免被识别为机器人
-            time.sleep(random.uniform(1, 3))
-                
+            scoped_sleep(random.uniform(1, 3))
+
             baidu_query = f"site:{domain}"
             # 优先使用移动端接口，降低被拦截的风险
             baidu_url = f"https://m.baidu.com/s?word={baidu_query}"
-            
+
             # 使用移动端浏览器headers
             headers = {
                 'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
@@ -367,13 +889,13 @@ class KSiteTool:
                 'Accept-Encoding': 'gzip, deflate',
                 'Connection': 'keep-alive'
             }
-            
+
             response = self.session.get(baidu_url, headers=headers, timeout=timeout)
             # 处理编码问题
             if response.encoding is None or response.encoding == 'ISO-8859-1':
                 response.encoding = 'utf-8'
             response_text = response.text
-            
+
             # 如果内容看起来是乱码，尝试不同的解码方式
             if len([c for c in response_text[:100] if ord(c) > 127]) > 50:
                 try:
@@ -383,14 +905,14 @@ class KSiteTool:
                         response_text = response.content.decode('gbk', errors='ignore')
                     except:
                         response_text = response.content.decode('latin-1', errors='ignore')
-            
+
             # 记录调试信息
             results['baidu_debug'] = {
                 'url': baidu_url,
                 'status_code': response.status_code,
                 'content_length': len(response_text)
             }
-            
+
             # 更全面的百度收录判断模式
             baidu_patterns = [
                 r'找到相关结果约([\d,]+)个',
@@ -401,7 +923,7 @@ class KSiteTool:
                 r'共找到([\d,]+)个结果',
                 r'搜索结果约([\d,]+)个'
             ]
-            
+
             found_count = False
             for pattern in baidu_patterns:
                 match = re.search(pattern, response_text)
@@ -416,7 +938,7 @@ class KSiteTool:
                         break
                     except ValueError:
                         continue
-            
+
             # 如果没有找到数量，进行更详细的内容分析
             if not found_count:
                 # 首先检查是否被反爬虫拦截
@@ -440,9 +962,9 @@ class KSiteTool:
                         '未找到相关网页',
                         '没有找到符合查询条件'
                     ]
-                    
+
                     has_no_results = any(indicator in response_text for indicator in no_result_indicators)
-                    
+
                     if has_no_results:
                         results['baidu_indexed'] = False
                         results['baidu_count'] = 0
@@ -452,7 +974,7 @@ class KSiteTool:
                         from bs4 import BeautifulSoup
                         try:
                             soup = BeautifulSoup(response_text, 'html.parser')
-                            
+
                             # 查找包含域名的链接
                             domain_links = soup.find_all('a', href=True)
                             found_domain_links = 0
@@ -461,11 +983,11 @@ class KSiteTool:
                                 text = link.get_text().strip()
                                 if (domain in href or domain in text) and len(text) > 10:
                                     found_domain_links += 1
-                            
+
                             # 查找结果容器
                             result_containers = soup.find_all(['div', 'section', 'article'], 
                                                             class_=re.compile(r'result|item|card|content'))
-                            
+
                             if found_domain_links > 0 or len(result_containers) > 10:
                                 results['baidu_indexed'] = True
                                 results['baidu_count'] = f'约{found_domain_links}+' if found_domain_links > 0 else 'unknown'
@@ -477,9 +999,9 @@ class KSiteTool:
                                     domain.replace('www.', ''),
                                     f'www.{domain}' if not domain.startswith('www.') else domain[4:]
                                 ]
-                                
+
                                 has_domain_in_text = any(indicator in response_text for indicator in domain_indicators)
-                                
+
                                 if has_domain_in_text:
                                     results['baidu_indexed'] = True
                                     results['baidu_count'] = 'unknown'
@@ -488,7 +1010,7 @@ class KSiteTool:
                                     results['baidu_indexed'] = False
                                     results['baidu_count'] = 0
                                     results['baidu_reason'] = 'no_domain_in_results'
-                        
+
                         except Exception as e:
                             # 如果BeautifulSoup解析失败，回退到简单文本检查
                             domain_indicators = [
@@ -496,9 +1018,9 @@ class KSiteTool:
                                 domain.replace('www.', ''),
                                 f'www.{domain}' if not domain.startswith('www.') else domain[4:]
                             ]
-                            
+
                             has_domain_in_text = any(indicator in response_text for indicator in domain_indicators)
-                            
+
                             if has_domain_in_text:
                                 results['baidu_indexed'] = True
                                 results['baidu_count'] = 'unknown'
@@ -507,26 +1029,26 @@ class KSiteTool:
                                 results['baidu_indexed'] = False
                                 results['baidu_count'] = 0
                                 results['baidu_reason'] = 'no_domain_in_results'
-                
+
         except Exception as e:
             results['baidu_error'] = str(e)
             results['baidu_indexed'] = False
-        
+
         # 检查Google收录 - 改进版
         try:
             if self.stop_flag.is_set():
                 return results
-                
+
             # 添加随机延迟以避免被识别为机器人
-            time.sleep(random.uniform(1, 3))
-                
+            scoped_sleep(random.uniform(1, 3))
+
             google_query = f"site:{domain}"
             google_url = f"https://www.google.com/search?q={google_query}&num=10"
             headers = self.get_random_headers()
-            
+
             response = self.session.get(google_url, headers=headers, timeout=timeout)
             response_text = response.text.lower()
-            
+
             # 更准确的Google收录判断
             no_results_indicators = [
                 'did not match any documents',
@@ -534,16 +1056,16 @@ class KSiteTool:
                 'no results found',
                 'try different keywords'
             ]
-            
+
             has_results_indicators = [
                 'about',
                 'results',
                 domain.lower()
             ]
-            
+
             # 检查是否明确表示没有结果
             no_results = any(indicator in response_text for indicator in no_results_indicators)
-            
+
             if no_results:
                 results['google_indexed'] = False
                 results['google_count'] = 0
@@ -567,13 +1089,13 @@ class KSiteTool:
                     else:
                         results['google_indexed'] = False
                         results['google_count'] = 0
-                
+
         except Exception as e:
             results['google_error'] = str(e)
             results['google_indexed'] = False
-        
+
         return results
-    
+
     def submit_report_to_baidu(self, url, reason):
         """向百度提交举报"""
         try:
@@ -584,22 +1106,22 @@ class KSiteTool:
                 'type': 'violation',
                 'timestamp': int(time.time())
             }
-            
+
             # 这里应该是实际的百度举报API
             # 由于API限制，这里只是记录举报信息
-            
+
             return {
                 'status': 'submitted',
                 'platform': 'baidu',
                 'data': report_data
             }
-            
+
         except Exception as e:
             return {
                 'status': 'error',
                 'error': str(e)
             }
-    
+
     def submit_report_to_12377(self, url, reason):
         """向12377举报中心提交举报"""
         try:
@@ -610,73 +1132,192 @@ class KSiteTool:
                 'category': 'illegal_content',
                 'timestamp': int(time.time())
             }
-            
+
             return {
                 'status': 'submitted',
                 'platform': '12377',
                 'data': report_data
             }
-            
+
         except Exception as e:
             return {
                 'status': 'error',
                 'error': str(e)
             }
-    
+
     def batch_check_sites(self, sites_data, callback=None):
-        """批量检查网站（多线程并发版本）"""
-        results = []
-        completed_count = 0
-        total_count = len(sites_data)
-        
+        """批量检查网站（多线程并发版本），返回全部结果；本次运行记入续检日志"""
+        sites = self.start_run(sites_data)
+        return list(self.iter_check_sites(sites, callback, sites.run_id))
+
+    def start_run(self, sites):
+        """为一次批量检测分配运行ID，返回记录站点列表的迭代器（run_id属性为运行ID），交给iter_check_sites检测"""
+        settings = {'engine': CONFIG['request'].get('engine', 'threads'), 'max_workers': self.max_workers,
+                    'adaptive_concurrency': CONFIG['request'].get('adaptive_concurrency', True)}
+        sites = self.journal.create_run(sites, settings)
+        self.current_run_id = sites.run_id
+        return sites
+
+    def resume(self, run_id, callback=None):
+        """续检被中断的批量检测，按完成顺序逐个产出结果
+
+        跳过已完成的站点，其余站点（包括中断时正在检测的）重新检测
+        """
+        if self.journal.progress(run_id) is None:
+            raise LookupError(f'批量检测 {run_id} 不存在')
+        self.journal.reopen_run(run_id)
+        self.current_run_id = run_id
+        return self.iter_check_sites(self.journal.pending_sites(run_id), callback, run_id)
+
+    def iter_check_sites(self, sites, callback=None, run_id=None):
+        """批量检查网站，按完成顺序逐个产出结果
+
+        sites可以是任意可迭代对象（例如逐行读取域名文件的生成器），站点按需取出，
+        同时进行中的站点数有上限，结果不在内部累积，内存占用与列表长度无关；
+        给出run_id时每个站点完成后记入续检日志
+        """
         # 重置停止标志
         self.stop_flag.clear()
-        
+
+        # 已知域名的站点ID一次性载入，入库时按主键更新
+        self.load_site_ids()
+
+        # 解析和检测交给分析进程池，下载线程只负责网络I/O
+        pool = self._create_analysis_pool()
+
+        def submit_analysis(fetched, rules, base=None):
+            """下载成功后立即提交分析，与后续下载并行进行；base为爬虫页面的对比基准"""
+            return self.submit_analysis(pool, fetched, rules, base)
+
+        site_deadline = CONFIG['request'].get('site_deadline') or None
+
+        def cancelled_result(domain, keywords, reason):
+            """停止检测时不产出结果（站点留待续检），超过单站点时限时记为错误"""
+            if self.stop_flag.is_set():
+                return None
+            return {
+                'domain': domain,
+                'keywords': keywords,
+                'error': reason,
+                'check_time': datetime.now().isoformat()
+            }
+
+        def dead_result(domain, keywords, dns):
+            """DNS预解析确认失效（不存在或没有地址）的域名不发起HTTP请求，直接记为错误"""
+            return {
+                'domain': domain,
+                'keywords': keywords,
+                'error': f"DNS解析失败：{STATUS_TEXT[dns['status']]}",
+                'dns_status': dns['status'],
+                'check_time': datetime.now().isoformat()
+            }
+
         def check_single_site(site_info):
+            """检查单个网站；所有步骤共用单站点时限"""
+            scope = self.site_scopes.open(site_deadline)
+            try:
+                with scope:
+                    return check_site(site_info)
+            finally:
+                self.site_scopes.close(scope)
+
+        def check_site(site_info):
             """检查单个网站"""
             domain, keywords = site_info
-            
+
             if self.stop_flag.is_set():
                 return None
-                
+
             try:
                 # 检查网站内容
                 url = f"http://{domain}" if not domain.startswith('http') else domain
-                
+
+                dns = self.site_dns(url)
+                if dns is not None and dns['status'] in DEAD_STATUSES:
+                    return dead_result(domain, keywords, dns)
+
+                # 同一站点的两次检查使用同一个规则包
+                rules = self.rule_pack
+
                 # 普通用户访问检查
-                normal_check = self.check_site_content(url, use_search_engine_ua=False)
-                
+                normal_fetch = self.fetch_page(url, use_search_engine_ua=False, rules=rules)
+                normal_future = submit_analysis(normal_fetch, rules)
+
                 if self.stop_flag.is_set():
                     return None
-                
+                checkpoint()
+
                 # 搜索引擎爬虫访问检查
-                spider_check = self.check_site_content(url, use_search_engine_ua=True)
-                
+                spider_fetch = self.fetch_page(url, use_search_engine_ua=True, rules=rules)
+                spider_future = submit_analysis(spider_fetch, rules, self._spider_base(spider_fetch, normal_fetch))
+
                 if self.stop_flag.is_set():
                     return None
-                
-                # 检查收录状态
-                indexing_status = self.check_site_indexing(domain)
-                
-                result = {
+                checkpoint()
+
+                return complete_site(site_info, rules, normal_fetch, normal_future, spider_fetch, spider_future)
+
+            except Cancelled as e:
+                return cancelled_result(domain, keywords, str(e))
+            except Exception as e:
+                return {
                     'domain': domain,
                     'keywords': keywords,
-                    'normal_check': normal_check,
-                    'spider_check': spider_check,
-                    'indexing_status': indexing_status,
+                    'error': str(e),
                     'check_time': datetime.now().isoformat()
                 }
-                
-                # 保存到数据库
-                try:
-                    site_id = self.add_site(domain, keywords)
-                    if site_id:
-                        self.save_detection_log(site_id, result)
-                except Exception as db_error:
-                    result['db_error'] = str(db_error)
-                
-                return result
-                
+
+        async def check_single_site_async(site_info, fetcher, loop, executor):
+            """检查单个网站（异步引擎：两次下载在事件循环中并发，其余步骤交给线程池）
+
+            停止检测或超过单站点时限时取消本任务，线程池中的步骤在取消范围内同时中断
+            """
+            domain, keywords = site_info
+
+            if self.stop_flag.is_set():
+                return None
+
+            scope = self.site_scopes.open(site_deadline)
+            task = asyncio.current_task()
+            scope.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+            try:
+                url = f"http://{domain}" if not domain.startswith('http') else domain
+                rules = self.rule_pack
+
+                if self.dns is not None:
+                    dns = await self._await_shared(self.dns.submit(urlparse(url).hostname))
+                    if dns['status'] in DEAD_STATUSES:
+                        return dead_result(domain, keywords, dns)
+
+                # robots.txt只获取一次，两次访问共用
+                robots = None
+                if SECURITY_CONFIG.get('respect_robots_txt'):
+                    robots = await self.robots_parser_async(url, fetcher)
+
+                # 普通用户与搜索引擎爬虫两次访问
+                normal_fetch, spider_fetch = await asyncio.gather(
+                    self.fetch_page_async(fetcher, url, False, rules, robots),
+                    self.fetch_page_async(fetcher, url, True, rules, robots))
+
+                if self.stop_flag.is_set():
+                    return None
+
+                def finish():
+                    with scope:
+                        normal_future = submit_analysis(normal_fetch, rules)
+                        spider_future = submit_analysis(spider_fetch, rules,
+                                                        self._spider_base(spider_fetch, normal_fetch))
+                        return complete_site(site_info, rules, normal_fetch, normal_future,
+                                             spider_fetch, spider_future)
+
+                return await loop.run_in_executor(executor, finish)
+
+            except asyncio.CancelledError:
+                if not scope.cancelled:
+                    raise
+                return cancelled_result(domain, keywords, scope.reason)
+            except Cancelled as e:
+                return cancelled_result(domain, keywords, str(e))
             except Exception as e:
                 return {
                     'domain': domain,
@@ -684,63 +1325,368 @@ class KSiteTool:
                     'error': str(e),
                     'check_time': datetime.now().isoformat()
                 }
-        
-        # 使用线程池并发执行
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_site = {executor.submit(check_single_site, site): site for site in sites_data}
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_site):
-                if self.stop_flag.is_set():
+            finally:
+                self.site_scopes.close(scope)
+
+        def complete_site(site_info, rules, normal_fetch, normal_future, spider_fetch, spider_future):
+            """检查收录状态、汇总分析结果并保存"""
+            domain, keywords = site_info
+            # 检查收录状态
+            indexing_status = self.check_site_indexing(domain)
+            checkpoint()
+
+            # 分析进行期间保存页面快照
+            self.save_snapshots(domain, normal_fetch, spider_fetch)
+
+            # 等待分析结果
+            normal_check = self.analyze_fetched(normal_fetch, rules, pool, normal_future)
+            spider_check, cloaking = self.compare_spider_fetch(spider_fetch, normal_fetch, normal_check, rules,
+                                                               pool, spider_future)
+
+            result = {
+                'domain': domain,
+                'keywords': keywords,
+                'normal_check': normal_check,
+                'spider_check': spider_check,
+                'cloaking': cloaking,
+                'indexing_status': indexing_status,
+                'check_time': datetime.now().isoformat()
+            }
+
+            # 交给写入线程保存（失败计入写入统计）
+            findings = findings_from_result(result, rules.matcher.category_of)
+            self.db_writer.submit(self._save_check_result, domain, keywords, result,
+                                  self._site_status(result, rules), findings, run_id,
+                                  getattr(site_info, 'position', None))
+
+            return result
+
+        if CONFIG['request'].get('engine') == 'async' and async_engine_available():
+            # 异步引擎：少量线程维持大量并发下载
+            completed = self._iter_async_batch(sites, check_single_site_async)
+        else:
+            # 使用线程池并发执行
+            completed = self._iter_batch(sites, check_single_site)
+
+        completed_count = 0
+        total_count = len(sites) if hasattr(sites, '__len__') else None
+        finished = False
+        try:
+            for site, result in completed:
+                completed_count += 1
+                if run_id is not None and 'error' in result and hasattr(site, 'position'):
+                    # 正常结果在保存检测结果的同一个写入任务中标记完成（见_save_check_result）
+                    self.journal.mark_done(run_id, site.position)
+
+                # 回调进度更新
+                if callback:
+                    callback(completed_count, total_count, result)
+                yield result
+            finished = not self.stop_flag.is_set()
+        finally:
+            completed.close()
+            if run_id is not None:
+                if not finished and isinstance(sites, JournaledSites):
+                    sites.record_rest()  # 尚未取出的站点也记入日志，续检时继续
+                self.journal.finish_run(run_id, 'completed' if finished else 'stopped')
+            if pool is not None:
+                pool.shutdown(cancel=self.stop_flag.is_set())
+            if self.result_cache is not None:
+                self.result_cache.flush()
+            if self.validator_store is not None:
+                self.validator_store.flush()
+            if self.snapshot_store is not None:
+                self.snapshot_store.flush()
+            if self.coalescer is not None:
+                self.coalescer.clear()
+            self.db_writer.flush()
+
+    def _create_analysis_pool(self):
+        """按配置创建分析进程池，不可用时返回None（在下载线程内分析）"""
+        settings = CONFIG.get('analysis', {})
+        if not settings.get('use_process_pool', False):
+            return None
+        try:
+            return AnalysisPool(self.rule_pack, cache_dir=self.rule_cache_dir,
+                                max_processes=settings.get('max_processes', 0),
+                                queue_size=settings.get('queue_size', 0),
+                                **self._analysis_options())
+        except (OSError, NotImplementedError, ImportError):
+            return None
+
+    def _create_scheduler(self):
+        """按SECURITY_CONFIG创建站点调度器（按注册域名和IP分组限速、限制并发）"""
+        return PolitenessScheduler(rate=SECURITY_CONFIG.get('request_rate_limit', 10),
+                                   max_per_group=SECURITY_CONFIG.get('max_concurrent_per_host', 2),
+                                   group_by_ip=SECURITY_CONFIG.get('group_by_ip', True),
+                                   dns_ttl=SECURITY_CONFIG.get('dns_cache_ttl', 300),
+                                   resolve=self.dns.first_address if self.dns else resolve_host)
+
+    def _create_controller(self, max_limit):
+        """按CONFIG['request']创建自适应并发控制器，未开启时返回None（使用固定并发）"""
+        settings = CONFIG['request']
+        if not settings.get('adaptive_concurrency', True):
+            return None
+        return AimdController(initial=settings.get('initial_concurrency', 8),
+                              min_limit=settings.get('min_concurrency', 2), max_limit=max_limit)
+
+    def _fill_scheduler(self, scheduler, site_iter, lookahead):
+        """按需从站点列表中取出站点放入调度队列，列表取完时返回False"""
+        while len(scheduler) < lookahead:
+            site = next(site_iter, None)
+            if site is None:
+                return False
+            host = self._site_host(site[0])
+            if self.dns is not None:
+                self.dns.submit(host)  # 进入队列的同时开始预解析
+            scheduler.add(site, host)
+        return True
+
+    def _iter_batch(self, sites, check_single_site):
+        """在下载线程池中执行批量检查，按完成顺序产出(站点, 结果)；已提交未完成的站点数不超过max_in_flight
+
+        站点先进入调度队列，只派发所属主机当前可用的站点，下载线程不会等待热点主机；
+        开启自适应并发时同时进行的站点数由并发控制器决定，线程数只是上限
+        """
+        window = CONFIG['request'].get('max_in_flight') or self.max_workers * 2
+        lookahead = max(window, SECURITY_CONFIG.get('scheduler_lookahead', 1000))
+        workers = min(self.max_workers, SECURITY_CONFIG.get('max_concurrent_requests', 100))
+        site_iter = iter(sites)
+        sites_left = True
+        scheduler = self._create_scheduler()
+        controller = self.concurrency = self._create_controller(workers)
+        future_to_site = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    # 按需取出站点，派发可用的站点补足窗口
+                    if sites_left:
+                        sites_left = self._fill_scheduler(scheduler, site_iter, lookahead)
+                    limit = controller.limit if controller else window
+                    while len(future_to_site) < limit and not self.stop_flag.is_set():
+                        ready = scheduler.pop_ready()
+                        if ready is None:
+                            break
+                        future_to_site[executor.submit(check_single_site, ready[0])] = ready
+                    if controller:
+                        controller.in_flight(len(future_to_site))
+                    if self.stop_flag.is_set() and not future_to_site:
+                        break
+                    if not future_to_site and not len(scheduler):
+                        break
+
+                    # 处理完成的任务；窗口未满且队列中的站点都在等待令牌时最多等到下一个站点可以派发，
+                    # 窗口已满时只能等待站点完成（不按delay()轮询，否则可派发的站点会让等待立即返回）
+                    if not future_to_site:
+                        self.stop_flag.wait(scheduler.delay() or 0)
+                        continue
+                    timeout = scheduler.delay() if len(scheduler) and len(future_to_site) < limit else None
+                    done, _ = wait(future_to_site, timeout=timeout, return_when=FIRST_COMPLETED)
+                    # 停止时已完成的站点仍然产出（结果已交给写入线程保存）
+                    for future in done:
+                        site, ticket = future_to_site.pop(future)
+                        scheduler.release(ticket)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = {
+                                'domain': site[0],
+                                'keywords': site[1],
+                                'error': f"Future execution error: {str(e)}",
+                                'check_time': datetime.now().isoformat()
+                            }
+                        if result is not None:
+                            yield site, result
+                    if self.stop_flag.is_set():
+                        break
+            finally:
+                # 取消所有未完成的任务
+                for future in future_to_site:
+                    future.cancel()
+                scheduler.close()
+
+    def _iter_async_batch(self, sites, check_single_site_async):
+        """在事件循环中执行批量检查，按完成顺序产出(站点, 结果)；同时进行的站点数不超过async_concurrency
+
+        事件循环由本生成器逐步驱动（每次运行到至少一个站点完成），不需要额外的线程；
+        开启自适应并发时async_concurrency只是上限
+        """
+        settings = CONFIG['request']
+        window = settings.get('async_concurrency', 1000)
+        lookahead = max(window, SECURITY_CONFIG.get('scheduler_lookahead', 1000))
+        site_iter = iter(sites)
+        sites_left = True
+        scheduler = self._create_scheduler()
+        controller = self.concurrency = self._create_controller(window)
+        tasks = {}
+
+        async def create_fetcher():
+            return AsyncFetcher(max_connections=min(window, SECURITY_CONFIG.get('max_concurrent_requests', 100)),
+                                per_host_limit=settings.get('per_host_limit', 4),
+                                max_redirects=SECURITY_CONFIG['max_redirects'],
+                                connect_timeout=SECURITY_CONFIG['connection_timeout'],
+                                read_timeout=SECURITY_CONFIG['read_timeout'],
+                                max_retries=settings['max_retries'],
+                                max_body_bytes=CONFIG['detection']['max_body_bytes'],
+                                observer=controller.record if controller else None,
+                                addresses=self.dns.addresses if self.dns else None)
+
+        loop = asyncio.new_event_loop()
+        fetcher = loop.run_until_complete(create_fetcher())
+        try:
+            # 收录检查、分析和入库等阻塞步骤在线程池中执行
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    while True:
+                        if sites_left:
+                            sites_left = self._fill_scheduler(scheduler, site_iter, lookahead)
+                        limit = controller.limit if controller else window
+                        while len(tasks) < limit and not self.stop_flag.is_set():
+                            ready = scheduler.pop_ready()
+                            if ready is None:
+                                break
+                            task = loop.create_task(check_single_site_async(ready[0], fetcher, loop, executor))
+                            tasks[task] = ready
+                        if controller:
+                            controller.in_flight(len(tasks))
+                        if self.stop_flag.is_set() and not tasks:
+                            break
+                        if not tasks and not len(scheduler):
+                            break
+
+                        # 窗口已满时只等待站点完成（同_iter_batch）
+                        if not tasks:
+                            self.stop_flag.wait(scheduler.delay() or 0)
+                            continue
+                        timeout = scheduler.delay() if len(scheduler) and len(tasks) < limit else None
+                        done, _ = loop.run_until_complete(
+                            asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED))
+                        for task in done:
+                            site, ticket = tasks.pop(task)
+                            scheduler.release(ticket)
+                            result = task.result()
+                            if result is not None:
+                                yield site, result
+                        if self.stop_flag.is_set():
+                            break
+                finally:
                     # 取消所有未完成的任务
-                    for f in future_to_site:
-                        f.cancel()
+                    for task in tasks:
+                        task.cancel()
+                    if tasks:
+                        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                    scheduler.close()
+        finally:
+            loop.run_until_complete(fetcher.close())
+            loop.close()
+
+    def replay_snapshots(self, since=None, latest_only=False, callback=None):
+        """离线重放：用当前规则包重新分析快照库中的页面，不发起任何网络请求
+
+        每次检测（普通用户和爬虫两份快照）写入一条检测日志，检测时间沿用原检测时间，
+        整批日志归入新的一代并标记规则包版本；不更新站点状态和收录信息。返回本代的统计
+        """
+        if self.snapshot_store is None:
+            raise RuntimeError('未启用页面快照')
+
+        self.stop_flag.clear()
+        self.load_site_ids()
+        rules = self.rule_pack
+        generation_id = self.db_writer.call(start_generation, rules.version, 'replay')
+        stats = {'generation_id': generation_id, 'rule_version': rules.version,
+                 'captures': 0, 'violations': 0, 'skipped': 0}
+
+        # 解析和检测全部交给分析进程池，主线程只负责读取快照和提交
+        pool = self._create_analysis_pool()
+        window = pool.queue_size * 2 if pool is not None else 0
+        in_flight = deque()
+
+        def complete(domain, captured_at, normal_fetch, spider_fetch, normal_future, spider_future):
+            normal_check = self.analyze_fetched(normal_fetch, rules, pool, normal_future)
+            spider_check, cloaking = self.compare_spider_fetch(spider_fetch, normal_fetch, normal_check, rules,
+                                                               pool, spider_future)
+            result = {
+                'domain': domain,
+                'normal_check': normal_check,
+                'spider_check': spider_check,
+                'cloaking': cloaking,
+                'check_time': captured_at,
+                'replay': {'generation_id': generation_id, 'rule_version': rules.version}
+            }
+            findings = findings_from_result(result, rules.matcher.category_of)
+            self.db_writer.submit(self._save_replay_log, domain, result, findings, generation_id, captured_at)
+
+            stats['captures'] += 1
+            if normal_check.get('violations'):
+                stats['violations'] += 1
+            if callback:
+                callback(stats['captures'], result)
+
+        try:
+            for domain, captured_at, fetches in self.snapshot_store.iter_captures(since, latest_only):
+                if self.stop_flag.is_set():
                     break
-                
-                try:
-                    result = future.result()
-                    if result is not None:
-                        results.append(result)
-                        completed_count += 1
-                        
-                        # 回调进度更新
-                        if callback:
-                            callback(completed_count, total_count, result)
-                            
-                except Exception as e:
-                    site = future_to_site[future]
-                    error_result = {
-                        'domain': site[0],
-                        'keywords': site[1],
-                        'error': f"Future execution error: {str(e)}",
-                        'check_time': datetime.now().isoformat()
-                    }
-                    results.append(error_result)
-                    completed_count += 1
-                    
-                    if callback:
-                        callback(completed_count, total_count, error_result)
-        
-        return results
-    
+                normal_fetch = fetches.get('normal')
+                if normal_fetch is None:
+                    stats['skipped'] += 1  # 普通访问的快照已被淘汰
+                    continue
+                spider_fetch = fetches.get('spider') or {'url': normal_fetch['url'], 'error': '没有爬虫访问的快照',
+                                                         'status': 'error'}
+                normal_future = self.submit_analysis(pool, normal_fetch, rules)
+                spider_future = self.submit_analysis(pool, spider_fetch, rules,
+                                                     self._spider_base(spider_fetch, normal_fetch))
+                in_flight.append((domain, captured_at, normal_fetch, spider_fetch, normal_future, spider_future))
+                while len(in_flight) > window:
+                    complete(*in_flight.popleft())
+
+            while in_flight and not self.stop_flag.is_set():
+                complete(*in_flight.popleft())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel=self.stop_flag.is_set())
+            if self.result_cache is not None:
+                self.result_cache.flush()
+            self.db_writer.call(finish_generation, generation_id, stats['captures'], stats['violations'])
+
+        return stats
+
     def save_detection_log(self, site_id, result):
         """保存检测日志"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        findings = findings_from_result(result, self.rule_pack.matcher.category_of)
+        self.db_writer.call(self._insert_detection_log, site_id, result, findings)
+
+    def _insert_detection_log(self, conn, site_id, result, findings=(), generation_id=None, check_time=None):
+        """在写入线程中执行：插入检测日志及拆分后的发现记录"""
         violation_found = bool(result.get('normal_check', {}).get('violations', []))
         violation_details = json.dumps(result, ensure_ascii=False)
         content_hash = result.get('normal_check', {}).get('content_hash', '')
-        
-        cursor.execute('''
-            INSERT INTO detection_logs (site_id, check_time, violation_found, violation_details, page_content_hash)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (site_id, datetime.now(), violation_found, violation_details, content_hash))
-        
-        conn.commit()
-        conn.close()
-    
+        rule_version = result.get('normal_check', {}).get('rule_version')
+
+        log_id = conn.execute('''
+            INSERT INTO detection_logs (site_id, check_time, violation_found, violation_details, page_content_hash,
+                                        rule_version, generation_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (site_id, check_time or datetime.now(), violation_found, violation_details, content_hash,
+              rule_version, generation_id)).lastrowid
+        insert_findings(conn, [(log_id,) + finding for finding in findings])
+
+    def _save_check_result(self, conn, domain, keywords, result, site_status, findings, run_id=None,
+                           position=None):
+        """在写入线程中执行：更新站点状态并记录本次检测日志；给出run_id时同时在续检日志中标记该位置的站点完成"""
+        site_id = self._upsert_site(conn, domain, keywords, site_status)
+        self._insert_detection_log(conn, site_id, result, findings)
+        if run_id is not None and position is not None:
+            self.journal.mark_done_in(conn, run_id, position)
+
+    def _save_replay_log(self, conn, domain, result, findings, generation_id, check_time):
+        """在写入线程中执行：记录离线重放的检测日志（不更新站点状态）"""
+        site_id = self._site_ids.get(domain)
+        if site_id is None:
+            row = conn.execute('SELECT id FROM sites WHERE domain = ?', (domain,)).fetchone()
+            site_id = row[0] if row else None
+        self._insert_detection_log(conn, site_id, result, findings, generation_id, check_time)
+
     def generate_report(self, results):
         """生成检测报告"""
         report = {
@@ -749,48 +1695,83 @@ class KSiteTool:
             'indexed_sites': 0,
             'hidden_content_sites': 0,
             'js_redirect_sites': 0,
+            'cloaked_sites': 0,
             'details': []
         }
-        
+
         for result in results:
             if 'error' in result:
                 continue
-                
+
             normal_check = result.get('normal_check', {})
             violations = normal_check.get('violations', [])
             hidden_links = normal_check.get('hidden_links', [])
             js_redirects = normal_check.get('js_redirects', [])
             indexing = result.get('indexing_status', {})
-            
+
             if violations:
                 report['violation_sites'] += 1
-            
+
             if indexing.get('baidu_indexed') or indexing.get('google_indexed'):
                 report['indexed_sites'] += 1
-            
+
             if hidden_links:
                 report['hidden_content_sites'] += 1
-            
+
             if js_redirects:
                 report['js_redirect_sites'] += 1
-            
+
+            if result.get('cloaking', {}).get('verdict') == 'cloaked':
+                report['cloaked_sites'] += 1
+
             report['details'].append({
                 'domain': result['domain'],
                 'violations': violations,
                 'hidden_content': len(hidden_links),
                 'js_redirects': len(js_redirects),
+                'cloaking': result.get('cloaking', {}).get('verdict', ''),
                 'baidu_indexed': indexing.get('baidu_indexed', False),
                 'google_indexed': indexing.get('google_indexed', False)
             })
-        
+
         return report
 
 if __name__ == "__main__":
-    # 测试代码
-    tool = KSiteTool()
-    
-    # 测试单个网站检查
-    test_url = "http://example.com"
-    result = tool.check_site_content(test_url)
-
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    parser = argparse.ArgumentParser(description='K站工具命令行')
+    commands = parser.add_subparsers(dest='command')
+    check_parser = commands.add_parser('check', help='检查单个网站')
+    check_parser.add_argument('url', nargs='?', default='http://example.com')
+    replay_parser = commands.add_parser('replay', help='用当前规则包重新分析已保存的页面快照（不联网）')
+    replay_parser.add_argument('--since', help='只重放该时间之后的检测，例如 2026-09-01')
+    replay_parser.add_argument('--latest', action='store_true', help='每个域名只重放最近一次检测')
+    export_parser = commands.add_parser('export', help='导出历史记录（格式由扩展名决定：xlsx/csv/jsonl/json/parquet）')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--db', default='k_site_data.db')
+    export_parser.add_argument('--table', action='append', choices=list(exporters.HISTORY_TABLES),
+                               help='要导出的表，可重复指定，默认全部')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        # 直接从数据库导出，不需要初始化检测工具
+        start = time.time()
+        count = exporters.export_history(args.path, args.db, args.table or tuple(exporters.HISTORY_TABLES))
+        print(f"已导出 {count} 行到 {args.path}，耗时 {time.time() - start:.1f} 秒")
+    elif args.command == 'replay':
+        tool = KSiteTool()
+        start = time.time()
+
+        def progress(count, result):
+            if count % 100 == 0:
+                print(f"已重放 {count} 次检测", flush=True)
+
+        stats = tool.replay_snapshots(since=args.since, latest_only=args.latest, callback=progress)
+        tool.db_writer.close()
+        print(f"第 {stats['generation_id']} 代（规则包 {stats['rule_version']}）：重放 {stats['captures']} 次检测，"
+              f"违规 {stats['violations']} 次，跳过 {stats['skipped']} 次，耗时 {time.time() - start:.1f} 秒")
+    else:
+        # 测试单个网站检查
+        tool = KSiteTool()
+        test_url = getattr(args, 'url', None) or "http://example.com"
+        result = tool.check_site_content(test_url)
+
+        print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 关键词匹配器
+基于Aho-Corasick自动机的多模式关键词匹配，一次扫描找出全部违规关键词
+"""
+
+import re
+import time
+from collections import deque, namedtuple
+
+try:
+    import ahocorasick  # pyahocorasick（C实现，可选）
+except ImportError:
+    ahocorasick = None
+
+# 单次命中：关键词、分类、起止偏移（end为开区间）
+KeywordMatch = namedtuple('KeywordMatch', ['keyword', 'category', 'start', 'end'])
+
+class KeywordMatcher:
+    """编译后的多模式关键词匹配器
+    
+    构建完成后只读，可在多个工作线程之间共享。
+    安装了pyahocorasick时使用C实现的自动机，否则使用纯Python实现。
+    """
+    
+    def __init__(self, keywords_by_category, use_native=True):
+        pairs = ((category, keyword)
+                 for category, keywords in keywords_by_category.items()
+                 for keyword in keywords)
+        self._load(pairs, use_native)
+    
+    @classmethod
+    def from_keywords(cls, keywords, categories=None, default_category='other', use_native=True):
+        """从扁平关键词列表构建，分类取自categories字典，保持列表原有顺序"""
+        lookup = {}
+        for category, words in (categories or {}).items():
+            for word in words:
+                lookup.setdefault(word, category)
+        
+        matcher = cls.__new__(cls)
+        matcher._load(((lookup.get(keyword, default_category), keyword) for keyword in keywords), use_native)
+        return matcher
+    
+    def _load(self, pairs, use_native):
+        """登记关键词并构建自动机"""
+        # 关键词按定义顺序去重，同一关键词只保留第一个分类
+        self.keywords = []
+        self.categories = []
+        self._index = {}
+        for category, keyword in pairs:
+            if not keyword or keyword in self._index:
+                continue
+            self._index[keyword] = len(self.keywords)
+            self.keywords.append(keyword)
+            self.categories.append(category)
+        self.max_length = max(map(len, self.keywords), default=0)
+        
+        self.backend = 'native' if (use_native and ahocorasick is not None) else 'python'
+        if self.backend == 'native':
+            self._build_native()
+        else:
+            self._build_python()
+    
+    def _build_native(self):
+        """构建pyahocorasick自动机"""
+        automaton = ahocorasick.Automaton()
+        for index, keyword in enumerate(self.keywords):
+            automaton.add_word(keyword, index)
+        if self.keywords:
+            automaton.make_automaton()
+        self._automaton = automaton
+    
+    def _build_python(self):
+        """构建纯Python自动机（goto/fail/output表）"""
+        goto = [{}]
+        output = [()]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    output.append(())
+                state = next_state
+            output[state] = output[state] + (index,)
+        
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0)
+                output[next_state] = output[next_state] + output[fail[next_state]]
+        
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self._lengths = [len(keyword) for keyword in self.keywords]
+        # 处于根状态时，用正则直接跳到下一个可能的关键词首字符
+        first_chars = ''.join(sorted(goto[0]))
+        self._start_re = re.compile('[%s]' % re.escape(first_chars)) if first_chars else None
+    
+    def _iter_python(self, text):
+        """纯Python扫描，产出(start, end, keyword_index)"""
+        if self._start_re is None:
+            return
+        goto, fail, output, lengths = self._goto, self._fail, self._output, self._lengths
+        root = goto[0]
+        search_start = self._start_re.search
+        state = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if state == 0 and ch not in root:
+                match = search_start(text, i)
+                if match is None:
+                    return
+                i = match.start()
+                ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index in output[state]:
+                yield i + 1 - lengths[index], i + 1, index
+            i += 1
+    
+    def _iter_native(self, text):
+        """pyahocorasick扫描，产出(start, end, keyword_index)"""
+        if not self.keywords:
+            return
+        keywords = self.keywords
+        for end, index in self._automaton.iter(text):
+            yield end + 1 - len(keywords[index]), end + 1, index
+    
+    def iter_matches(self, text):
+        """逐个产出文本中的关键词命中（包含重叠命中）"""
+        if not text:
+            return
+        scan = self._iter_native if self.backend == 'native' else self._iter_python
+        keywords, categories = self.keywords, self.categories
+        for start, end, index in scan(text):
+            yield KeywordMatch(keywords[index], categories[index], start, end)
+    
+    def find_all(self, text):
+        """返回文本中所有关键词命中"""
+        return list(self.iter_matches(text))
+    
+    def matched_keywords(self, *texts):
+        """返回在任一文本中出现过的关键词，按关键词定义顺序排列"""
+        found = set()
+        native = self.backend == 'native' and self.keywords
+        for text in texts:
+            if not text:
+                continue
+            if native:
+                # 只需要关键词序号：直接遍历自动机按存储的序号去重，不经过_iter_native计算起止偏移
+                for _, index in self._automaton.iter(text):
+                    found.add(index)
+            else:
+                for _, _, index in self._iter_python(text):
+                    found.add(index)
+        return [self.keywords[index] for index in sorted(found)]
+    
+    def category_of(self, keyword):
+        """查询关键词所属分类"""
+        index = self._index.get(keyword)
+        return self.categories[index] if index is not None else None
+    
+    def __len__(self):
+        return len(self.keywords)
+
+def benchmark(keywords, text, rounds=200):
+    """对比逐关键词子串扫描与自动机匹配的单页耗时（毫秒）"""
+    results = {}
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        [keyword for keyword in keywords if keyword in text]
+    results['substring_loop'] = (time.perf_counter() - start) * 1000 / rounds
+    
+    for use_native in (False, True):
+        matcher = KeywordMatcher.from_keywords(keywords, use_native=use_native)
+        if use_native and matcher.backend != 'native':
+            continue
+        start = time.perf_counter()
+        for _ in range(rounds):
+            matcher.matched_keywords(text)
+        results[f'automaton_{matcher.backend}'] = (time.perf_counter() - start) * 1000 / rounds
+    
+    return results
+
+if __name__ == "__main__":
+    # 基准测试：使用config.py中的完整关键词库
+    import random
+    from config import VIOLATION_KEYWORDS
+    
+    all_keywords = [keyword for words in VIOLATION_KEYWORDS.values() for keyword in words]
+    filler = '这是一个普通的企业网站页面，提供产品介绍与联系方式。'
+    
+    # 违规页（四分之一的片段是关键词）和常见页面（偶尔出现关键词）
+    for label, ratio in (('违规页', 0.25), ('常见页面', 0.005)):
+        page = ''.join(random.choice(all_keywords) if random.random() < ratio else filler for _ in range(4000))
+        print(f"{label} 关键词数量: {len(all_keywords)}，页面长度: {len(page)} 字符")
+        for name, cost in benchmark(all_keywords, page, rounds=20).items():
+            print(f"{name:>20}: {cost:.3f} ms/页")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 页面分析流水线
+页面只解析一次、DOM只遍历一次：各检测器声明自己关心的节点类型，
+遍历时按标签名分发，遍历结束后由各检测器汇总结果
+"""
+
+import re
+import time
+from html_parsers import get_parser, SoupBackend
+from page_body import decode_body
+
+class Detector:
+    """检测器基类：声明关心的节点，遍历时接收对应节点，结束时写入结果"""
+    tags = ()        # 关心的标签名
+    styled = False   # 是否接收所有带style属性的元素
+    text = False     # 是否接收正文文本节点
+    
+    def __init__(self, rules):
+        self.rules = rules
+    
+    def visit(self, node, page):
+        """处理元素节点"""
+    
+    def visit_text(self, text, page):
+        """处理文本节点"""
+    
+    def finish(self, page, result):
+        """遍历结束后写入检测结果"""
+
+class PageContext:
+    """单个页面的遍历上下文，检测器之间通过它共享数据"""
+    
+    def __init__(self, rules, verdict_threshold=0):
+        self.rules = rules
+        self.verdict_threshold = verdict_threshold
+        self.verdict_reached = False
+        self.title = None
+        self.title_seen = False
+        self.meta_description = ''
+        self.meta_keywords = ''
+        self.tdk_meta = []  # [(name, content)]，name为小写的description/keywords
+        self.stats = {'traversals': 0, 'nodes': 0, 'subtree_walks': 0}
+
+class TdkDetector(Detector):
+    """收集标题与meta信息并检查TDK篡改"""
+    tags = ('title', 'meta')
+    
+    def visit(self, node, page):
+        if node.name == 'title':
+            # 与soup.title一致：只取第一个title
+            if not page.title_seen:
+                page.title_seen = True
+                page.title = node.string
+            return
+        
+        name = node.get('name')
+        content = node.get('content', '')
+        if name == 'description':
+            page.meta_description = content
+        elif name == 'keywords':
+            page.meta_keywords = content
+        
+        lower_name = (name or '').lower()
+        if lower_name in ('description', 'keywords'):
+            page.tdk_meta.append((lower_name, (content or '').lower()))
+    
+    def finish(self, page, result):
+        rules = self.rules
+        title = page.title or ''
+        issues = []
+        
+        # 检查标题中的违规内容
+        for keyword in rules.matcher.matched_keywords(title):
+            issues.append({
+                'type': 'title_violation',
+                'keyword': keyword,
+                'title': title
+            })
+        
+        if rules.title_max_length and len(title.strip()) > rules.title_max_length:
+            issues.append({
+                'type': 'title_too_long',
+                'length': len(title.strip()),
+                'title': title[:100]
+            })
+        
+        # 检查meta描述和关键词
+        tdk_fields = {'title': title}
+        for name, content in page.tdk_meta:
+            tdk_fields[name] = content
+            for keyword in rules.matcher.matched_keywords(content):
+                issues.append({
+                    'type': f'meta_{name}_violation',
+                    'keyword': keyword,
+                    'content': content[:100]
+                })
+        
+        description = tdk_fields.get('description', '')
+        if rules.description_max_length and len(description) > rules.description_max_length:
+            issues.append({
+                'type': 'description_too_long',
+                'length': len(description),
+                'content': description[:100]
+            })
+        
+        keyword_items = [item for item in re.split(r'[,，|;；\s]+', tdk_fields.get('keywords', '')) if item]
+        if rules.keywords_max_count and len(keyword_items) > rules.keywords_max_count:
+            issues.append({
+                'type': 'keywords_too_many',
+                'count': len(keyword_items),
+                'content': tdk_fields['keywords'][:100]
+            })
+        
+        # 可疑模式（超长连续中文/英文、重复字符等）
+        for field, value in tdk_fields.items():
+            for pattern, regex in rules.tdk_patterns:
+                if value and regex.search(value):
+                    issues.append({
+                        'type': 'suspicious_pattern',
+                        'field': field,
+                        'pattern': pattern,
+                        'content': value[:100]
+                    })
+        
+        result['title'] = page.title
+        result['meta_description'] = page.meta_description
+        result['meta_keywords'] = page.meta_keywords
+        result['tdk_issues'] = issues
+
+class KeywordDetector(Detector):
+    """正文文本分块匹配违规关键词，结合标题和meta信息汇总"""
+    text = True
+    chunk_size = 16 * 1024  # 累积到该长度时扫描一次
+    
+    def __init__(self, rules):
+        super().__init__(rules)
+        self.parts = []
+        self.pending = 0
+        self.tail = ''
+        self.found = set()
+    
+    def visit_text(self, text, page):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.chunk_size:
+            self._scan()
+            if page.verdict_threshold and len(self.found) >= page.verdict_threshold:
+                page.verdict_reached = True
+    
+    def _scan(self):
+        """扫描新累积的文本；保留上一块末尾（最长关键词长度-1个字符），跨块的关键词不会漏掉"""
+        matcher = self.rules.matcher
+        text = self.tail + ''.join(self.parts).lower()
+        self.found.update(matcher.matched_keywords(text))
+        keep = matcher.max_length - 1
+        self.tail = text[-keep:] if keep > 0 else ''
+        self.parts = []
+        self.pending = 0
+    
+    def finish(self, page, result):
+        self._scan()
+        matcher = self.rules.matcher
+        self.found.update(matcher.matched_keywords(page.title, page.meta_description, page.meta_keywords))
+        result['violations'] = [keyword for keyword in matcher.keywords if keyword in self.found]
+
+class HiddenContentDetector(Detector):
+    """检查隐藏内容和暗链（规则来自DETECTION_RULES['hidden_content']）"""
+    styled = True
+    
+    def __init__(self, rules):
+        super().__init__(rules)
+        self.hidden_elements = []
+    
+    def visit(self, node, page):
+        rules = self.rules
+        style = node.get('style', '')
+        for rule_type, pattern in rules.hidden_styles:
+            if not pattern.search(style):
+                continue
+            
+            if node.name in rules.suspicious_tags:
+                # 隐藏的iframe/object/embed
+                self.hidden_elements.append({
+                    'type': f'hidden_{node.name}',
+                    'src': node.get('src') or node.get('data', ''),
+                    'tag': node.name
+                })
+            else:
+                page.stats['subtree_walks'] += 1
+                text = node.get_text()
+                if len(text.strip()) >= rules.min_content_length:
+                    self.hidden_elements.append({
+                        'type': rule_type,
+                        'content': text[:100],
+                        'tag': node.name
+                    })
+            break
+    
+    def finish(self, page, result):
+        result['hidden_links'] = self.hidden_elements
+
+class JsRedirectDetector(Detector):
+    """检查JS跳转和劫持（规则来自DETECTION_RULES['js_redirect']）"""
+    tags = ('script',)
+    
+    def __init__(self, rules):
+        super().__init__(rules)
+        self.js_issues = []
+    
+    def visit(self, node, page):
+        rules = self.rules
+        script_content = node.string
+        if not script_content:
+            return
+        
+        # 脚本中出现的可疑函数（eval、unescape等），附加到每条跳转记录上
+        suspicious = []
+        if rules.suspicious_function_re:
+            suspicious = sorted(set(rules.suspicious_function_re.findall(script_content)))
+        
+        for pattern, regex in rules.js_patterns:
+            if regex.search(script_content):
+                issue = {
+                    'type': 'js_redirect',
+                    'pattern': pattern,
+                    'content': script_content[:200]
+                }
+                if suspicious:
+                    issue['suspicious_functions'] = suspicious
+                self.js_issues.append(issue)
+    
+    def finish(self, page, result):
+        result['js_redirects'] = self.js_issues
+
+# 默认检测器（顺序即汇总顺序：关键词检测依赖TDK检测收集的标题和meta）
+DEFAULT_DETECTORS = (TdkDetector, KeywordDetector, HiddenContentDetector, JsRedirectDetector)
+
+def analyze_document(root, rules, detectors=DEFAULT_DETECTORS, backend=None, verdict_threshold=0):
+    """对已解析的文档运行检测器，整棵树只遍历一次（默认按BeautifulSoup文档处理）
+    
+    verdict_threshold大于0时，正文命中的违规关键词达到该数量即停止遍历，
+    其余检测器只包含已遍历部分的结果，并在结果中标记early_exit
+    """
+    backend = backend or SoupBackend()
+    page = PageContext(rules, verdict_threshold)
+    instances = [detector(rules) for detector in detectors]
+    
+    # 按节点类型建立分发表
+    by_tag = {}
+    styled = []
+    text_handlers = []
+    for detector in instances:
+        for tag in detector.tags:
+            by_tag.setdefault(tag, []).append(detector)
+        if detector.styled:
+            styled.append(detector)
+        if detector.text:
+            text_handlers.append(detector)
+    
+    page.stats['traversals'] += 1
+    nodes = 0
+    for node, is_text in backend.iter_nodes(root):
+        nodes += 1
+        if is_text:
+            for detector in text_handlers:
+                detector.visit_text(node, page)
+            if page.verdict_reached:
+                break
+            continue
+        
+        for detector in by_tag.get(node.name, ()):
+            detector.visit(node, page)
+        if styled and node.get('style') is not None:
+            for detector in styled:
+                detector.visit(node, page)
+    page.stats['nodes'] = nodes
+    
+    result = {}
+    for detector in instances:
+        detector.finish(page, result)
+    if page.verdict_reached:
+        result['early_exit'] = True
+    return result, page.stats
+
+def analyze_html(html, rules, detectors=DEFAULT_DETECTORS, profile=False, parser=None, verdict_threshold=0):
+    """解析HTML并运行全部检测器，parser为解析后端名称（默认auto）"""
+    backend = get_parser(parser)
+    start = time.perf_counter()
+    root = backend.parse(html)
+    parsed = time.perf_counter()
+    
+    result, stats = analyze_document(root, rules, detectors, backend, verdict_threshold)
+    
+    if profile:
+        stats['parser'] = backend.name
+        stats['parse_ms'] = round((parsed - start) * 1000, 3)
+        stats['detect_ms'] = round((time.perf_counter() - parsed) * 1000, 3)
+        result['profile'] = stats
+    return result
+
+def analyze_body(content, rules, parser=None, profile=False, encoding=None, sample_size=64 * 1024,
+                 verdict_threshold=0):
+    """解码原始响应体并分析（可在分析进程中执行），encoding为响应头声明的编码"""
+    text = decode_body(content, encoding, sample_size)
+    return analyze_html(text, rules, profile=profile, parser=parser, verdict_threshold=verdict_threshold)
+
+def _legacy_analyze(soup, rules):
+    """旧版多次遍历的检测流程，仅用于性能对比"""
+    page_text = soup.get_text().lower()
+    title = soup.title.string if soup.title else ''
+    for meta in soup.find_all('meta'):
+        meta.get('name')
+    rules.matcher.matched_keywords(page_text, title)
+    for element in soup.find_all(style=re.compile(r'display\s*:\s*none')):
+        element.get_text()
+    for element in soup.find_all(style=re.compile(r'visibility\s*:\s*hidden')):
+        element.get_text()
+    soup.find_all('iframe')
+    for script in soup.find_all('script'):
+        script.string
+    soup.title
+    soup.find_all('meta')
+
+# 旧流程的整树遍历次数：get_text、meta×2、style×2、iframe、script
+LEGACY_TRAVERSALS = 7
+
+if __name__ == "__main__":
+    # 性能对比：单次遍历流水线 vs 旧版多次遍历
+    from bs4 import BeautifulSoup
+    from rule_pack import load_rule_pack
+    
+    rules = load_rule_pack()
+    block = ('<div class="item"><a href="/p/{0}">产品{0}</a><p style="color:red">介绍文字{0}</p>'
+             '<span>价格 {0} 元</span></div>')
+    html = ('<html><head><title>测试页面</title><meta name="description" content="描述">'
+            '<meta name="keywords" content="关键词"></head><body>'
+            + ''.join(block.format(i) for i in range(5000))
+            + '<script>var x = 1;</script></body></html>')
+    
+    soup = BeautifulSoup(html, 'html.parser')
+    rounds = 5
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _legacy_analyze(soup, rules)
+    legacy_ms = (time.perf_counter() - start) * 1000 / rounds
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result, stats = analyze_document(soup, rules)
+    pipeline_ms = (time.perf_counter() - start) * 1000 / rounds
+    
+    print(f"页面大小: {len(html)} 字节, 节点数: {stats['nodes']}")
+    print(f"旧流程: {LEGACY_TRAVERSALS} 次遍历, {legacy_ms:.1f} ms/页")
+    print(f"新流程: {stats['traversals']} 次遍历, {pipeline_ms:.1f} ms/页")
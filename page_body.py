@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 响应体处理
+流式读取响应体（字节上限 + 增量哈希），只取前N KB判断编码
+"""
+
+import re
+import codecs
+import hashlib
+from requests.compat import chardet
+
+# 流式读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+class BodyBuffer:
+    """按块累积响应体，超过字节上限后截断，同时增量计算原始字节的MD5"""
+    
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes  # 0表示不限制
+        self.size = 0
+        self.truncated = False
+        self._chunks = []
+        self._md5 = hashlib.md5()
+    
+    def feed(self, chunk):
+        """追加一块数据，达到上限时返回False（调用方应停止读取）"""
+        if self.max_bytes and self.size + len(chunk) > self.max_bytes:
+            chunk = chunk[:self.max_bytes - self.size]
+            self.truncated = True
+        if chunk:
+            self._chunks.append(chunk)
+            self._md5.update(chunk)
+            self.size += len(chunk)
+        return not self.truncated
+    
+    @property
+    def content(self):
+        if len(self._chunks) > 1:
+            self._chunks = [b''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else b''
+    
+    @property
+    def content_hash(self):
+        return self._md5.hexdigest()
+
+def charset_from_content_type(content_type):
+    """从Content-Type响应头中取charset，没有声明时返回None"""
+    if not content_type:
+        return None
+    match = _CHARSET_RE.search(content_type)
+    return match.group(1) if match else None
+
+def _valid_codec(name):
+    """编码名可用时返回Python规范名"""
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def detect_encoding(content, declared=None, sample_size=64 * 1024):
+    """判断响应体编码：响应头声明 > BOM > meta声明 > 对前sample_size字节做chardet检测"""
+    encoding = _valid_codec(declared)
+    if encoding:
+        return encoding
+    
+    for bom, name in _BOMS:
+        if content.startswith(bom):
+            return name
+    
+    sample = content[:sample_size] if sample_size else content
+    match = _META_CHARSET_RE.search(sample)
+    encoding = _valid_codec(match.group(1).decode('ascii', 'ignore')) if match else None
+    if encoding:
+        return encoding
+    
+    return chardet.detect(sample)['encoding'] or 'utf-8'
+
+def decode_body(content, declared=None, sample_size=64 * 1024):
+    """按检测到的编码解码响应体，无法解码的字节用替换字符代替"""
+    encoding = detect_encoding(content, declared, sample_size)
+    try:
+        return str(content, encoding, errors='replace')
+    except (LookupError, TypeError):
+        return str(content, errors='replace')
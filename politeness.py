@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 礼貌抓取调度
+待检测站点按注册域名和解析出的IP分组，每组一个令牌桶（每秒请求数）和同时检测的站点数上限；
+调度器在预读队列中挑选所属分组当前可用的最靠前的站点派发，热点主机（或共享主机IP）上的站点留在队列中，
+不占用下载线程；robots.txt按主机缓存，过期后重新获取
+未安装tldextract时按常见公共后缀近似确定注册域名
+"""
+
+import queue
+import socket
+import time
+import ipaddress
+import threading
+import urllib.robotparser
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+try:
+    import tldextract
+except ImportError:
+    tldextract = None
+
+# 常见的二级公共后缀（未安装tldextract时使用）
+_SECOND_LEVEL_SUFFIXES = frozenset([
+    'com.cn', 'net.cn', 'org.cn', 'gov.cn', 'edu.cn', 'ac.cn',
+    'com.hk', 'net.hk', 'org.hk', 'com.tw', 'net.tw', 'org.tw', 'com.mo', 'com.sg', 'com.my',
+    'co.uk', 'org.uk', 'co.jp', 'ne.jp', 'co.kr', 'com.au', 'net.au', 'com.br', 'co.in', 'co.nz', 'co.za'
+])
+
+# 使用tldextract自带的公共后缀列表，不联网更新
+_extract = tldextract.TLDExtract(suffix_list_urls=()) if tldextract is not None else None
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def registrable_domain(host):
+    """主机名的注册域名（www.a.example.com.cn -> example.com.cn），IP地址原样返回"""
+    host = (host or '').lower().rstrip('.')
+    if not host or is_ip(host):
+        return host
+    if _extract is not None:
+        parts = _extract(host)
+        return getattr(parts, 'top_domain_under_public_suffix', None) or parts.registered_domain or host
+    labels = host.split('.')
+    count = 3 if '.'.join(labels[-2:]) in _SECOND_LEVEL_SUFFIXES else 2
+    return '.'.join(labels[-count:])
+
+def resolve_host(host):
+    """解析主机的第一个地址，解析失败时返回None"""
+    if is_ip(host):
+        return host
+    try:
+        return socket.getaddrinfo(host, 80, type=socket.SOCK_STREAM)[0][4][0]
+    except (socket.gaierror, UnicodeError, IndexError):
+        return None
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积累burst个"""
+    
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+    
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount, now):
+        """还需等待多少秒才有amount个令牌"""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+    
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+    
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+class _Group:
+    __slots__ = ('bucket', 'active')
+    
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.active = 0
+
+class PolitenessScheduler:
+    """按注册域名和IP分组限速的站点调度器（线程安全，所有方法都不阻塞）
+    
+    add(item, host)放入队列并在后台解析IP；pop_ready()取出可以立即派发的站点和占用的分组，
+    站点检测完成后release(ticket)；没有可派发的站点时delay()给出最多需要等待的秒数
+    """
+    
+    RESOLVE_POLL = 0.05  # 有站点在等待DNS解析时的轮询间隔（秒）
+    RESOLVE_GRACE = 1.0  # 解析超过这么久的站点先只按注册域名分组派发，不等待解析结果
+    
+    def __init__(self, rate=10, max_per_group=2, cost=2, group_by_ip=True, dns_ttl=300, resolver_threads=16,
+                 resolve=resolve_host, clock=time.monotonic):
+        self.rate = rate  # 每组每秒请求数，0表示不限速
+        self.max_per_group = max_per_group  # 每组同时检测的站点数，0表示不限制
+        self.cost = cost  # 每个站点消耗的令牌数（普通用户和爬虫各一次请求）
+        self.burst = max(rate, cost)
+        self.group_by_ip = group_by_ip
+        self.dns_ttl = dns_ttl
+        self.resolve = resolve
+        self.clock = clock
+        self.pending = []  # [item, host, 注册域名]，按加入顺序
+        self.groups = {}
+        self.stats = {'dispatched': 0, 'reordered': 0, 'groups': 0}
+        self._addresses = OrderedDict()  # 主机 -> (IP, 过期时间)
+        self._resolving = {}  # 主机 -> 开始解析的时间
+        self._lock = threading.Lock()
+        # 解析线程为守护线程，退出时不等待卡在DNS超时中的解析
+        self._requests = queue.Queue()
+        self._resolver_threads = resolver_threads if group_by_ip else 0
+        for _ in range(self._resolver_threads):
+            threading.Thread(target=self._resolver, daemon=True).start()
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def add(self, item, host):
+        host = (host or '').lower()
+        with self._lock:
+            self.pending.append((item, host, registrable_domain(host)))
+            if self.group_by_ip:
+                self._address(host, self.clock())
+    
+    def _address(self, host, now):
+        """返回(是否已解析, IP)；未解析时在后台开始解析"""
+        entry = self._addresses.get(host)
+        if entry is not None and entry[1] > now:
+            return True, entry[0]
+        started = self._resolving.get(host)
+        if started is None:
+            self._resolving[host] = started = now
+            self._requests.put(host)
+        # 过期的地址在重新解析期间继续使用
+        if entry is not None:
+            return True, entry[0]
+        return now - started > self.RESOLVE_GRACE, None
+    
+    def _resolver(self):
+        while True:
+            host = self._requests.get()
+            if host is None:
+                break
+            ip = self.resolve(host)
+            with self._lock:
+                self._resolving.pop(host, None)
+                self._addresses[host] = (ip, self.clock() + self.dns_ttl)
+                self._addresses.move_to_end(host)
+                while len(self._addresses) > 100000:
+                    self._addresses.popitem(last=False)
+    
+    def _groups(self, host, domain, now):
+        """站点所属的分组，IP尚未解析时返回None"""
+        keys = [('domain', domain)]
+        if self.group_by_ip:
+            resolved, ip = self._address(host, now)
+            if not resolved:
+                return None
+            if ip is not None:
+                keys.append(('ip', ip))
+        groups = []
+        for key in keys:
+            group = self.groups.get(key)
+            if group is None:
+                bucket = TokenBucket(self.rate, self.burst, now) if self.rate > 0 else None
+                group = self.groups[key] = _Group(bucket)
+                self.stats['groups'] += 1
+            groups.append(group)
+        return groups
+    
+    def _wait_time(self, groups, now):
+        """分组全部可用前需要等待的秒数，受并发上限限制时返回None（等待其他站点完成）"""
+        wait = 0.0
+        for group in groups:
+            if self.max_per_group and group.active >= self.max_per_group:
+                return None
+            if group.bucket is not None:
+                wait = max(wait, group.bucket.wait_time(self.cost, now))
+        return wait
+    
+    def pop_ready(self):
+        """取出队列中最靠前的可以立即派发的站点，返回(item, ticket)；没有时返回None"""
+        now = self.clock()
+        with self._lock:
+            for index, (item, host, domain) in enumerate(self.pending):
+                groups = self._groups(host, domain, now)
+                if groups is None or self._wait_time(groups, now) != 0:
+                    continue
+                del self.pending[index]
+                for group in groups:
+                    group.active += 1
+                    if group.bucket is not None:
+                        group.bucket.take(self.cost, now)
+                self.stats['dispatched'] += 1
+                if index:
+                    self.stats['reordered'] += 1
+                return item, groups
+        return None
+    
+    def release(self, ticket):
+        """站点检测完成，归还分组的并发名额"""
+        now = self.clock()
+        with self._lock:
+            for group in ticket:
+                group.active -= 1
+            # 清理空闲且令牌已满的分组，分组数不随站点总数增长
+            if len(self.groups) > 4 * (len(self.pending) + 1024):
+                for key in [key for key, group in self.groups.items()
+                            if group.active == 0 and (group.bucket is None or group.bucket.is_full(now))]:
+                    del self.groups[key]
+    
+    def delay(self):
+        """距离队列中某个站点可以派发最多还需等待的秒数；只能等待其他站点完成时返回None"""
+        now = self.clock()
+        delay = None
+        with self._lock:
+            for _, host, domain in self.pending:
+                groups = self._groups(host, domain, now)
+                wait = self.RESOLVE_POLL if groups is None else self._wait_time(groups, now)
+                if wait is not None and (delay is None or wait < delay):
+                    delay = wait
+                    if delay == 0:
+                        break
+        return delay
+    
+    def close(self):
+        for _ in range(self._resolver_threads):
+            self._requests.put(None)
+
+class RobotsCache:
+    """robots.txt缓存（按协议+主机，带有效期，线程安全）
+    
+    401/403视为禁止抓取，其他4xx视为不限制；5xx和网络错误暂时视为不限制，按较短的有效期重新获取
+    """
+    
+    def __init__(self, ttl=3600, error_ttl=300, max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # 协议+主机 -> (RobotFileParser, 过期时间)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'.lower()
+    
+    def robots_url(self, url):
+        return self._key(url) + '/robots.txt'
+    
+    def get(self, url):
+        """已缓存且未过期的解析结果，需要重新获取时返回None"""
+        with self._lock:
+            entry = self._entries.get(self._key(url))
+        if entry is None or entry[1] <= self.clock():
+            return None
+        return entry[0]
+    
+    def store(self, url, status_code, content=b''):
+        """保存robots.txt的获取结果（status_code为None表示网络错误），返回解析结果"""
+        parser = urllib.robotparser.RobotFileParser()
+        if status_code in (401, 403):
+            parser.disallow_all = True
+        elif status_code is None or status_code >= 400:
+            parser.allow_all = True
+        else:
+            if isinstance(content, bytes):
+                content = content.decode('utf-8', errors='replace')
+            parser.parse(content.splitlines())
+            parser.modified()
+        ttl = self.error_ttl if status_code is None or status_code >= 500 else self.ttl
+        with self._lock:
+            key = self._key(url)
+            self._entries[key] = (parser, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return parser
+    
+    @staticmethod
+    def allowed(parser, url, user_agent):
+        return parser.can_fetch(user_agent or '*', url)
+
+def _simulate(sites, scheduler, lookahead, workers=20, fetch_time=0.05):
+    """模拟批量检测（每个站点耗时fetch_time秒），返回{IP: (同时检测的站点数峰值, 最后一个站点完成的时间)}"""
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    
+    active, stats = {}, {}
+    lock = threading.Lock()
+    start = time.time()
+    
+    def check(site):
+        ip = site[1]
+        with lock:
+            active[ip] = active.get(ip, 0) + 1
+            stats[ip] = (max(stats.get(ip, (0, 0))[0], active[ip]), 0)
+        time.sleep(fetch_time)
+        with lock:
+            active[ip] -= 1
+            stats[ip] = (stats[ip][0], time.time() - start)
+    
+    site_iter = iter(sites)
+    sites_left = True
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # lookahead为1时只能派发队首的站点（不重排）
+            while len(futures) < workers:
+                while sites_left and len(scheduler) < lookahead:
+                    site = next(site_iter, None)
+                    if site is None:
+                        sites_left = False
+                        break
+                    scheduler.add(site, site[0])
+                ready = scheduler.pop_ready()
+                if ready is None:
+                    break
+                futures[executor.submit(check, ready[0])] = ready[1]
+            if not futures and not len(scheduler):
+                break
+            if not futures:
+                time.sleep(scheduler.delay() or 0)
+                continue
+            done, _ = wait(futures, timeout=scheduler.delay() if len(scheduler) else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                scheduler.release(futures.pop(future))
+    scheduler.close()
+    return stats
+
+if __name__ == "__main__":
+    # 600个站点：每6个站点中有1个在同一共享主机IP上（不同域名），其余500个分布在100个IP上
+    sites = [(f'site{i}.com', '10.0.0.1' if i % 6 == 0 else f'10.0.1.{i % 100}') for i in range(600)]
+    addresses = dict(sites)
+    
+    for name, options, lookahead in (('不限制', {'rate': 0, 'max_per_group': 0}, 1000),
+                                     ('限制，按顺序派发', {}, 1),
+                                     ('限制，队列中重排', {}, 1000)):
+        scheduler = PolitenessScheduler(resolve=addresses.get, **options)
+        stats = _simulate(sites, scheduler, lookahead)
+        shared = stats.pop('10.0.0.1')
+        print(f"{name:<10} 共享IP：同时检测峰值 {shared[0]:2d}，{shared[1]:5.1f} 秒完成；"
+              f"其他IP：峰值 {max(peak for peak, _ in stats.values())}，"
+              f"{max(finished for _, finished in stats.values()):5.1f} 秒完成；重排 {scheduler.stats['reordered']} 次")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 分析结果缓存
+按(响应体哈希, 规则包版本)缓存检测器输出，复检时页面没有变化就直接沿用上次结果、不再解析；
+内存中保留最近使用的条目（LRU），其余持久化在SQLite的analysis_cache表中（写入交给数据库写入线程）
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """两级分析结果缓存：内存LRU + SQLite（自己的连接只读，新条目成批交给写入线程）"""
+    
+    def __init__(self, db_path, db_writer, max_entries=10000, persist=True, retention_days=30, flush_every=50):
+        self.db_path = db_path
+        self.db_writer = db_writer
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0}
+        self._memory = OrderedDict()
+        self._pending = {}  # 尚未交给写入线程的新条目
+        self._writing = {}  # 已交给写入线程、尚未提交的条目
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # 按取出顺序交给写入线程；先于_lock获取，写入线程的回调只用_lock
+        self._conn = None
+        if persist:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    content_hash TEXT,
+                    rule_version TEXT,
+                    result TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (content_hash, rule_version)
+                )
+            ''')
+            self._conn.commit()
+            # 清理过期条目（旧规则包版本的结果不会再被命中）
+            if retention_days:
+                db_writer.submit(self._expire, int(retention_days))
+    
+    def _expire(self, conn, retention_days):
+        conn.execute("DELETE FROM analysis_cache WHERE created_at < datetime('now', ?)",
+                     (f'-{retention_days} days',))
+    
+    def get(self, content_hash, rule_version):
+        """查找分析结果，未命中时返回None；命中的结果带有cache_hit标记"""
+        if not content_hash:
+            return None
+        key = (content_hash, rule_version)
+        with self._lock:
+            analysis = self._memory.get(key) or self._pending.get(key) or self._writing.get(key)
+            if analysis is not None:
+                self._remember(key, analysis)
+                self.stats['memory_hits'] += 1
+                return dict(analysis, cache_hit=True)
+            
+            row = self._select(key)
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            
+            analysis = json.loads(row[0])
+            self._remember(key, analysis)
+            self.stats['db_hits'] += 1
+            return dict(analysis, cache_hit=True)
+    
+    def contains(self, content_hash, rule_version):
+        """是否有缓存的分析结果（不计入命中统计）"""
+        if not content_hash:
+            return False
+        key = (content_hash, rule_version)
+        with self._lock:
+            return (key in self._memory or key in self._pending or key in self._writing
+                    or self._select(key, '1') is not None)
+    
+    def _select(self, key, column='result'):
+        if self._conn is None:
+            return None
+        return self._conn.execute(f'SELECT {column} FROM analysis_cache WHERE content_hash = ? AND rule_version = ?',
+                                  key).fetchone()
+    
+    def put(self, content_hash, rule_version, analysis):
+        """保存分析结果（不保存耗时统计；提前结束的不完整结果不缓存）"""
+        if not content_hash or analysis.get('cache_hit') or analysis.get('early_exit'):
+            return
+        analysis = {key: value for key, value in analysis.items() if key != 'profile'}
+        key = (content_hash, rule_version)
+        with self._lock:
+            self._remember(key, analysis)
+            self.stats['stores'] += 1
+            if self._conn is None:
+                return
+            self._pending[key] = analysis
+            if len(self._pending) < self.flush_every:
+                return
+        self.flush()
+    
+    def _remember(self, key, analysis):
+        self._memory[key] = analysis
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+    
+    def _submit(self, batch):
+        """（不持有_lock时调用）交给写入线程：写入队列满时submit会阻塞，而写入线程的完成回调需要获取_lock"""
+        rows = [(content_hash, rule_version, json.dumps(analysis, ensure_ascii=False))
+                for (content_hash, rule_version), analysis in batch.items()]
+        try:
+            future = self.db_writer.submit(self._write, rows)
+        except RuntimeError:
+            self._written(batch)  # 写入线程已关闭
+            raise
+        future.add_done_callback(lambda _: self._written(batch))
+    
+    def _write(self, conn, rows):
+        conn.executemany('INSERT OR REPLACE INTO analysis_cache (content_hash, rule_version, result) VALUES (?, ?, ?)',
+                         rows)
+    
+    def _written(self, batch):
+        # 提交后（或写入失败后）不再从_writing中查找；期间又写入的同一键以新条目为准
+        with self._lock:
+            for key, analysis in batch.items():
+                if self._writing.get(key) is analysis:
+                    del self._writing[key]
+    
+    def flush(self):
+        """把新条目成批交给写入线程（不等待提交）"""
+        with self._submit_lock:
+            with self._lock:
+                if self._conn is None or not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+                self._writing.update(batch)  # 提交前仍可从_writing中查到
+            self._submit(batch)
+    
+    def close(self):
+        """交出剩余条目并等待写入线程提交，然后关闭只读连接"""
+        self.flush()
+        self.db_writer.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    @property
+    def hits(self):
+        return self.stats['memory_hits'] + self.stats['db_hits']
+    
+    def summary(self):
+        """状态栏显示的命中统计"""
+        lookups = self.hits + self.stats['misses']
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"结果缓存 命中 {self.hits} (内存 {self.stats['memory_hits']} / 数据库 {self.stats['db_hits']})"
+                f" 未命中 {self.stats['misses']} 命中率 {rate:.0f}%")
+
+if __name__ == "__main__":
+    # 测试代码：首次扫描全部未命中，复检时页面不变直接命中，并对比耗时
+    import os
+    import time
+    import tempfile
+    from db_writer import DbWriter
+    from rule_pack import load_rule_pack
+    from html_parsers import SAMPLE_PAGES
+    from page_analyzer import analyze_body
+    from page_body import BodyBuffer
+    
+    rules = load_rule_pack()
+    pages = []
+    for i in range(200):
+        html = SAMPLE_PAGES['gambling' if i % 2 else 'clean'].replace('</body>', f'<p>站点{i}</p></body>')
+        body = BodyBuffer()
+        body.feed(html.encode('utf-8'))
+        pages.append((body.content_hash, body.content))
+    
+    def scan(cache):
+        start = time.perf_counter()
+        for content_hash, content in pages:
+            analysis = cache.get(content_hash, rules.version)
+            if analysis is None:
+                cache.put(content_hash, rules.version, analyze_body(content, rules))
+        cache.flush()
+        return (time.perf_counter() - start) * 1000
+    
+    db_path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    writer = DbWriter(db_path)
+    cache = ResultCache(db_path, writer, max_entries=500)
+    print(f"首次扫描: {scan(cache):.1f} ms  {cache.summary()}")
+    print(f"复检: {scan(cache):.1f} ms  {cache.summary()}")
+    cache.close()
+    
+    cache = ResultCache(db_path, writer, max_entries=500)
+    print(f"重启后复检: {scan(cache):.1f} ms  {cache.summary()}")
+    cache.close()
+    writer.close()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 规则包
+将config.py中的关键词、正则和选择器编译为不可变、带版本号的规则包，
+编译结果按内容哈希缓存到磁盘，启动时直接加载
+"""
+
+import os
+import re
+import json
+import pickle
+import runpy
+import hashlib
+import tempfile
+from keyword_matcher import KeywordMatcher
+
+# 规则包结构版本，修改编译逻辑时递增，使旧缓存失效
+RULE_PACK_SCHEMA = 2
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.py')
+
+_STYLE_SELECTOR_RE = re.compile(r'^\[style\*=["\']([^"\']+)["\']\]$')
+
+def read_rule_source(config_path=None):
+    """从config.py读取规则原始定义（不影响已导入的config模块）"""
+    namespace = runpy.run_path(config_path or DEFAULT_CONFIG_PATH)
+    return {
+        'keywords': namespace.get('VIOLATION_KEYWORDS', {}),
+        'detection_rules': namespace.get('DETECTION_RULES', {}),
+    }
+
+def rule_source_version(source):
+    """根据规则内容计算版本号"""
+    payload = json.dumps({'schema': RULE_PACK_SCHEMA, 'source': source},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def compile_style_selector(selector):
+    """将[style*="prop:value"]选择器编译为(类型名, 正则)，容忍空白和大小写差异"""
+    match = _STYLE_SELECTOR_RE.match(selector.strip())
+    if not match:
+        return None
+    
+    declaration = match.group(1)
+    parts = []
+    for item in declaration.split(';'):
+        if not item.strip():
+            continue
+        prop, _, value = item.partition(':')
+        value = value.strip()
+        part = re.escape(prop.strip()) + r'\s*:\s*' + re.escape(value)
+        # 避免font-size:0误匹配font-size:0.8em之类的值
+        part += r'(?![.\d])' if value[-1:].isdigit() else r'(?![\w-])'
+        parts.append(part)
+    
+    rule_type = re.sub(r'[^a-z0-9]+', '_', declaration.lower()).strip('_')
+    return rule_type, re.compile(r'\s*;\s*'.join(parts), re.IGNORECASE)
+
+class RulePack:
+    """编译后的检测规则包（不可变，可在线程间共享，可序列化）"""
+    
+    def __init__(self, source, version=None):
+        object.__setattr__(self, '_frozen', False)
+        self.version = version or rule_source_version(source)
+        self.source = source
+        self.matcher = KeywordMatcher(source.get('keywords', {}))
+        self._compile_patterns()
+        self._frozen = True
+    
+    def _compile_patterns(self):
+        """编译隐藏内容、JS劫持与TDK规则"""
+        rules = self.source.get('detection_rules', {})
+        
+        hidden = rules.get('hidden_content', {})
+        self.hidden_styles = tuple(filter(None, (compile_style_selector(selector)
+                                                 for selector in hidden.get('css_selectors', []))))
+        self.suspicious_tags = frozenset(tag.lower() for tag in hidden.get('suspicious_tags', []))
+        self.min_content_length = hidden.get('min_content_length', 1)
+        
+        js = rules.get('js_redirect', {})
+        self.js_patterns = tuple((pattern, re.compile(pattern, re.IGNORECASE))
+                                 for pattern in js.get('patterns', []))
+        functions = js.get('suspicious_functions', [])
+        self.suspicious_functions = tuple(functions)
+        self.suspicious_function_re = (
+            re.compile(r'\b(%s)\s*\(' % '|'.join(re.escape(name) for name in functions))
+            if functions else None
+        )
+        
+        tdk = rules.get('tdk_tampering', {})
+        self.title_max_length = tdk.get('title_max_length')
+        self.description_max_length = tdk.get('description_max_length')
+        self.keywords_max_count = tdk.get('keywords_max_count')
+        self.tdk_patterns = tuple((pattern, re.compile(pattern))
+                                  for pattern in tdk.get('suspicious_patterns', []))
+    
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('RulePack是不可变对象')
+        object.__setattr__(self, name, value)
+    
+    def __getstate__(self):
+        # 自动机表直接序列化，正则在加载时重新编译（re模块无法持久化编译结果）
+        return {'version': self.version, 'source': self.source, 'matcher': self.matcher}
+    
+    def __setstate__(self, state):
+        object.__setattr__(self, '_frozen', False)
+        self.version = state['version']
+        self.source = state['source']
+        self.matcher = state['matcher']
+        self._compile_patterns()
+        self._frozen = True
+    
+    @property
+    def keywords(self):
+        """全部关键词（按定义顺序）"""
+        return list(self.matcher.keywords)
+    
+    def __repr__(self):
+        return f'<RulePack {self.version} keywords={len(self.matcher)}>'
+
+def load_cached_rule_pack(version, cache_dir):
+    """按版本号从磁盘缓存加载规则包，不存在或损坏时返回None"""
+    if not cache_dir:
+        return None
+    cache_file = os.path.join(cache_dir, f'rules-{version}.pickle')
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'rb') as f:
+            pack = pickle.load(f)
+    except Exception:
+        return None
+    if isinstance(pack, RulePack) and pack.version == version:
+        return pack
+    return None
+
+def load_rule_pack(config_path=None, cache_dir=None):
+    """加载规则包，优先使用磁盘缓存"""
+    source = read_rule_source(config_path)
+    version = rule_source_version(source)
+    
+    # 缓存损坏时重新编译
+    pack = load_cached_rule_pack(version, cache_dir)
+    if pack is not None:
+        return pack
+    
+    pack = RulePack(source, version)
+    
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f'rules-{version}.pickle')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再替换，避免并发读取到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(pack, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            pass
+    
+    return pack
+
+if __name__ == "__main__":
+    # 测试代码：对比冷编译与缓存加载耗时
+    import time
+    import shutil
+    
+    test_cache = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        pack = load_rule_pack(cache_dir=test_cache)
+        cold = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        cached = load_rule_pack(cache_dir=test_cache)
+        warm = (time.perf_counter() - start) * 1000
+        
+        print(pack)
+        print(f"编译: {cold:.2f} ms, 缓存加载: {warm:.2f} ms, 版本一致: {pack.version == cached.version}")
+    finally:
+        shutil.rmtree(test_cache)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 页面快照存储
+每个响应体按内容哈希只存一份（跨域名、跨复检去重），用在已有页面上训练的zstd字典压缩；
+总大小超过上限时按最近访问时间淘汰，每个域名只保留最近N次快照。规则更新后可直接重新分析快照，不必重新抓取
+未安装zstandard时使用zlib压缩
+"""
+
+import zlib
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EVICT_BATCH = 200  # 淘汰时每次读取的响应体数
+
+class SnapshotStore:
+    """内容寻址的压缩快照库（独立的SQLite文件）"""
+    
+    def __init__(self, db_path, max_bytes=2 * 1024 ** 3, keep_per_domain=5, level=10,
+                 dict_size=112 * 1024, dict_samples=300, commit_every=100):
+        self.db_path = db_path
+        self.max_bytes = max_bytes  # 压缩后的总大小上限，0表示不限制
+        self.keep_per_domain = keep_per_domain  # 每个域名保留的快照次数，0表示不限制
+        self.level = level
+        self.dict_size = dict_size
+        self.dict_samples = dict_samples  # 收集到这么多个页面后训练压缩字典
+        self.commit_every = commit_every
+        self.stats = {'stored': 0, 'deduplicated': 0, 'evicted': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        self._lock = threading.RLock()
+        self._local = threading.local()  # zstd压缩/解压对象不是线程安全的，每个线程各用一份
+        self._dicts = {}  # 只整体替换（见train_dictionary），压缩时可以不加锁读取
+        self._samples = []
+        self._training = False
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS snapshot_blobs (
+                content_hash TEXT PRIMARY KEY,
+                codec TEXT,
+                dict_id INTEGER,
+                raw_size INTEGER,
+                stored_size INTEGER,
+                last_access DATETIME,
+                data BLOB
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_refs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                domain TEXT,
+                url TEXT,
+                fetch TEXT,
+                status_code INTEGER,
+                content_hash TEXT,
+                final_url TEXT,
+                encoding TEXT,
+                truncated INTEGER,
+                captured_at DATETIME
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data BLOB,
+                created_at DATETIME
+            );
+            CREATE INDEX IF NOT EXISTS idx_refs_domain ON snapshot_refs (domain, fetch, captured_at);
+            CREATE INDEX IF NOT EXISTS idx_refs_hash ON snapshot_refs (content_hash);
+            CREATE INDEX IF NOT EXISTS idx_refs_captured ON snapshot_refs (captured_at DESC, domain, id);
+            CREATE INDEX IF NOT EXISTS idx_blobs_access ON snapshot_blobs (last_access);
+        ''')
+        for dict_id, data in self._conn.execute('SELECT id, data FROM snapshot_dicts'):
+            self._dicts[dict_id] = zstandard.ZstdCompressionDict(data) if zstandard else None
+        self.total_bytes = self._conn.execute(
+            'SELECT COALESCE(SUM(stored_size), 0) FROM snapshot_blobs').fetchone()[0]
+    
+    @property
+    def codec(self):
+        return 'zstd' if zstandard is not None else 'zlib'
+    
+    @property
+    def dict_id(self):
+        """当前用于压缩的字典（0表示还没有训练字典）"""
+        return max(self._dicts) if self._dicts and zstandard is not None else 0
+    
+    def _compressor(self, dict_id):
+        cache = self._local.__dict__.setdefault('compressors', {})
+        if dict_id not in cache:
+            cache[dict_id] = zstandard.ZstdCompressor(level=self.level, dict_data=self._dicts.get(dict_id))
+        return cache[dict_id]
+    
+    def _decompressor(self, dict_id):
+        cache = self._local.__dict__.setdefault('decompressors', {})
+        if dict_id not in cache:
+            cache[dict_id] = zstandard.ZstdDecompressor(dict_data=self._dicts.get(dict_id))
+        return cache[dict_id]
+    
+    def compress(self, content):
+        """压缩响应体，返回(codec, dict_id, 压缩数据)"""
+        if zstandard is None:
+            return 'zlib', 0, zlib.compress(content, 6)
+        dict_id = self.dict_id
+        return 'zstd', dict_id, self._compressor(dict_id).compress(content)
+    
+    def decompress(self, codec, dict_id, data):
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        if zstandard is None:
+            raise RuntimeError('需要安装zstandard才能读取zstd快照')
+        return self._decompressor(dict_id).decompress(data)
+    
+    def put(self, domain, fetched, fetch='normal', captured_at=None):
+        """保存一次下载结果（fetch_page格式）的快照，返回内容哈希；没有响应体时返回None
+        
+        304（content为None）时只要响应体已在库中，就只记录一次新的快照引用；
+        同一次检测的普通用户和爬虫快照使用相同的captured_at
+        """
+        content_hash = fetched.get('content_hash')
+        if not content_hash or 'content' not in fetched:
+            return None
+        content = fetched['content']
+        
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM snapshot_blobs WHERE content_hash = ?',
+                                        (content_hash,)).fetchone() is not None
+        if not exists and content is None:
+            return None
+        
+        blob = None
+        if not exists:
+            self._collect_sample(content)
+            blob = self.compress(content)  # 在锁外压缩，多个下载线程可并行
+        
+        now = datetime.now()
+        captured_at = captured_at or now
+        with self._lock:
+            if blob is None:
+                if self._conn.execute('UPDATE snapshot_blobs SET last_access = ? WHERE content_hash = ?',
+                                      (now, content_hash)).rowcount:
+                    self.stats['deduplicated'] += 1
+                elif content is None:
+                    return None
+                else:
+                    # 两次加锁之间响应体被其他线程淘汰或按保留策略删除，重新写入（很少发生，直接在锁内压缩）
+                    blob = self.compress(content)
+            if blob is not None:
+                codec, dict_id, data = blob
+                cursor = self._conn.execute('''
+                    INSERT OR IGNORE INTO snapshot_blobs
+                    (content_hash, codec, dict_id, raw_size, stored_size, last_access, data)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (content_hash, codec, dict_id, len(content), len(data), now, data))
+                if cursor.rowcount:
+                    self.total_bytes += len(data)
+                    self.stats['stored'] += 1
+                    self.stats['raw_bytes'] += len(content)
+                    self.stats['stored_bytes'] += len(data)
+            
+            self._conn.execute('''
+                INSERT INTO snapshot_refs
+                (domain, url, fetch, status_code, content_hash, final_url, encoding, truncated, captured_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (domain, fetched.get('url'), fetch, fetched.get('status_code'), content_hash,
+                  fetched.get('final_url'), fetched.get('encoding'), bool(fetched.get('truncated')), captured_at))
+            self._apply_retention(domain, fetch)
+            self._evict()
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._commit()
+        return content_hash
+    
+    def _collect_sample(self, content):
+        """收集训练样本，达到数量后由收集到最后一个样本的线程训练压缩字典（训练期间其他线程照常写入）"""
+        if zstandard is None or self._dicts:
+            return
+        with self._lock:
+            if self._dicts or self._training:
+                return
+            self._samples.append(content)
+            if len(self._samples) < self.dict_samples:
+                return
+            samples, self._samples = self._samples, []
+            self._training = True
+        try:
+            self.train_dictionary(samples)
+        finally:
+            with self._lock:
+                self._training = False
+    
+    def train_dictionary(self, samples=None):
+        """用样本（默认取库中最近的快照）训练新的压缩字典，之后的快照使用新字典；返回字典ID
+        
+        训练在锁外进行（耗时较长），只有保存和启用字典时加锁
+        """
+        if zstandard is None:
+            return 0
+        if samples is None:
+            samples = [content for ref, content in self.iter_snapshots(limit=self.dict_samples)]
+        try:
+            trained = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+        except zstandard.ZstdError:
+            return self.dict_id  # 样本太少或太小
+        with self._lock:
+            dict_id = self._conn.execute('INSERT INTO snapshot_dicts (data, created_at) VALUES (?, ?)',
+                                         (trained.as_bytes(), datetime.now())).lastrowid
+            self._conn.commit()
+            dicts = dict(self._dicts)
+            dicts[dict_id] = trained
+            self._dicts = dicts
+            return dict_id
+    
+    def _apply_retention(self, domain, fetch):
+        """每个域名（普通用户、爬虫分别计算）只保留最近keep_per_domain次快照，不再被引用的响应体一并删除"""
+        if not self.keep_per_domain:
+            return
+        stale = self._conn.execute('''
+            SELECT id, content_hash FROM snapshot_refs WHERE domain = ? AND fetch = ?
+            ORDER BY captured_at DESC, id DESC LIMIT -1 OFFSET ?
+        ''', (domain, fetch, self.keep_per_domain)).fetchall()
+        if not stale:
+            return
+        self._conn.executemany('DELETE FROM snapshot_refs WHERE id = ?', [(ref_id,) for ref_id, _ in stale])
+        for content_hash in {content_hash for _, content_hash in stale}:
+            self._delete_if_unreferenced(content_hash)
+    
+    def _delete_if_unreferenced(self, content_hash):
+        if self._conn.execute('SELECT 1 FROM snapshot_refs WHERE content_hash = ? LIMIT 1',
+                              (content_hash,)).fetchone():
+            return
+        row = self._conn.execute('SELECT stored_size FROM snapshot_blobs WHERE content_hash = ?',
+                                 (content_hash,)).fetchone()
+        if row:
+            self._conn.execute('DELETE FROM snapshot_blobs WHERE content_hash = ?', (content_hash,))
+            self.total_bytes -= row[0]
+    
+    def _evict(self):
+        """总大小超过上限时按最近访问时间淘汰响应体（及其引用）"""
+        if not self.max_bytes or self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9  # 一次多淘汰一些，避免每次写入都触发
+        # 每次只按idx_blobs_access取最旧的一小批，不把整张表读进内存，也不在打开的游标上删除
+        while self.total_bytes > target:
+            rows = self._conn.execute('SELECT content_hash, stored_size FROM snapshot_blobs ORDER BY last_access LIMIT ?',
+                                      (EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for content_hash, stored_size in rows:
+                if self.total_bytes <= target:
+                    break
+                self._conn.execute('DELETE FROM snapshot_refs WHERE content_hash = ?', (content_hash,))
+                self._conn.execute('DELETE FROM snapshot_blobs WHERE content_hash = ?', (content_hash,))
+                self.total_bytes -= stored_size
+                self.stats['evicted'] += 1
+    
+    def get(self, content_hash):
+        """读取响应体，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute('SELECT codec, dict_id, data FROM snapshot_blobs WHERE content_hash = ?',
+                                     (content_hash,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE snapshot_blobs SET last_access = ? WHERE content_hash = ?',
+                               (datetime.now(), content_hash))
+        return self.decompress(*row)
+    
+    def iter_snapshots(self, since=None, limit=None, latest_only=False):
+        """按时间倒序遍历快照，产出(引用信息dict, 响应体)；批量重新分析时使用（不更新访问时间）
+        
+        latest_only为True时每个域名只取最近一次检测；按idx_refs_captured的顺序读取，
+        不需要先把所有行（连同响应体）排序，第一行立即产出
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('r.captured_at >= ?')
+            params.append(since)
+        if latest_only:
+            conditions.append('r.captured_at = (SELECT MAX(captured_at) FROM snapshot_refs x WHERE x.domain = r.domain)')
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        query = f'''
+            SELECT r.id, r.domain, r.url, r.fetch, r.status_code, r.content_hash, r.final_url, r.encoding,
+                   r.truncated, r.captured_at, b.codec, b.dict_id, b.data
+            FROM snapshot_refs r JOIN snapshot_blobs b ON b.content_hash = r.content_hash
+            {where}
+            ORDER BY r.captured_at DESC, r.domain, r.id
+        '''
+        if limit:
+            query += f' LIMIT {int(limit)}'
+        # 单独的只读连接，遍历过程中不阻塞写入
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for row in conn.execute(query, params):
+                ref = dict(zip(('id', 'domain', 'url', 'fetch', 'status_code', 'content_hash', 'final_url',
+                                'encoding', 'truncated', 'captured_at'), row[:10]))
+                yield ref, self.decompress(*row[10:])
+        finally:
+            conn.close()
+    
+    def iter_captures(self, since=None, latest_only=False):
+        """按检测遍历快照，产出(域名, 检测时间, {fetch: 下载结果})，下载结果与fetch_page格式相同"""
+        current, fetches = None, {}
+        for ref, content in self.iter_snapshots(since=since, latest_only=latest_only):
+            key = (ref['domain'], ref['captured_at'])
+            if key != current:
+                if fetches:
+                    yield current[0], current[1], fetches
+                current, fetches = key, {}
+            fetches[ref['fetch']] = {
+                'url': ref['url'],
+                'status_code': ref['status_code'],
+                'content': content,
+                'content_hash': ref['content_hash'],
+                'final_url': ref['final_url'],
+                'encoding': ref['encoding'],
+                'truncated': bool(ref['truncated'])
+            }
+        if fetches:
+            yield current[0], current[1], fetches
+    
+    def _commit(self):
+        self._conn.commit()
+        self._uncommitted = 0
+    
+    def flush(self):
+        """提交尚未写入磁盘的快照"""
+        with self._lock:
+            if self._conn is not None:
+                self._commit()
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._commit()
+                self._conn.close()
+                self._conn = None
+    
+    def summary(self):
+        """压缩与去重统计"""
+        ratio = self.stats['stored_bytes'] / self.stats['raw_bytes'] * 100 if self.stats['raw_bytes'] else 0.0
+        return (f"快照 新增 {self.stats['stored']} 个，去重 {self.stats['deduplicated']} 次，"
+                f"压缩后为原始大小的 {ratio:.1f}%，库大小 {self.total_bytes / (1024 * 1024):.1f} MB")
+
+if __name__ == "__main__":
+    # 测试代码：模拟多站点多次复检，比较zlib、无字典zstd与字典zstd的压缩率和读取速度
+    import os
+    import time
+    import tempfile
+    import hashlib
+    from random import Random
+    from html_parsers import SAMPLE_PAGES
+    
+    templates = list(SAMPLE_PAGES.values())
+    
+    def page(site, day):
+        base = templates[site % len(templates)]
+        rng = Random(f'{site}-{day if site % 3 else 0}')  # 三分之一的站点每次复检内容不变
+        items = ''.join(f'<li class="item"><a href="/p/{site}-{i}">商品{rng.randint(1, 999)}</a>'
+                        f'<span class="price">{rng.randint(10, 999)}元</span></li>' for i in range(60))
+        nav = ''.join(f'<a class="nav" href="/c/{i}">栏目{i}</a>' for i in range(20))
+        return base.replace('<body>', f'<body><div id="nav">{nav}</div><ul>{items}</ul>').encode('utf-8')
+    
+    corpus = [(f'site{site}.com', page(site, day)) for day in range(3) for site in range(400)]
+    raw = sum(len(content) for _, content in corpus)
+    print(f"页面 {len(corpus)} 个，原始大小 {raw / 1024:.0f} KB")
+    
+    zlib_size = sum(len(zlib.compress(content, 6)) for _, content in corpus)
+    print(f"zlib逐页压缩: {zlib_size / raw * 100:.1f}%")
+    if zstandard is not None:
+        plain = zstandard.ZstdCompressor(level=10)
+        print(f"zstd无字典: {sum(len(plain.compress(content)) for _, content in corpus) / raw * 100:.1f}%")
+    
+    store = SnapshotStore(os.path.join(tempfile.mkdtemp(), 'snapshots.db'), keep_per_domain=2, dict_samples=200)
+    for domain, content in corpus:
+        store.put(domain, {'url': f'http://{domain}', 'content': content, 'final_url': f'http://{domain}/',
+                           'content_hash': hashlib.md5(content).hexdigest(), 'encoding': 'utf-8'})
+    store.flush()
+    print(f"快照库({store.codec}): {store.summary()}")
+    
+    start = time.perf_counter()
+    count = sum(1 for _ in store.iter_snapshots())
+    elapsed = time.perf_counter() - start
+    print(f"批量读取: {count} 个快照 {elapsed * 1000:.0f} ms ({count / elapsed:.0f} 个/秒)")
+    store.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K站工具 虚拟表格
+全部行保存在列表中，Treeview中只创建当前可见的几十行，滚动时替换这些行的内容；
+表格行数再多，插入和滚动的开销也只与可见行数有关
+"""
+
+import tkinter as tk
+from tkinter import ttk
+
+class VirtualTreeview:
+    """只渲染可见行的Treeview（行号即数据下标）"""
+    
+    def __init__(self, parent, columns, height=15, column_width=120):
+        self.rows = []
+        self.first = 0  # 第一个可见行的下标
+        self.page_size = height
+        self.follow = True  # 滚动到底部时新行到达后自动跟随
+        self.frame = ttk.Frame(parent)
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(0, weight=1)
+        
+        self.tree = ttk.Treeview(self.frame, columns=columns, show='headings', height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=column_width)
+        
+        # 纵向滚动条由本类按数据行数控制，横向滚动条直接交给Treeview
+        self.scrollbar_y = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar_x = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.scrollbar_x.set)
+        
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(-1 if event.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(1, 'units'))
+        self.tree.bind('<Prior>', lambda event: self.scroll(-1, 'pages'))
+        self.tree.bind('<Next>', lambda event: self.scroll(1, 'pages'))
+    
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+    
+    def bind(self, sequence, func):
+        self.tree.bind(sequence, func)
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def append(self, rows):
+        """追加多行（一次刷新）"""
+        if not rows:
+            return
+        self.rows.extend(rows)
+        if self.follow:
+            self.first = max(0, len(self.rows) - self.page_size)
+        self._render()
+    
+    def clear(self):
+        self.rows = []
+        self.first = 0
+        self.follow = True
+        self._render()
+    
+    def selected_index(self):
+        """当前选中行的数据下标，没有选中时返回None"""
+        selection = self.tree.selection()
+        return int(selection[0]) if selection else None
+    
+    def scroll(self, amount, what='units'):
+        step = amount * (self.page_size if what == 'pages' else 3)
+        self._scroll_to(self.first + step)
+        return 'break'
+    
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self._scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]), args[2])
+    
+    def _scroll_to(self, first):
+        last_page = max(0, len(self.rows) - self.page_size)
+        first = max(0, min(first, last_page))
+        self.follow = first >= last_page
+        if first != self.first:
+            self.first = first
+            self._render()
+    
+    def _on_resize(self, event):
+        row_height = ttk.Style().lookup('Treeview', 'rowheight') or 20
+        page_size = max(1, int(event.height) // int(row_height) - 1)  # 减去标题行
+        if page_size != self.page_size:
+            self.page_size = page_size
+            if self.follow:
+                self.first = max(0, len(self.rows) - self.page_size)
+            self._render()
+    
+    def _render(self):
+        """用可见范围内的行替换Treeview中的内容，保持选中的数据行"""
+        selected = self.selected_index()
+        self.tree.delete(*self.tree.get_children())
+        last = min(len(self.rows), self.first + self.page_size)
+        for index in range(self.first, last):
+            self.tree.insert('', 'end', iid=str(index), values=self.rows[index])
+        if selected is not None and self.first <= selected < last:
+            self.tree.selection_set(str(selected))
+        
+        if self.rows:
+            self.scrollbar_y.set(self.first / len(self.rows), last / len(self.rows))
+        else:
+            self.scrollbar_y.set(0, 1)